@@ -0,0 +1,194 @@
+import hashlib
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from typing import Mapping, Optional
+from urllib.parse import urlsplit
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DailyClicks, HourlyClicks, ReferrerClicks
+from . import redis
+
+_HOURLY_KEY = 'stats:hourly:{}'
+_DAILY_KEY = 'stats:daily:{}'
+_VISITORS_KEY = 'stats:visitors:{}:{}'
+_REFERRERS_KEY = 'stats:referrers:{}'
+_DIRTY_KEY = 'stats:dirty'
+
+_HOUR_FORMAT = '%Y%m%d%H'
+_DAY_FORMAT = '%Y%m%d'
+
+# Buckets older than these are compacted into the DB and dropped from Redis
+_HOURLY_RETENTION = timedelta(hours=48)
+_DAILY_RETENTION = timedelta(days=2)
+_VISITORS_TTL = timedelta(days=3)
+
+HOURS_REPORTED = 48
+# Referrers past these many are dropped at compaction, so a slug linked from everywhere keeps a
+# bounded sorted set
+REFERRERS_REPORTED = 20
+DIRECT = '(direct)'
+
+
+def track(pipeline, slug: str, meta: Mapping[str, str], now: Optional[datetime] = None) -> None:
+    """Queues updating the click buckets of `slug` on a Redis pipeline.
+
+    `meta` is `HttpRequest.META` or a WSGI environ of the click request.
+    """
+    now = now or timezone.now()
+    day = now.strftime(_DAY_FORMAT)
+    visitors_key = _VISITORS_KEY.format(slug, day)
+    pipeline.hincrby(_HOURLY_KEY.format(slug), now.strftime(_HOUR_FORMAT), 1)
+    pipeline.hincrby(_DAILY_KEY.format(slug), day, 1)
+    pipeline.pfadd(visitors_key, _visitor(meta))
+    pipeline.expire(visitors_key, _VISITORS_TTL)
+    pipeline.zincrby(_REFERRERS_KEY.format(slug), 1, _referrer(meta))
+    pipeline.sadd(_DIRTY_KEY, slug)
+
+
+def forget(pipeline, slugs: list[str], now: Optional[datetime] = None) -> None:
+    """Deletes the compacted click buckets of `slugs` and queues deleting the live ones on a
+    Redis pipeline, e.g. before the slugs are freed for new short URLs."""
+    now = now or timezone.now()
+    HourlyClicks.objects.filter(slug__in=slugs).delete()
+    DailyClicks.objects.filter(slug__in=slugs).delete()
+    ReferrerClicks.objects.filter(slug__in=slugs).delete()
+    days = [(now - timedelta(days=i)).strftime(_DAY_FORMAT) for i in range(_VISITORS_TTL.days + 1)]
+    for slug in slugs:
+        pipeline.delete(_HOURLY_KEY.format(slug), _DAILY_KEY.format(slug),
+                        _REFERRERS_KEY.format(slug),
+                        *(_VISITORS_KEY.format(slug, day) for day in days))
+    pipeline.srem(_DIRTY_KEY, *slugs)
+
+
+def _visitor(meta: Mapping[str, str]) -> bytes:
+    forwarded_for = meta.get('HTTP_X_FORWARDED_FOR', '')
+    ip = forwarded_for.split(',')[0].strip() or meta.get('REMOTE_ADDR', '')
+    return hashlib.blake2b(f'{ip} {meta.get("HTTP_USER_AGENT", "")}'.encode(),
+                           digest_size=8).digest()
+
+
+def _referrer(meta: Mapping[str, str]) -> str:
+    host = urlsplit(meta.get('HTTP_REFERER', '')).hostname
+    return host[:ReferrerClicks._meta.get_field('referrer').max_length] if host else DIRECT
+
+
+def compact(batch_size: int = 1000) -> int:
+    """Stores the buckets of the slugs clicked since the last compaction in the DB.
+    Returns the number of compacted slugs."""
+    compacted = 0
+    for _ in range(-(-redis.redis.scard(_DIRTY_KEY) // batch_size)):
+        slugs = [slug.decode() for slug in redis.redis.spop(_DIRTY_KEY, batch_size)]
+        try:
+            _compact(slugs)
+        except BaseException:
+            redis.redis.sadd(_DIRTY_KEY, *slugs)
+            raise
+        compacted += len(slugs)
+    return compacted
+
+
+def _compact(slugs: list[str]) -> None:
+    now = timezone.now()
+    pipeline = redis.redis.pipeline(transaction=False)
+    for slug in slugs:
+        pipeline.hgetall(_HOURLY_KEY.format(slug))
+        pipeline.hgetall(_DAILY_KEY.format(slug))
+        pipeline.zrevrange(_REFERRERS_KEY.format(slug), 0, -1, withscores=True)
+    buckets = pipeline.execute()
+
+    hourly_rows, daily_counts, referrer_rows, dropped_referrers = [], [], [], {}
+    for slug, hourly, daily, referrers in zip(slugs, buckets[::3], buckets[1::3], buckets[2::3]):
+        hourly_rows += [HourlyClicks(slug=slug, hour=_parse_hour(hour), clicks=int(clicks))
+                        for hour, clicks in hourly.items()]
+        daily_counts += [(slug, day.decode(), int(clicks)) for day, clicks in daily.items()]
+        referrer_rows += [ReferrerClicks(slug=slug, referrer=referrer.decode(), clicks=int(clicks))
+                          for referrer, clicks in referrers[:REFERRERS_REPORTED]]
+        if len(referrers) > REFERRERS_REPORTED:
+            dropped_referrers[slug] = [referrer.decode()
+                                       for referrer, _ in referrers[REFERRERS_REPORTED:]]
+
+    for slug, day, _ in daily_counts:
+        pipeline.pfcount(_VISITORS_KEY.format(slug, day))
+    visitors = pipeline.execute()
+    # Visitors of days long gone are not known anymore, their rows are complete already
+    daily_rows = [DailyClicks(slug=slug, day=_parse_day(day), clicks=clicks, unique_visitors=count)
+                  for (slug, day, clicks), count in zip(daily_counts, visitors) if count]
+
+    with transaction.atomic():
+        HourlyClicks.objects.bulk_create(hourly_rows, update_conflicts=True,
+                                         unique_fields=['slug', 'hour'], update_fields=['clicks'])
+        DailyClicks.objects.bulk_create(daily_rows, update_conflicts=True,
+                                        unique_fields=['slug', 'day'],
+                                        update_fields=['clicks', 'unique_visitors'])
+        ReferrerClicks.objects.bulk_create(referrer_rows, update_conflicts=True,
+                                           unique_fields=['slug', 'referrer'],
+                                           update_fields=['clicks'])
+        # Their counts start over if they come back, like those of a referrer never seen
+        for slug, referrers in dropped_referrers.items():
+            ReferrerClicks.objects.filter(slug=slug, referrer__in=referrers).delete()
+
+    oldest_hour = (now - _HOURLY_RETENTION).strftime(_HOUR_FORMAT)
+    oldest_day = (now - _DAILY_RETENTION).strftime(_DAY_FORMAT)
+    for row in hourly_rows:
+        if row.hour.strftime(_HOUR_FORMAT) < oldest_hour:
+            pipeline.hdel(_HOURLY_KEY.format(row.slug), row.hour.strftime(_HOUR_FORMAT))
+    for slug, day, _ in daily_counts:
+        if day < oldest_day:
+            pipeline.hdel(_DAILY_KEY.format(slug), day)
+    for slug in dropped_referrers:
+        pipeline.zremrangebyrank(_REFERRERS_KEY.format(slug), 0, -REFERRERS_REPORTED - 1)
+    pipeline.execute()
+
+
+def _parse_hour(hour: bytes) -> datetime:
+    return datetime.strptime(hour.decode(), _HOUR_FORMAT).replace(tzinfo=dt_timezone.utc)
+
+
+def _parse_day(day: str) -> date:
+    return datetime.strptime(day, _DAY_FORMAT).date()
+
+
+def stats(slug: str, days: int = 30, now: Optional[datetime] = None) -> dict:
+    """Returns click counts of the last `days` days and `HOURS_REPORTED` hours, unique visitors
+    per day and the top `REFERRERS_REPORTED` referrers of `slug`, merging the compacted buckets
+    with the live ones."""
+    now = now or timezone.now()
+    first_hour = (now - timedelta(hours=HOURS_REPORTED - 1)).replace(minute=0, second=0,
+                                                                   microsecond=0)
+    first_day = (now - timedelta(days=days - 1)).date()
+    live_days = [(now - timedelta(days=i)).strftime(_DAY_FORMAT)
+                 for i in range(min(days, _VISITORS_TTL.days))]
+
+    pipeline = redis.redis.pipeline(transaction=False)
+    pipeline.hgetall(_HOURLY_KEY.format(slug))
+    pipeline.hgetall(_DAILY_KEY.format(slug))
+    pipeline.zrevrange(_REFERRERS_KEY.format(slug), 0, REFERRERS_REPORTED - 1, withscores=True)
+    for day in live_days:
+        pipeline.pfcount(_VISITORS_KEY.format(slug, day))
+    live_hourly, live_daily, live_referrers, *live_visitors = pipeline.execute()
+
+    hourly = dict(HourlyClicks.objects.filter(slug=slug, hour__gte=first_hour)
+                  .values_list('hour', 'clicks'))
+    hourly.update((_parse_hour(hour), int(clicks)) for hour, clicks in live_hourly.items())
+    daily = {day: (clicks, visitors) for day, clicks, visitors
+             in DailyClicks.objects.filter(slug=slug, day__gte=first_day)
+             .values_list('day', 'clicks', 'unique_visitors')}
+    visitors_by_day = dict(zip(live_days, live_visitors))
+    for day, clicks in live_daily.items():
+        day = day.decode()
+        if day in visitors_by_day:
+            daily[_parse_day(day)] = (int(clicks), visitors_by_day[day])
+    referrers = dict(ReferrerClicks.objects.filter(slug=slug).order_by('-clicks')
+                     .values_list('referrer', 'clicks')[:REFERRERS_REPORTED])
+    referrers.update((referrer.decode(), int(clicks)) for referrer, clicks in live_referrers)
+
+    return {
+        'hourly': [{'hour': hour, 'clicks': clicks}
+                   for hour, clicks in sorted(hourly.items()) if hour >= first_hour],
+        'daily': [{'day': day, 'clicks': clicks, 'unique_visitors': visitors}
+                  for day, (clicks, visitors) in sorted(daily.items()) if day >= first_day],
+        'referrers': [{'referrer': referrer, 'clicks': clicks} for referrer, clicks
+                      in sorted(referrers.items(), key=lambda item: item[1],
+                                reverse=True)[:REFERRERS_REPORTED]],
+    }
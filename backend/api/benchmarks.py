@@ -0,0 +1,154 @@
+import contextlib
+import time
+import uuid
+from typing import Callable, Iterator, Optional
+from unittest.mock import patch
+from wsgiref.util import setup_testing_defaults
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, \
+    teardown_test_environment
+from fakeredis import FakeAsyncRedis, FakeRedis, FakeServer
+
+from .fastpath import RedirectFastPath
+from .models import ShortUrl, SlugCounter
+from . import cache, redis, shorten, slugs
+
+URL = 'http://example.com'
+USER_ID = uuid.UUID(int=0)
+
+
+class Result:
+    def __init__(self, name: str, timings_ns: list[int]):
+        self.name = name
+        self.timings_ns = sorted(timings_ns)
+
+    @property
+    def ops_per_sec(self) -> float:
+        return len(self.timings_ns) / (sum(self.timings_ns) / 1e9)
+
+    def percentile_us(self, percent: float) -> float:
+        index = min(len(self.timings_ns) - 1, int(len(self.timings_ns) * percent / 100))
+        return self.timings_ns[index] / 1000
+
+    def as_dict(self) -> dict[str, float]:
+        return {'ops_per_sec': self.ops_per_sec, 'p50_us': self.percentile_us(50),
+                'p95_us': self.percentile_us(95), 'p99_us': self.percentile_us(99)}
+
+
+def measure(name: str, operation: Callable[[int], None], iterations: int,
+            setup: Optional[Callable[[int], None]] = None) -> Result:
+    """Times `operation(i)` for every i in range(iterations), calling `setup(i)` untimed before.
+
+    A tenth of the iterations is run first to warm up, with the i following the timed ones, so
+    that the keys timed are not touched before, see `warmed_up()`.
+    """
+    timings = []
+    for i in [*range(iterations, warmed_up(iterations)), *range(iterations)]:
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter_ns()
+        operation(i)
+        elapsed = time.perf_counter_ns() - start
+        if i < iterations:
+            timings.append(elapsed)
+    return Result(name, timings)
+
+
+def warmed_up(iterations: int) -> int:
+    """Returns the number of times `measure()` calls the operation, warm-up included."""
+    return iterations + iterations // 10
+
+
+@contextlib.contextmanager
+def environment() -> Iterator[None]:
+    """Runs the benchmarks against a throwaway test database and an in-memory fake Redis.
+
+    Only the default database gets a test database, so shards and replicas are switched off.
+    """
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    server = FakeServer()
+    try:
+        with override_settings(SHORTURL_SHARDS=['default'], SHORTURL_PREVIOUS_SHARD_COUNT=None,
+                               REPLICA_DATABASES={}), \
+                patch.object(redis, 'redis', FakeRedis(server=server)), \
+                patch.object(redis, 'aredis', FakeAsyncRedis(server=server)):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        cache.local_cache.clear()
+
+
+def _seed(prefix: str, iterations: int) -> list[str]:
+    slug_list = [f'{prefix}{i}' for i in range(warmed_up(iterations))]
+    ShortUrl.objects.bulk_create([ShortUrl(slug=slug, url=URL, user_id=USER_ID)
+                                  for slug in slug_list])
+    return slug_list
+
+
+def bench_shorten(iterations: int) -> Iterator[Result]:
+    yield measure('shorten', lambda i: shorten.shorten(f'shorten{i}', URL, USER_ID), iterations)
+
+
+def bench_unshorten(iterations: int) -> Iterator[Result]:
+    slug_list = _seed('unshorten', iterations)
+
+    def evict_everywhere(i):
+        cache.local_cache.clear()
+        cache.slug_cache.delete(slug_list[i])
+
+    yield measure('unshorten (miss)', lambda i: shorten.unshorten(slug_list[i]), iterations,
+                  setup=evict_everywhere)
+    yield measure('unshorten (redis hit)', lambda i: shorten.unshorten(slug_list[i]), iterations,
+                  setup=lambda i: cache.local_cache.clear())
+    for slug in slug_list:
+        shorten.unshorten(slug)
+    yield measure('unshorten (local hit)', lambda i: shorten.unshorten(slug_list[i]), iterations)
+
+
+def bench_generate_unique_slug(iterations: int) -> Iterator[Result]:
+    length = 4
+    for fill_ratio in (0, 0.5, 0.9, 0.99):
+        SlugCounter.objects.update_or_create(
+            length=length, defaults={'next_value': int(slugs.capacity(length) * fill_ratio)})
+        generator = slugs.SlugGenerator('benchmark')
+        yield measure(f'generate_unique_slug ({fill_ratio:.0%} full)',
+                      lambda i: generator.generate(length), iterations)
+
+
+def bench_views(iterations: int) -> Iterator[Result]:
+    slug_list = _seed('view', iterations)
+    client = Client()
+    yield measure('shorten_view', lambda i: client.post('/api/shorten/', {'url': URL}), iterations)
+    yield measure('redirect_view', lambda i: client.get(f'/{slug_list[i]}'), iterations)
+
+    fast_path = RedirectFastPath(lambda environ, start_response: [])
+
+    def redirect(i):
+        environ = {'PATH_INFO': f'/{slug_list[i]}'}
+        setup_testing_defaults(environ)
+        fast_path(environ, lambda status, headers: None)
+
+    yield measure('redirect (fast path)', redirect, iterations)
+
+
+BENCHMARKS = [bench_shorten, bench_unshorten, bench_generate_unique_slug, bench_views]
+
+
+def compare(results: list[Result], baseline: dict[str, dict[str, float]],
+            tolerance: float) -> list[str]:
+    """Returns descriptions of the results slower than the baseline by more than `tolerance`."""
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+        old, new = baseline[result.name], result.as_dict()
+        if new['ops_per_sec'] < old['ops_per_sec'] * (1 - tolerance):
+            regressions.append(f'{result.name}: {old["ops_per_sec"]:.0f} -> '
+                               f'{new["ops_per_sec"]:.0f} ops/sec')
+        if new['p95_us'] > old['p95_us'] * (1 + tolerance):
+            regressions.append(f'{result.name}: p95 {old["p95_us"]:.1f} -> {new["p95_us"]:.1f} us')
+    return regressions
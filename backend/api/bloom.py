@@ -0,0 +1,80 @@
+import hashlib
+from typing import Iterable
+
+from django.conf import settings
+
+from . import redis
+
+
+class BloomFilter:
+    """Bloom filter stored as a Redis bitmap, shared by all worker processes.
+
+    The bit right after the filter is a sentinel set only by `rebuild()`. Until it is set
+    (e.g. the filter has never been built or Redis lost it) `might_contain()` answers True
+    for everything, so an incomplete filter never hides existing items.
+    """
+
+    def __init__(self, key: str, size: int = 2 ** 24, hashes: int = 7):
+        self.key = key
+        self.size = size
+        self.hashes = hashes
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def might_contain(self, item: str) -> bool:
+        return self.might_contain_many([item])[0]
+
+    def might_contain_many(self, items: list[str]) -> list[bool]:
+        pipeline = redis.redis.pipeline(transaction=False)
+        self._queue_lookups(pipeline, items)
+        return self._lookup_results(items, pipeline.execute())
+
+    async def amight_contain(self, item: str) -> bool:
+        pipeline = redis.aredis.pipeline(transaction=False)
+        self._queue_lookups(pipeline, [item])
+        return self._lookup_results([item], await pipeline.execute())[0]
+
+    def _queue_lookups(self, pipeline, items: list[str]) -> None:
+        pipeline.getbit(self.key, self.size)
+        for item in items:
+            for position in self._positions(item):
+                pipeline.getbit(self.key, position)
+
+    def _lookup_results(self, items: list[str], results: list[int]) -> list[bool]:
+        ready, *bits = results
+        if not ready:
+            return [True] * len(items)
+        return [all(bits[i:i + self.hashes]) for i in range(0, len(bits), self.hashes)]
+
+    def add(self, *items: str, pipeline=None) -> None:
+        """Adds the items, queuing the commands on `pipeline` if one is given."""
+        own_pipeline = pipeline is None
+        if own_pipeline:
+            pipeline = redis.redis.pipeline(transaction=False)
+        for item in items:
+            for position in self._positions(item):
+                pipeline.setbit(self.key, position, 1)
+        if own_pipeline:
+            pipeline.execute()
+
+    def rebuild(self, items: Iterable[str]) -> int:
+        """Replaces the filter with one containing exactly `items`. Returns the item count."""
+        bits = bytearray(self.size // 8 + 1)
+        count = 0
+        for item in items:
+            for position in self._positions(item):
+                bits[position >> 3] |= 0x80 >> (position & 7)
+            count += 1
+        bits[self.size >> 3] |= 0x80 >> (self.size & 7)
+
+        new_key = f'{self.key}:new'
+        redis.redis.set(new_key, bytes(bits))
+        redis.redis.rename(new_key, self.key)
+        return count
+
+
+slug_filter = BloomFilter('bloom:slugs', **getattr(settings, 'SLUG_BLOOM_FILTER', {}))
@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional
+
+from django.conf import settings
+
+from . import redis
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+_FILL_LOCK_KEY = 'fill:{}'
+
+
+class LocalCache:
+    """Bounded in-process LRU cache whose entries expire after `ttl` seconds.
+
+    Each worker process holds its own instance, so cached values may lag behind the shared
+    Redis cache by up to `ttl` seconds unless they are invalidated explicitly.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+local_cache = LocalCache(**getattr(settings, 'LOCAL_SLUG_CACHE', {}))
+
+
+def encode(url: str, expires_at: Optional[datetime] = None) -> str:
+    """Returns the cached value of a short URL. The expiry, if any, precedes the URL as a Unix
+    timestamp, which cannot be mistaken for a URL starting with its scheme."""
+    return url if expires_at is None else f'{int(expires_at.timestamp())} {url}'
+
+
+def decode(value: str) -> str:
+    """Returns the URL of a cached value, or "" for a slug known not to exist or expired."""
+    if not value[:1].isdigit():
+        return value
+    expires_at, url = value.split(' ', 1)
+    return url if time.time() < int(expires_at) else ''
+
+
+class SlugCache:
+    """Slug -> URL entries in Redis shared by all workers. An empty URL marks a slug known not
+    to exist. Values of expiring short URLs carry their expiry, see `encode()`.
+
+    Entries expire `ttl` seconds after they were written or last refreshed, and a hit refreshes
+    an entry once it is past half of its TTL, so popular slugs stay cached while the rest
+    expire. `ttl=0` keeps entries forever. Negative entries expire after `negative_ttl` seconds
+    and are never refreshed.
+
+    With `buckets` > 0, entries are fields of that many Redis hashes instead of top-level keys.
+    Hashes under hash-max-listpack-entries fields and hash-max-listpack-value bytes per URL are
+    stored as compact listpacks, without the per-key overhead. Field TTLs need Redis 7.4. Under
+    memory pressure, Redis evicts whole buckets.
+    """
+
+    def __init__(self, ttl: int = 7 * 86400, negative_ttl: int = 30, buckets: int = 0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.buckets = buckets
+
+    def location(self, slug: str) -> tuple[str, Optional[str]]:
+        """Returns the key and the hash field, if any, of the entry of `slug`."""
+        if not self.buckets:
+            return slug, None
+        # Hashing spreads custom slugs sharing a prefix evenly over the buckets
+        return f'b:{zlib.crc32(slug.encode()) % self.buckets}', slug
+
+    def _queue_get(self, pipeline, slug: str) -> None:
+        key, field = self.location(slug)
+        if field is None:
+            pipeline.get(key)
+            if self.ttl:
+                pipeline.ttl(key)
+        else:
+            pipeline.hget(key, field)
+            if self.ttl:
+                pipeline.httl(key, field)
+
+    def _entries(self, slugs: list[str], results: list, refresh_pipeline) -> list[Optional[str]]:
+        """Decodes looked up entries, queueing refreshes of the hits past half of their TTL."""
+        step = 2 if self.ttl else 1
+        entries = []
+        for i, slug in enumerate(slugs):
+            value = results[i * step]
+            entries.append(None if value is None else value.decode())
+            if not self.ttl or not entries[-1] or not decode(entries[-1]):
+                continue
+            ttl = results[i * step + 1]
+            ttl = ttl[0] if isinstance(ttl, list) else ttl
+            # -1 is no TTL, e.g. of an entry cached before TTLs were configured
+            if -1 <= ttl < self.ttl / 2:
+                self._queue_expire(refresh_pipeline, slug, self.ttl)
+        return entries
+
+    def get(self, slug: str) -> Optional[str]:
+        """Returns the cached value of `slug`, "" if it is known not to exist, or None."""
+        return self.get_many([slug])[0]
+
+    def get_many(self, slugs: list[str]) -> list[Optional[str]]:
+        pipeline = redis.redis.pipeline(transaction=False)
+        for slug in slugs:
+            self._queue_get(pipeline, slug)
+        refresh = redis.redis.pipeline(transaction=False)
+        entries = self._entries(slugs, pipeline.execute(), refresh)
+        if len(refresh):
+            refresh.execute()
+        return entries
+
+    async def aget(self, slug: str) -> Optional[str]:
+        """Asynchronous `get()` for ASGI workers."""
+        pipeline = redis.aredis.pipeline(transaction=False)
+        self._queue_get(pipeline, slug)
+        refresh = redis.aredis.pipeline(transaction=False)
+        entry = self._entries([slug], await pipeline.execute(), refresh)[0]
+        if len(refresh):
+            await refresh.execute()
+        return entry
+
+    def _queue_expire(self, pipeline, slug: str, ttl: int) -> None:
+        key, field = self.location(slug)
+        if field is None:
+            pipeline.expire(key, ttl)
+        else:
+            pipeline.hexpire(key, ttl, field)
+            self._queue_bucket_expire(pipeline, key)
+
+    def _queue_write(self, pipeline, slug: str, url: str, ttl: int) -> None:
+        key, field = self.location(slug)
+        if field is None:
+            pipeline.set(key, url, ex=ttl or None)
+        else:
+            pipeline.hset(key, field, url)
+            if ttl:
+                pipeline.hexpire(key, ttl, field)
+            else:
+                pipeline.hpersist(key, field)
+            self._queue_bucket_expire(pipeline, key)
+
+    def _queue_bucket_expire(self, pipeline, key: str) -> None:
+        # volatile-* eviction policies only evict keys with a TTL, and field TTLs don't count.
+        # Every write and refresh extends the bucket to outlive all of its fields.
+        if self.ttl:
+            pipeline.expire(key, self.ttl)
+
+    def set(self, slug: str, url: str, pipeline=None) -> None:
+        """Caches the URL of `slug`, or a value returned by `encode()`, queueing the commands on
+        `pipeline` if given."""
+        self._write(slug, url, self.ttl, pipeline)
+
+    def set_negative(self, slug: str, pipeline=None) -> None:
+        """Caches that `slug` does not exist."""
+        self._write(slug, '', self.negative_ttl, pipeline)
+
+    def _write(self, slug: str, url: str, ttl: int, pipeline) -> None:
+        if pipeline is not None:
+            self._queue_write(pipeline, slug, url, ttl)
+            return
+        pipeline = redis.redis.pipeline(transaction=False)
+        self._queue_write(pipeline, slug, url, ttl)
+        pipeline.execute()
+
+    async def aset(self, slug: str, url: str) -> None:
+        pipeline = redis.aredis.pipeline(transaction=False)
+        self._queue_write(pipeline, slug, url, self.ttl)
+        await pipeline.execute()
+
+    async def aset_negative(self, slug: str) -> None:
+        pipeline = redis.aredis.pipeline(transaction=False)
+        self._queue_write(pipeline, slug, '', self.negative_ttl)
+        await pipeline.execute()
+
+    def delete(self, *slugs: str, pipeline=None) -> None:
+        own_pipeline = pipeline is None
+        if own_pipeline:
+            pipeline = redis.redis.pipeline(transaction=False)
+        for slug in slugs:
+            key, field = self.location(slug)
+            if field is None:
+                pipeline.delete(key)
+            else:
+                pipeline.hdel(key, field)
+        if own_pipeline:
+            pipeline.execute()
+
+    def lock_fill(self, slug: str, ttl: float) -> bool:
+        """Takes the lock of loading `slug` into the cache for `ttl` seconds, unless another
+        process holds it. The lock is released by `unlock_fill()` once the entry is cached, or
+        expires after `ttl` seconds if its holder dies."""
+        return bool(redis.redis.set(_FILL_LOCK_KEY.format(slug), 1, px=int(ttl * 1000), nx=True))
+
+    async def alock_fill(self, slug: str, ttl: float) -> bool:
+        return bool(await redis.aredis.set(_FILL_LOCK_KEY.format(slug), 1, px=int(ttl * 1000),
+                                           nx=True))
+
+    def unlock_fill(self, slug: str) -> None:
+        redis.redis.delete(_FILL_LOCK_KEY.format(slug))
+
+    async def aunlock_fill(self, slug: str) -> None:
+        await redis.aredis.delete(_FILL_LOCK_KEY.format(slug))
+
+    def wait_for(self, slug: str, timeout: float, interval: float) -> Optional[str]:
+        """Polls the entry of `slug` every `interval` seconds until it is cached or `timeout`
+        seconds have passed. Returns like `get()`."""
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(interval)
+            url = self.get(slug)
+            if url is not None or time.monotonic() >= deadline:
+                return url
+
+    async def await_for(self, slug: str, timeout: float, interval: float) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            await asyncio.sleep(interval)
+            url = await self.aget(slug)
+            if url is not None or time.monotonic() >= deadline:
+                return url
+
+    def is_entry_key(self, key: str) -> bool:
+        """Tells whether a Redis key holds entries. Other keys contain a ":", which slugs cannot,
+        see `shorten.is_valid_slug()`."""
+        return key.startswith('b:') if self.buckets else ':' not in key
+
+    def memory_report(self, samples: int = 1000) -> dict[str, Any]:
+        """Estimates the number of entries and their memory usage from a sample of random keys,
+        along with Redis memory and keyspace statistics."""
+        memory, stats = redis.redis.info('memory'), redis.redis.info('stats')
+        pipeline = redis.redis.pipeline(transaction=False)
+        for _ in range(samples):
+            pipeline.randomkey()
+        keys = {key.decode() for key in pipeline.execute() if key is not None}
+        entry_keys = [key for key in keys if self.is_entry_key(key)]
+
+        pipeline = redis.redis.pipeline(transaction=False)
+        for key in entry_keys:
+            pipeline.memory_usage(key, samples=0)
+            if self.buckets:
+                pipeline.hlen(key)
+                pipeline.object('encoding', key)
+        results = pipeline.execute()
+        step = 3 if self.buckets else 1
+        entry_bytes = sum(usage or 0 for usage in results[::step])
+        entries_per_key = (sum(results[1::step]) / len(entry_keys)
+                           if self.buckets and entry_keys else 1)
+        sampled_entries = entries_per_key * len(entry_keys)
+
+        hits, misses = stats['keyspace_hits'], stats['keyspace_misses']
+        return {
+            'used_memory': memory['used_memory'],
+            'maxmemory': memory['maxmemory'],
+            'maxmemory_policy': memory['maxmemory_policy'],
+            'evicted_keys': stats['evicted_keys'],
+            'expired_keys': stats['expired_keys'],
+            'keyspace_hit_rate': hits / (hits + misses) if hits + misses else None,
+            'entries': (round(redis.redis.dbsize() * sampled_entries / len(keys))
+                        if keys else 0),
+            'bytes_per_entry': entry_bytes / sampled_entries if sampled_entries else None,
+            # Hashes with field TTLs are listpackex
+            'listpack_share': (sum(1 for encoding in results[2::step]
+                                   if encoding in (b'listpack', b'listpackex'))
+                               / len(entry_keys) if self.buckets and entry_keys else None),
+        }
+
+
+slug_cache = SlugCache(negative_ttl=getattr(settings, 'NEGATIVE_CACHE_TTL', 30),
+                       **getattr(settings, 'SLUG_CACHE', {}))
+
+
+def invalidate(*slugs: str, pipeline=None) -> None:
+    """Drops the slugs from the local cache of every worker process, queueing the message on
+    `pipeline` if given."""
+    if not slugs:
+        return
+    for slug in slugs:
+        local_cache.delete(slug)
+    # Slugs never contain spaces, so one message can carry a whole batch
+    (pipeline or redis.redis).publish(INVALIDATION_CHANNEL, ' '.join(slugs))
+
+
+def _on_invalidation(message: dict) -> None:
+    for slug in message['data'].decode().split():
+        local_cache.delete(slug)
+
+
+def _on_listener_error(error: Exception, pubsub, thread) -> None:
+    # Invalidations published while disconnected are lost, so start over with an empty cache
+    logger.warning('Cache invalidation listener failed: %r', error)
+    local_cache.clear()
+    time.sleep(1)
+
+
+def listen_for_invalidations() -> threading.Thread:
+    """Starts a daemon thread applying invalidations published by other workers."""
+    pubsub = redis.redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{INVALIDATION_CHANNEL: _on_invalidation})
+    return pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=_on_listener_error)
@@ -0,0 +1,95 @@
+import uuid
+from datetime import timedelta
+from typing import Mapping
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ClickBatch, ClickStats
+from . import analytics, redis
+
+_PENDING_KEY = 'clicks:pending'
+_FLUSHING_KEY = 'clicks:flushing'
+_BATCH_ID_KEY = 'clicks:flushing:id'
+
+_CHUNK_SIZE = 1000
+_BATCH_RETENTION = timedelta(days=1)
+
+
+def record(slug: str, meta: Mapping[str, str]) -> None:
+    """Counts a click of `slug`. `meta` is `HttpRequest.META` or a WSGI environ of the click."""
+    pipeline = redis.redis.pipeline(transaction=False)
+    pipeline.hincrby(_PENDING_KEY, slug, 1)
+    analytics.track(pipeline, slug, meta)
+    pipeline.execute()
+
+
+async def arecord(slug: str, meta: Mapping[str, str]) -> None:
+    """Asynchronous `record()` for ASGI workers."""
+    pipeline = redis.aredis.pipeline(transaction=False)
+    pipeline.hincrby(_PENDING_KEY, slug, 1)
+    analytics.track(pipeline, slug, meta)
+    await pipeline.execute()
+
+
+def total(slug: str) -> int:
+    """Returns the click count of `slug` including the clicks not flushed to the DB yet."""
+    pipeline = redis.redis.pipeline(transaction=False)
+    pipeline.hget(_PENDING_KEY, slug)
+    pipeline.hget(_FLUSHING_KEY, slug)
+    pending, flushing = pipeline.execute()
+    flushed = ClickStats.objects.filter(slug=slug).values_list('clicks', flat=True).first()
+    return (flushed or 0) + int(pending or 0) + int(flushing or 0)
+
+
+def forget(slugs: list[str]) -> None:
+    """Deletes the click counts and statistics of `slugs`, flushed or not."""
+    if not slugs:
+        return
+    ClickStats.objects.filter(slug__in=slugs).delete()
+    pipeline = redis.redis.pipeline(transaction=False)
+    pipeline.hdel(_PENDING_KEY, *slugs)
+    pipeline.hdel(_FLUSHING_KEY, *slugs)
+    analytics.forget(pipeline, slugs)
+    pipeline.execute()
+
+
+def flush() -> int:
+    """Adds the click counts recorded in Redis to `ClickStats`. Returns the number of slugs.
+
+    The pending counts are first renamed to a separate key under a batch ID. If a flush is
+    interrupted, the next one picks the same batch up again, and the batch ID recorded in the
+    same transaction as the counts makes sure the batch is never added twice.
+    """
+    batch_id = redis.redis.get(_BATCH_ID_KEY)
+    if not redis.redis.exists(_FLUSHING_KEY):
+        if not redis.redis.exists(_PENDING_KEY):
+            return 0
+        redis.redis.rename(_PENDING_KEY, _FLUSHING_KEY)
+        batch_id = None
+    if batch_id is None:
+        batch_id = uuid.uuid4().hex
+        redis.redis.set(_BATCH_ID_KEY, batch_id)
+    else:
+        batch_id = batch_id.decode()
+
+    counts = {slug.decode(): int(count)
+              for slug, count in redis.redis.hgetall(_FLUSHING_KEY).items()}
+    with transaction.atomic():
+        if not ClickBatch.objects.filter(id=batch_id).exists():
+            slugs = list(counts)
+            for start in range(0, len(slugs), _CHUNK_SIZE):
+                _add_counts({slug: counts[slug] for slug in slugs[start:start + _CHUNK_SIZE]})
+            ClickBatch.objects.create(id=batch_id)
+        ClickBatch.objects.filter(flushed_at__lt=timezone.now() - _BATCH_RETENTION).delete()
+    redis.redis.delete(_FLUSHING_KEY, _BATCH_ID_KEY)
+    return len(counts)
+
+
+def _add_counts(counts: dict[str, int]) -> None:
+    stats = ClickStats.objects.select_for_update().in_bulk(list(counts))
+    for slug, stat in stats.items():
+        stat.clicks += counts[slug]
+    ClickStats.objects.bulk_update(stats.values(), ['clicks'])
+    ClickStats.objects.bulk_create([ClickStats(slug=slug, clicks=count)
+                                    for slug, count in counts.items() if slug not in stats])
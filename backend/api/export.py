@@ -0,0 +1,59 @@
+import csv
+import heapq
+import json
+import uuid
+from typing import Iterator
+
+from .models import ShortUrl
+from .pagination import after
+from . import shards
+
+FIELDS = ('slug', 'url', 'created_at')
+
+
+def rows(user_id: uuid.UUID, chunk_size: int = 2000) -> Iterator[tuple]:
+    """Yields `FIELDS` of all short URLs of the user, oldest first, merged across shards.
+
+    Rows are read in chunks continuing after the last row of the previous chunk. MySQL client
+    cursors buffer whole result sets, so `QuerySet.iterator()` would not keep memory flat, and
+    short queries don't hold a transaction open while a slow client downloads.
+    """
+    queryset = ShortUrl.objects.filter(user_id=user_id).order_by('created_at', 'slug')
+    return heapq.merge(*(_shard_rows(shard_queryset, chunk_size)
+                         for shard_queryset in shards.fan_out(queryset)),
+                       key=lambda row: (row[2], row[0]))
+
+
+def _shard_rows(queryset, chunk_size: int) -> Iterator[tuple]:
+    chunk = list(queryset.values_list(*FIELDS)[:chunk_size])
+    while chunk:
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        slug, _, created_at = chunk[-1]
+        chunk = list(after(queryset, created_at, slug).values_list(*FIELDS)[:chunk_size])
+
+
+def ndjson(rows: Iterator[tuple]) -> Iterator[str]:
+    for slug, url, created_at in rows:
+        yield json.dumps({'slug': slug, 'url': url, 'created_at': created_at.isoformat()}) + '\n'
+
+
+class _Echo:
+    """File-like object handing the lines written by `csv.writer` back."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def csv_lines(rows: Iterator[tuple]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for slug, url, created_at in rows:
+        yield writer.writerow((slug, url, created_at.isoformat()))
+
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson),
+    'csv': ('text/csv; charset=utf-8', csv_lines),
+}
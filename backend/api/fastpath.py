@@ -0,0 +1,111 @@
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from django.utils.encoding import iri_to_uri
+
+from . import clicks, metrics, shorten, views
+
+_REDIRECT_VIEWS = {views.redirect_view, views.aredirect_view}
+
+
+def _match(method: str, path: str) -> Optional[str]:
+    """Returns the slug if the request would be routed to a redirect view."""
+    if method not in ('GET', 'HEAD'):
+        return None
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    return match.kwargs['slug'] if match.func in _REDIRECT_VIEWS else None
+
+
+def _headers(url: Optional[str]) -> list[tuple[str, str]]:
+    # The headers SecurityMiddleware would add to these responses
+    headers = [('Content-Type', 'text/html; charset=utf-8'), ('Content-Length', '0')]
+    if url is not None:
+        headers.append(('Location', iri_to_uri(url)))
+    if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+        headers.append(('X-Content-Type-Options', 'nosniff'))
+    if settings.SECURE_REFERRER_POLICY:
+        headers.append(('Referrer-Policy', settings.SECURE_REFERRER_POLICY))
+    return headers
+
+
+class RedirectFastPath:
+    """WSGI middleware serving redirects without going through Django's middleware stack.
+
+    Redirects don't need sessions, CSRF protection or authentication, so they are answered
+    right from the slug cache. All other requests are passed on to `application`.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        slug = _match(environ['REQUEST_METHOD'], environ.get('PATH_INFO', ''))
+        if slug is None:
+            return self.application(environ, start_response)
+        # What the request_started and request_finished signals of Django's handler do, so that
+        # CONN_MAX_AGE applies and broken connections are replaced
+        close_old_connections()
+        try:
+            return self._redirect(slug, environ, start_response)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def _redirect(slug: str, environ, start_response):
+        with metrics.track_request('api.fastpath.RedirectFastPath'):
+            try:
+                url = shorten.unshorten(slug)
+            except shorten.UnshortenError:
+                start_response('404 Not Found', _headers(None))
+                return [b'']
+            clicks.record(slug, environ)
+            start_response('302 Found', _headers(url))
+            return [b'']
+
+
+class AsyncRedirectFastPath:
+    """ASGI counterpart of `RedirectFastPath`."""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        slug = _match(scope['method'], scope['path']) if scope['type'] == 'http' else None
+        if slug is None:
+            return await self.application(scope, receive, send)
+        # Database connections belong to the thread running the ORM's synchronous code
+        await sync_to_async(close_old_connections)()
+        try:
+            await self._redirect(slug, scope, send)
+        finally:
+            await sync_to_async(close_old_connections)()
+
+    @staticmethod
+    async def _redirect(slug: str, scope, send) -> None:
+        with metrics.track_request('api.fastpath.AsyncRedirectFastPath'):
+            try:
+                url = await shorten.aunshorten(slug)
+                status = 302
+            except shorten.UnshortenError:
+                url = None
+                status = 404
+            if url is not None:
+                await clicks.arecord(slug, _meta(scope))
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': [(name.lower().encode(), value.encode())
+                                    for name, value in _headers(url)]})
+            await send({'type': 'http.response.body', 'body': b''})
+
+
+def _meta(scope) -> dict[str, str]:
+    """Builds the part of `HttpRequest.META` click tracking needs out of an ASGI scope."""
+    meta = {'REMOTE_ADDR': scope['client'][0] if scope.get('client') else ''}
+    for name, value in scope['headers']:
+        meta['HTTP_' + name.decode('latin1').upper().replace('-', '_')] = value.decode('latin1')
+    return meta
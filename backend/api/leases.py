@@ -0,0 +1,78 @@
+import time
+
+from django.conf import settings
+
+from . import redis, slugs
+
+_POOL_KEY = 'slugs:pool:{}'
+_LEASE_KEY = 'slugs:lease:{}'
+_LEASES_KEY = 'slugs:leases'
+
+
+class SlugPool:
+    """Pool of pre-generated slugs handed out as leases expiring after `lease_ttl` seconds.
+
+    A leased slug is known to be free unless someone took it as a custom slug meanwhile, so
+    shortening it does not have to check uniqueness up front. Leases that expire unused are
+    put back into the pool.
+    """
+
+    def __init__(self, size: int = 1000, batch_size: int = 100, lease_ttl: int = 600):
+        self.size = size
+        self.batch_size = batch_size
+        self.lease_ttl = lease_ttl
+
+    def fill(self, length: int) -> int:
+        """Tops the pool of `length` long slugs up to `size`. Returns the number of added slugs."""
+        missing = min(self.size - redis.redis.llen(_POOL_KEY.format(length)),
+                      slugs.generator.available(length))
+        if missing <= 0:
+            return 0
+        redis.redis.rpush(_POOL_KEY.format(length), *slugs.generator.generate_many(length, missing))
+        return missing
+
+    def lease(self, length: int) -> str:
+        slug = redis.redis.lpop(_POOL_KEY.format(length))
+        # Concurrent leasers may empty the pool again before the slugs added are popped
+        while slug is None:
+            self.reclaim_expired()
+            count = min(self.batch_size, slugs.generator.available(length))
+            if count:
+                redis.redis.rpush(_POOL_KEY.format(length),
+                                  *slugs.generator.generate_many(length, count))
+            slug = redis.redis.lpop(_POOL_KEY.format(length))
+            if slug is None and not count:
+                raise slugs.NoFreeSlugsError()
+        slug = slug.decode()
+
+        pipeline = redis.redis.pipeline(transaction=False)
+        pipeline.set(_LEASE_KEY.format(slug), 1, ex=self.lease_ttl)
+        pipeline.zadd(_LEASES_KEY, {slug: time.time() + self.lease_ttl})
+        pipeline.execute()
+        return slug
+
+    def claim(self, slug: str) -> bool:
+        """Ends the lease of `slug` if there is one. Returns whether the slug was leased."""
+        pipeline = redis.redis.pipeline(transaction=False)
+        pipeline.delete(_LEASE_KEY.format(slug))
+        pipeline.zrem(_LEASES_KEY, slug)
+        deleted, _ = pipeline.execute()
+        return bool(deleted)
+
+    def release(self, slug: str) -> None:
+        """Returns a claimed slug which turned out unused to the pool."""
+        redis.redis.rpush(_POOL_KEY.format(len(slug)), slug)
+
+    def reclaim_expired(self) -> int:
+        """Returns slugs of expired leases to the pool. Returns the number of reclaimed slugs."""
+        expired = redis.redis.zrangebyscore(_LEASES_KEY, '-inf', time.time())
+        reclaimed = 0
+        for slug in expired:
+            # Only one of concurrently reclaiming workers manages to remove the slug
+            if redis.redis.zrem(_LEASES_KEY, slug):
+                self.release(slug.decode())
+                reclaimed += 1
+        return reclaimed
+
+
+pool = SlugPool(**getattr(settings, 'SLUG_POOL', {}))
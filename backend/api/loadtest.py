@@ -0,0 +1,263 @@
+import asyncio
+import bisect
+import itertools
+import json
+import random
+import re
+import time
+from http.cookies import SimpleCookie
+from typing import Optional
+from urllib.parse import urlencode
+
+OPERATIONS = ('redirect', 'shorten', 'slug', 'listing')
+_EXPECTED_STATUSES = {'redirect': {302}, 'shorten': {200}, 'slug': {200}, 'listing': {200}}
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# Slug lookups answered by a database query, see `unshorten_lookups_total` in `api.metrics`
+_DB_LOOKUPS = ('db_hit', 'not_found')
+_LOOKUPS_PATTERN = re.compile(r'^unshorten_lookups_total\{result="(\w+)"\} (\S+)$', re.MULTILINE)
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parses a traffic mix like "redirect=90,shorten=5" into normalized operation weights."""
+    weights = {}
+    for part in mix.split(','):
+        operation, _, weight = part.partition('=')
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise ValueError(f'unknown operation {operation!r}, expected one of {OPERATIONS}')
+        weights[operation] = float(weight)
+        if weights[operation] < 0:
+            raise ValueError(f'negative weight of {operation!r}')
+    total = sum(weights.values())
+    if not total:
+        raise ValueError('the traffic mix is empty')
+    return {operation: weight / total for operation, weight in weights.items()}
+
+
+def parse_lookups(metrics: str) -> dict[str, float]:
+    """Returns the slug lookup counts by result from the /metrics output of the backend."""
+    return {result: float(value) for result, value in _LOOKUPS_PATTERN.findall(metrics)}
+
+
+def hit_ratio(before: Optional[dict[str, float]],
+              after: Optional[dict[str, float]]) -> Optional[float]:
+    """Share of the slug lookups between two `parse_lookups()` results answered without a
+    database query, by a cache or the Bloom filter."""
+    if before is None or after is None:
+        return None
+    counts = {result: count - before.get(result, 0) for result, count in after.items()}
+    total = sum(counts.values())
+    if not total:
+        return None
+    return 1 - sum(counts.get(result, 0) for result in _DB_LOOKUPS) / total
+
+
+class ZipfSampler:
+    """Samples indices of `n` items, the k-th most popular one with probability ~ 1 / k^s."""
+
+    def __init__(self, n: int, s: float = 1.0, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+        self.cumulative = list(itertools.accumulate(1 / k ** s for k in range(1, n + 1)))
+
+    def sample(self) -> int:
+        point = self.rng.random() * self.cumulative[-1]
+        return min(bisect.bisect_left(self.cumulative, point), len(self.cumulative) - 1)
+
+
+class Stats:
+    """Latencies and errors of requests per operation."""
+
+    def __init__(self):
+        self.latencies_ms: dict[str, list[float]] = {operation: [] for operation in OPERATIONS}
+        self.errors: dict[str, int] = {operation: 0 for operation in OPERATIONS}
+
+    def record(self, operation: str, latency_ms: float, ok: bool) -> None:
+        self.latencies_ms[operation].append(latency_ms)
+        if not ok:
+            self.errors[operation] += 1
+
+    @property
+    def requests(self) -> int:
+        return sum(len(latencies) for latencies in self.latencies_ms.values())
+
+    def percentile_ms(self, operation: str, percent: float) -> float:
+        latencies = sorted(self.latencies_ms[operation])
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def histogram(self, operation: str) -> list[tuple[str, int]]:
+        counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        for latency in self.latencies_ms[operation]:
+            counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, latency)] += 1
+        labels = [f'<= {bound} ms' for bound in HISTOGRAM_BOUNDS_MS]
+        labels.append(f'> {HISTOGRAM_BOUNDS_MS[-1]} ms')
+        return list(zip(labels, counts))
+
+
+class HTTPConnection:
+    """Minimal HTTP/1.1 client connection with a cookie jar, kept alive unless the server closes
+    it, e.g. gunicorn's sync workers after every response."""
+
+    def __init__(self, host: str, port: int, unix_socket: Optional[str], host_header: str):
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.host_header = host_header
+        self.cookies = SimpleCookie()
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None,
+                      content_type: str = 'application/json') -> tuple[int, bytes]:
+        while True:
+            reused = self.writer is not None
+            if not reused:
+                if self.unix_socket:
+                    self.reader, self.writer = await asyncio.open_unix_connection(self.unix_socket)
+                else:
+                    self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                status, content, keep_alive = await self._request(method, path, body, content_type)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                self.close()
+                if reused:
+                    # The server may have closed the idle connection, retry on a new one
+                    continue
+                raise
+            if not keep_alive:
+                self.close()
+            return status, content
+
+    async def _request(self, method, path, body, content_type) -> tuple[int, bytes, bool]:
+        headers = [f'{method} {path} HTTP/1.1', f'Host: {self.host_header}']
+        if self.cookies:
+            headers.append('Cookie: ' + '; '.join(f'{name}={morsel.value}'
+                                                  for name, morsel in self.cookies.items()))
+        if body is not None:
+            headers += [f'Content-Type: {content_type}', f'Content-Length: {len(body)}']
+        self.writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + (body or b''))
+        await self.writer.drain()
+
+        status_line = (await self.reader.readline()).split()
+        if not status_line:
+            raise ConnectionResetError('the server closed the connection')
+        status = int(status_line[1])
+        keep_alive = status_line[0] == b'HTTP/1.1'
+        length, chunked = 0, False
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin1').partition(':')
+            name, value = name.strip().lower(), value.strip()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = value.lower() == 'chunked'
+            elif name == 'connection':
+                keep_alive = value.lower() != 'close'
+            elif name == 'set-cookie':
+                self.cookies.load(value)
+        if not chunked:
+            return status, await self.reader.readexactly(length), keep_alive
+        content = b''
+        while size := int((await self.reader.readline()).strip(), 16):
+            content += await self.reader.readexactly(size)
+            await self.reader.readline()
+        await self.reader.readline()
+        return status, content, keep_alive
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadTest:
+    def __init__(self, connect: dict, mix: dict[str, float], concurrency: int,
+                 zipf_exponent: float = 1.0, seed: Optional[int] = None):
+        self.connect = connect
+        self.mix = mix
+        self.concurrency = concurrency
+        self.zipf_exponent = zipf_exponent
+        self.rng = random.Random(seed)
+        self.slugs: list[str] = []
+        self.sampler: Optional[ZipfSampler] = None
+        self.total = Stats()
+        self.interval = Stats()
+
+    async def seed(self, count: int, batch_size: int = 1000) -> None:
+        """Shortens `count` URLs through the bulk endpoint for redirects to pick from."""
+        connection = HTTPConnection(**self.connect)
+        try:
+            for start in range(0, count, batch_size):
+                items = [{'url': f'http://example.com/{i}'}
+                         for i in range(start, min(count, start + batch_size))]
+                status, content = await connection.request('POST', '/api/shorten/bulk/',
+                                                           json.dumps(items).encode())
+                if status != 200:
+                    raise RuntimeError(f'seeding failed with status {status}: {content[:200]!r}')
+                self.slugs += [result['slug'] for result in json.loads(content)
+                               if result['status'] == 'created']
+        finally:
+            connection.close()
+        # Popularity ranks get spread over the slugs randomly
+        self.rng.shuffle(self.slugs)
+        self.sampler = ZipfSampler(len(self.slugs), self.zipf_exponent, self.rng)
+
+    def _pick(self) -> str:
+        return self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    def _request(self, operation: str) -> tuple[str, str, Optional[bytes]]:
+        if operation == 'redirect':
+            return 'GET', f'/{self.slugs[self.sampler.sample()]}', None
+        if operation == 'shorten':
+            url = f'http://example.com/{self.rng.getrandbits(64)}'
+            return 'POST', '/api/shorten/', json.dumps({'url': url}).encode()
+        if operation == 'slug':
+            return 'GET', '/api/slug/?' + urlencode({'length': 6}), None
+        return 'GET', '/api/urls/', None
+
+    async def _worker(self, deadline: float) -> None:
+        connection = HTTPConnection(**self.connect)
+        try:
+            while time.monotonic() < deadline:
+                operation = self._pick()
+                start = time.perf_counter()
+                try:
+                    status, _ = await connection.request(*self._request(operation))
+                    ok = status in _EXPECTED_STATUSES[operation]
+                except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    ok = False
+                latency_ms = (time.perf_counter() - start) * 1000
+                self.total.record(operation, latency_ms, ok)
+                self.interval.record(operation, latency_ms, ok)
+        finally:
+            connection.close()
+
+    async def lookups(self, connection: HTTPConnection) -> Optional[dict[str, float]]:
+        """Returns the slug lookup counts of the backend by result, or None if its /metrics
+        endpoint cannot be read."""
+        try:
+            status, content = await connection.request('GET', '/metrics')
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            return None
+        return parse_lookups(content.decode()) if status == 200 else None
+
+    async def run(self, duration: float, report_interval: float, report) -> None:
+        """Runs the traffic mix for `duration` seconds, calling
+        `report(interval_stats, elapsed, hit_ratio)` every `report_interval` seconds."""
+        if 'redirect' in self.mix and self.sampler is None:
+            raise RuntimeError('seed() has to be called before running redirects')
+        metrics_connection = HTTPConnection(**self.connect)
+        try:
+            lookups = await self.lookups(metrics_connection)
+            started = time.monotonic()
+            workers = [asyncio.create_task(self._worker(started + duration))
+                       for _ in range(self.concurrency)]
+            while not all(worker.done() for worker in workers):
+                await asyncio.wait(workers, timeout=report_interval)
+                interval, self.interval = self.interval, Stats()
+                elapsed = time.monotonic() - started
+                previous, lookups = lookups, await self.lookups(metrics_connection)
+                report(interval, elapsed, hit_ratio(previous, lookups))
+            await asyncio.gather(*workers)
+        finally:
+            metrics_connection.close()
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Times the shorten, unshorten and slug generation hot paths against a throwaway test '
+            'database and a fake Redis.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000)
+        parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+        parser.add_argument('--compare', metavar='FILE',
+                            help='fail if the results are worse than a saved baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='allowed relative slowdown compared to the baseline')
+
+    def handle(self, *args, iterations, save, compare, tolerance, **options):
+        results = []
+        self.stdout.write(f'{"benchmark":<36}{"ops/sec":>10}{"p50 us":>10}{"p95 us":>10}'
+                          f'{"p99 us":>10}')
+        with benchmarks.environment():
+            for benchmark in benchmarks.BENCHMARKS:
+                for result in benchmark(iterations):
+                    results.append(result)
+                    self.stdout.write(f'{result.name:<36}{result.ops_per_sec:>10.0f}'
+                                      + ''.join(f'{result.percentile_us(p):>10.1f}'
+                                                for p in (50, 95, 99)))
+
+        if save:
+            with open(save, 'w') as file:
+                json.dump({result.name: result.as_dict() for result in results}, file, indent=2)
+        if compare:
+            with open(compare) as file:
+                regressions = benchmarks.compare(results, json.load(file), tolerance)
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write('No performance regressions.')
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import snapshot, warmup
+
+
+class Command(BaseCommand):
+    help = ('Writes the unexpired short URLs to the snapshot file that worker processes look slugs '
+            'up in before Redis, replacing the previous snapshot atomically.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='snapshot file, SLUG_SNAPSHOT["path"] by default')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='URLs read per query')
+
+    def handle(self, *args, path, chunk_size, **options):
+        path = path or snapshot.slug_snapshot.path
+        if path is None:
+            raise CommandError('Set SLUG_SNAPSHOT_PATH or pass --path.')
+        started_at = time.monotonic()
+        count = snapshot.build(path, warmup.chunks(chunk_size=chunk_size))
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(f'Wrote {count} slugs to {path} in {elapsed:.1f} s.')
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from ... import cache, metrics
+
+
+class Command(BaseCommand):
+    help = ('Reports the memory used per slug cache entry in Redis, projected to a given number '
+            'of entries, and the cache hit rates.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=1000,
+                            help='number of random keys to measure')
+        parser.add_argument('--entries', type=int, default=100_000_000,
+                            help='number of cached entries to project the memory usage to')
+
+    def handle(self, *args, samples, entries, **options):
+        report = cache.slug_cache.memory_report(samples)
+        self.stdout.write(f'Redis memory: {_size(report["used_memory"])} used, '
+                          f'{_size(report["maxmemory"]) if report["maxmemory"] else "no"} limit, '
+                          f'{report["maxmemory_policy"]} policy')
+        self.stdout.write(f'Keys evicted: {report["evicted_keys"]}, '
+                          f'expired: {report["expired_keys"]}')
+        if report['keyspace_hit_rate'] is not None:
+            self.stdout.write(f'Redis keyspace hit rate: {report["keyspace_hit_rate"]:.1%}')
+
+        layout = (f'{cache.slug_cache.buckets} hash buckets' if cache.slug_cache.buckets
+                  else 'one key per slug')
+        self.stdout.write(f'Slug cache: {layout}, TTL {cache.slug_cache.ttl or "none"}')
+        self.stdout.write(f'Entries (estimated): {report["entries"]}')
+        if report['bytes_per_entry'] is not None:
+            self.stdout.write(f'Memory per entry: {report["bytes_per_entry"]:.0f} B, '
+                              f'{_size(report["bytes_per_entry"] * entries)} for {entries} entries')
+        if report['listpack_share'] is not None:
+            self.stdout.write(f'Buckets encoded as listpacks: {report["listpack_share"]:.1%}')
+
+        # Collected from the dumps of the workers if METRICS_DIR is shared with them
+        lookups = {dict(labels)['result']: count for (name, labels), count
+                   in metrics.collect()['counters'].items() if name == 'unshorten_lookups_total'}
+        total = sum(lookups.values())
+        if total:
+            self.stdout.write('Slug lookups: ' + ', '.join(
+                f'{result} {count / total:.1%}' for result, count in sorted(lookups.items())))
+
+
+def _size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TiB'
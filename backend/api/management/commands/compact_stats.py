@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import analytics
+
+
+class Command(BaseCommand):
+    help = 'Stores the click statistics buckets kept in Redis in the database rollup tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='keep running, compacting every INTERVAL seconds')
+
+    def handle(self, *args, interval, **options):
+        while True:
+            self.stdout.write(f'Compacted statistics of {analytics.compact()} slugs.')
+            if interval is None:
+                return
+            time.sleep(interval)
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...leases import pool
+
+
+class Command(BaseCommand):
+    help = 'Pre-generates slugs into the lease pool and reclaims expired leases.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--length', type=int, action='append', dest='lengths',
+                            help='slug length to fill the pool for (default: 6), may be repeated')
+        parser.add_argument('--interval', type=float,
+                            help='keep running, refilling the pool every INTERVAL seconds')
+
+    def handle(self, *args, lengths, interval, **options):
+        lengths = lengths or [6]
+        while True:
+            reclaimed = pool.reclaim_expired()
+            added = sum(pool.fill(length) for length in lengths)
+            self.stdout.write(f'Reclaimed {reclaimed} expired leases, generated {added} slugs.')
+            if interval is None:
+                return
+            time.sleep(interval)
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import clicks
+
+
+class Command(BaseCommand):
+    help = 'Moves click counts recorded by redirects from Redis to the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='keep running, flushing every INTERVAL seconds')
+
+    def handle(self, *args, interval, **options):
+        while True:
+            self.stdout.write(f'Flushed click counts of {clicks.flush()} slugs.')
+            if interval is None:
+                return
+            time.sleep(interval)
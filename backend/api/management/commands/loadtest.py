@@ -0,0 +1,74 @@
+import asyncio
+from typing import Optional
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Drives a running backend over HTTP with a mix of Zipf-distributed redirects of seeded '
+            'slugs, shorten, slug and listing requests, reporting throughput, latencies, errors '
+            'and the slug cache hit ratio over time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--unix-socket', help='connect to a unix socket instead of host:port')
+        parser.add_argument('--host-header', default='localhost')
+        parser.add_argument('--mix', default='redirect=90,shorten=5,slug=3,listing=2',
+                            help='relative weights of the operations')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='number of concurrent keep-alive connections')
+        parser.add_argument('--duration', type=float, default=60, help='seconds')
+        parser.add_argument('--report-interval', type=float, default=5, help='seconds')
+        parser.add_argument('--seed-slugs', type=int, default=10000,
+                            help='number of URLs shortened up front for the redirects')
+        parser.add_argument('--zipf-exponent', type=float, default=1.0)
+        parser.add_argument('--random-seed', type=int)
+
+    def handle(self, *args, host, port, unix_socket, host_header, mix, concurrency, duration,
+               report_interval, seed_slugs, zipf_exponent, random_seed, **options):
+        try:
+            weights = loadtest.parse_mix(mix)
+        except ValueError as e:
+            raise CommandError(f'Invalid --mix: {e}')
+        test = loadtest.LoadTest(
+            {'host': host, 'port': port, 'unix_socket': unix_socket, 'host_header': host_header},
+            weights, concurrency, zipf_exponent, random_seed)
+        asyncio.run(self._run(test, seed_slugs, duration, report_interval))
+
+        self.stdout.write(f'\nTotal: {test.total.requests} requests in {duration:.0f} s')
+        for operation in weights:
+            latencies = test.total.latencies_ms[operation]
+            if not latencies:
+                continue
+            self.stdout.write(f'\n{operation}: {len(latencies)} requests, '
+                              f'{test.total.errors[operation]} errors')
+            for label, count in test.total.histogram(operation):
+                bar = '#' * (60 * count // len(latencies))
+                self.stdout.write(f'  {label:>11} {count:>9} {bar}'.rstrip())
+
+    async def _run(self, test, seed_slugs, duration, report_interval):
+        if 'redirect' in test.mix:
+            self.stdout.write(f'Seeding {seed_slugs} slugs...')
+            try:
+                await test.seed(seed_slugs)
+            except (OSError, RuntimeError) as e:
+                raise CommandError(f'Seeding failed: {e}')
+        self.stdout.write(f'{"time":>6}{"req/s":>9}{"errors":>8}{"hit ratio":>11}'
+                          f'  p50/p95/p99 ms per operation')
+        self.reported_at = 0
+        await test.run(duration, report_interval, self._report)
+
+    def _report(self, stats: loadtest.Stats, elapsed: float,
+                hit_ratio: Optional[float]) -> None:
+        interval, self.reported_at = elapsed - self.reported_at, elapsed
+        errors = sum(stats.errors.values())
+        latencies = '  '.join(
+            f'{operation} {stats.percentile_ms(operation, 50):.1f}/'
+            f'{stats.percentile_ms(operation, 95):.1f}/{stats.percentile_ms(operation, 99):.1f}'
+            for operation in loadtest.OPERATIONS if stats.latencies_ms[operation])
+        self.stdout.write(f'{elapsed:>6.0f}{stats.requests / interval:>9.0f}'
+                          f'{errors / max(stats.requests, 1):>8.1%}'
+                          f'{"-" if hit_ratio is None else f"{hit_ratio:.1%}":>11}  {latencies}')
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ... import shorten
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired short URLs in batches and evicts them from the Redis cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='short URLs deleted per DELETE statement')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='seconds to sleep between batches')
+        parser.add_argument('--interval', type=float,
+                            help='keep running, deleting expired URLs every INTERVAL seconds')
+
+    def handle(self, *args, batch_size, pause, interval, **options):
+        while True:
+            deleted = 0
+            for count in shorten.delete_expired(batch_size):
+                deleted += count
+                time.sleep(pause)
+            self.stdout.write(f'Deleted {deleted} expired short URLs.')
+            if interval is None:
+                return
+            time.sleep(interval)
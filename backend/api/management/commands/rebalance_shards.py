@@ -0,0 +1,22 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from ... import shards
+
+
+class Command(BaseCommand):
+    help = ('Moves short URLs to the shard their slug hashes to, e.g. after shards were added to '
+            'SHORTURL_SHARDS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='rows read per query and moved per transaction')
+
+    def handle(self, *args, chunk_size, **options):
+        moved = Counter()
+        for source, target, count in shards.rebalance(chunk_size):
+            moved[source, target] += count
+        for (source, target), count in sorted(moved.items()):
+            self.stdout.write(f'Moved {count} short URLs from {source} to {target}.')
+        self.stdout.write(f'Moved {sum(moved.values())} short URLs in total.')
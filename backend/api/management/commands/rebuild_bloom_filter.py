@@ -0,0 +1,31 @@
+from datetime import timedelta
+from itertools import chain
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ... import shards
+from ...bloom import slug_filter
+from ...models import ShortUrl
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the Bloom filter of existing slugs used to answer unknown slugs without the DB.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, chunk_size, **options):
+        started_at = timezone.now()
+        slugs = chain.from_iterable(ShortUrl.objects.using(alias).values_list('slug', flat=True)
+                                    .iterator(chunk_size=chunk_size)
+                                    for alias in shards.aliases())
+        count = slug_filter.rebuild(slugs)
+
+        # Slugs added to the old filter while the new one was being built got lost by the swap
+        for alias in shards.aliases():
+            recent = ShortUrl.objects.using(alias).filter(
+                created_at__gte=started_at - timedelta(minutes=1))
+            slug_filter.add(*recent.values_list('slug', flat=True))
+
+        self.stdout.write(f'Added {count} slugs to the Bloom filter.')
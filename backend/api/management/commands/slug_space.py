@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ... import slugs
+
+
+class Command(BaseCommand):
+    help = 'Reports how much of the random slug space of each length is used up.'
+
+    def handle(self, *args, **options):
+        for length, reserved, capacity in slugs.space_usage():
+            self.stdout.write(f'{length:>3} chars: {reserved} of {capacity} reserved '
+                              f'({reserved / capacity:.6%})')
@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ... import warmup
+
+
+class Command(BaseCommand):
+    help = ('Loads short URLs from the database into the Redis slug cache, e.g. after Redis lost '
+            'its data, so that the first redirects do not all query the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--created-within', type=int, metavar='DAYS',
+                            help='only URLs created in the last DAYS days')
+        parser.add_argument('--clicked-within', type=int, metavar='DAYS',
+                            help='only URLs clicked in the last DAYS days, most clicked first')
+        parser.add_argument('--limit', type=int, help='maximum number of URLs to cache')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='URLs read per query and cached per Redis pipeline')
+        parser.add_argument('--progress-interval', type=float, default=5, help='seconds')
+
+    def handle(self, *args, created_within, clicked_within, limit, chunk_size, progress_interval,
+               **options):
+        now = timezone.now()
+        created_after = now - timedelta(days=created_within) if created_within else None
+        if clicked_within:
+            chunks = warmup.chunks_by_clicks((now - timedelta(days=clicked_within)).date(),
+                                             created_after, chunk_size)
+        else:
+            chunks = warmup.chunks(created_after, chunk_size)
+
+        started_at = reported_at = time.monotonic()
+        cached = 0
+        for count in warmup.warm(chunks, limit):
+            cached += count
+            if time.monotonic() - reported_at >= progress_interval:
+                reported_at = time.monotonic()
+                self.stdout.write(f'Cached {cached} URLs, '
+                                  f'{cached / (reported_at - started_at):.0f}/s')
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(f'Cached {cached} URLs in {elapsed:.1f} s, '
+                          f'{cached / elapsed if elapsed else 0:.0f}/s')
@@ -0,0 +1,253 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency per view.'),
+    'redis_commands_total': ('counter', 'Redis commands and pipelines sent per view.'),
+    'redis_seconds_total': ('counter', 'Time spent on Redis round trips per view.'),
+    'db_queries_total': ('counter', 'Database queries per view.'),
+    'db_seconds_total': ('counter', 'Time spent on database queries per view.'),
+    'unshorten_lookups_total': ('counter', 'Slug lookups per layer answering them.'),
+    'slug_generation_retries_total': ('counter', 'Generated slugs found occupied on insertion.'),
+    'shorten_deduplicated_total': ('counter', 'URLs shortened to a slug the user already had.'),
+}
+
+_Key = tuple[str, tuple[tuple[str, str], ...]]
+
+
+class Registry:
+    """Counters and histograms of one process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[_Key, float] = {}
+        # Bucket counts followed by the sum and the count of the observed values
+        self.histograms: dict[_Key, list[float]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {'counters': [[name, labels, value]
+                                 for (name, labels), value in self.counters.items()],
+                    'histograms': [[name, labels, list(values)]
+                                   for (name, labels), values in self.histograms.items()]}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+
+# Redis and DB usage of the request being handled, attributed to its view once it is resolved
+_request_usage: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar('request_usage',
+                                                                                default=None)
+
+
+def inc(name: str, amount: float = 1, **labels: str) -> None:
+    registry.inc(name, amount, **labels)
+
+
+def record_call(kind: str, seconds: float) -> None:
+    """Records a Redis (`kind="redis"`) or DB (`kind="db"`) call against the current request."""
+    usage = _request_usage.get()
+    if usage is None:
+        registry.inc(f'{kind}_{"queries" if kind == "db" else "commands"}_total', view='none')
+        registry.inc(f'{kind}_seconds_total', seconds, view='none')
+    else:
+        usage[kind][0] += 1
+        usage[kind][1] += seconds
+
+
+@contextlib.contextmanager
+def track_request(view: str = 'unmatched') -> Iterator[dict]:
+    """Times a request along with its Redis and DB calls. Set `usage["view"]` on the yielded dict
+    once the view is known."""
+    usage = {'view': view, 'redis': [0, 0.0], 'db': [0, 0.0]}
+    token = _request_usage.set(usage)
+    start = time.perf_counter()
+    try:
+        yield usage
+    finally:
+        elapsed = time.perf_counter() - start
+        _request_usage.reset(token)
+        view = usage['view']
+        registry.observe('http_request_duration_seconds', elapsed, view=view)
+        for kind, name in [('redis', 'redis_commands_total'), ('db', 'db_queries_total')]:
+            calls, seconds = usage[kind]
+            if calls:
+                registry.inc(name, calls, view=view)
+                registry.inc(f'{kind}_seconds_total', seconds, view=view)
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper installed on every connection, see `AppConfig.ready()`."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_call('db', time.perf_counter() - start)
+
+
+def instrument_connection(sender, connection, **kwargs) -> None:
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """Records the latency of every request and the Redis and DB calls it made per view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with track_request() as usage:
+            response = self.get_response(request)
+            usage['view'] = view_name(request)
+        return response
+
+    async def __acall__(self, request):
+        with track_request() as usage:
+            response = await self.get_response(request)
+            usage['view'] = view_name(request)
+        return response
+
+
+# Aggregation across worker processes: each one dumps its registry into a file of METRICS_DIR
+
+_dump_name: Optional[str] = None
+
+
+def _metrics_dir() -> Optional[Path]:
+    directory = getattr(settings, 'METRICS_DIR', None)
+    return Path(directory) if directory else None
+
+
+def dump() -> None:
+    """Writes the registry of this process to its file in METRICS_DIR."""
+    global _dump_name
+    directory = _metrics_dir()
+    if directory is None:
+        return
+    if _dump_name is None:
+        # The random part keeps a worker from overwriting the totals of a dead one with its PID
+        _dump_name = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+    temporary = directory / f'{_dump_name}.tmp'
+    temporary.write_text(json.dumps(registry.snapshot()))
+    os.replace(temporary, directory / _dump_name)
+
+
+def start_dumping() -> None:
+    """Dumps the registry every METRICS_DUMP_INTERVAL seconds from a daemon thread."""
+    if _metrics_dir() is None:
+        return
+    interval = getattr(settings, 'METRICS_DUMP_INTERVAL', 5)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            dump()
+
+    threading.Thread(target=run, name='metrics-dump', daemon=True).start()
+
+
+def collect() -> dict:
+    """Adds up the live registry of this process and the dumps of all other processes."""
+    snapshots = [registry.snapshot()]
+    directory = _metrics_dir()
+    if directory is not None:
+        for path in directory.glob('*.json'):
+            if path.name == _dump_name:
+                continue
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue  # replaced or removed meanwhile
+    counters: dict[_Key, float] = {}
+    histograms: dict[_Key, list[float]] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                merged[i] += value
+    return {'counters': counters, 'histograms': histograms}
+
+
+def render(collected: dict) -> str:
+    """Formats collected metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for (metric, labels), value in sorted(collected['counters'].items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        for (metric, labels), values in sorted(collected['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip([*LATENCY_BUCKETS, '+Inf'], values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} '
+                             f'{_number(cumulative)}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(values[-2])}')
+            lines.append(f'{name}_count{_labels(labels)} {_number(values[-1])}')
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
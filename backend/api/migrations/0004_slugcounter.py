@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_shorturl_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlugCounter',
+            fields=[
+                ('length', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='slug length')),
+                ('next_value', models.BigIntegerField(default=0, verbose_name='first counter value not reserved yet')),
+            ],
+        ),
+    ]
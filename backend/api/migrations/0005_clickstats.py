@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_slugcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickBatch',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='batch ID')),
+                ('flushed_at', models.DateTimeField(auto_now_add=True, verbose_name='flush time')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClickStats',
+            fields=[
+                ('slug', models.SlugField(primary_key=True, serialize=False, verbose_name='slug')),
+                ('clicks', models.PositiveBigIntegerField(default=0, verbose_name='click count')),
+            ],
+        ),
+    ]
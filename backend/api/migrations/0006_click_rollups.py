@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_clickstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyClicks',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(db_index=False, verbose_name='slug')),
+                ('day', models.DateField(verbose_name='day')),
+                ('clicks', models.PositiveBigIntegerField(verbose_name='click count')),
+                ('unique_visitors', models.PositiveBigIntegerField(verbose_name='approximate unique visitor count')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('slug', 'day'), name='unique_slug_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyClicks',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(db_index=False, verbose_name='slug')),
+                ('hour', models.DateTimeField(verbose_name='hour start')),
+                ('clicks', models.PositiveBigIntegerField(verbose_name='click count')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('slug', 'hour'), name='unique_slug_hour')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReferrerClicks',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(db_index=False, verbose_name='slug')),
+                ('referrer', models.CharField(max_length=255, verbose_name='referrer host')),
+                ('clicks', models.PositiveBigIntegerField(verbose_name='click count')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('slug', 'referrer'), name='unique_slug_referrer')],
+            },
+        ),
+    ]
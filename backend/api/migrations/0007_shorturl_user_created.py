@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_click_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shorturl',
+            index=models.Index(fields=['user_id', 'created_at'], name='shorturl_user_created'),
+        ),
+    ]
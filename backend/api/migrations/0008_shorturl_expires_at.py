@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_shorturl_user_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shorturl',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='expiry time'),
+        ),
+        migrations.AddIndex(
+            model_name='shorturl',
+            index=models.Index(fields=['expires_at'], name='shorturl_expires_at'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:59
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_shorturl_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shorturl',
+            name='url_hash',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.MD5('url'), output_field=models.CharField(max_length=32), verbose_name='URL hash'),
+        ),
+        migrations.AddIndex(
+            model_name='shorturl',
+            index=models.Index(fields=['user_id', 'url_hash'], name='shorturl_user_url_hash'),
+        ),
+    ]
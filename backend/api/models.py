@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import MD5
 
 
 class ShortUrl(models.Model):
@@ -7,3 +8,64 @@ class ShortUrl(models.Model):
     url = models.URLField('shortened URL')
     user_id = models.UUIDField('ephemeral user ID')
     created_at = models.DateTimeField('creation time', auto_now_add=True)
+    expires_at = models.DateTimeField('expiry time', null=True, blank=True)
+    # MySQL cannot index the whole URL, see `api.shorten.url_hash()`
+    url_hash = models.GeneratedField(expression=MD5('url'),
+                                     output_field=models.CharField(max_length=32),
+                                     db_persist=True, verbose_name='URL hash')
+
+    class Meta:
+        indexes = [
+            # Serves the listing of a user's URLs ordered by (created_at, slug): InnoDB appends
+            # the primary key to secondary indexes
+            models.Index(fields=['user_id', 'created_at'], name='shorturl_user_created'),
+            # Lets `manage.py reap_expired` find expired URLs without scanning the table
+            models.Index(fields=['expires_at'], name='shorturl_expires_at'),
+            # Finds a user's existing short URL of a URL when shortening with deduplication
+            models.Index(fields=['user_id', 'url_hash'], name='shorturl_user_url_hash'),
+        ]
+
+
+class SlugCounter(models.Model):
+    length = models.PositiveSmallIntegerField('slug length', primary_key=True)
+    next_value = models.BigIntegerField('first counter value not reserved yet', default=0)
+
+
+class ClickStats(models.Model):
+    slug = models.SlugField('slug', primary_key=True)
+    clicks = models.PositiveBigIntegerField('click count', default=0)
+
+
+class ClickBatch(models.Model):
+    """Click count batch already added to `ClickStats`, kept to never add a batch twice."""
+    id = models.CharField('batch ID', max_length=32, primary_key=True)
+    flushed_at = models.DateTimeField('flush time', auto_now_add=True)
+
+
+class HourlyClicks(models.Model):
+    slug = models.SlugField('slug', db_index=False)  # covered by the unique constraint
+    hour = models.DateTimeField('hour start')
+    clicks = models.PositiveBigIntegerField('click count')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['slug', 'hour'], name='unique_slug_hour')]
+
+
+class DailyClicks(models.Model):
+    slug = models.SlugField('slug', db_index=False)  # covered by the unique constraint
+    day = models.DateField('day')
+    clicks = models.PositiveBigIntegerField('click count')
+    unique_visitors = models.PositiveBigIntegerField('approximate unique visitor count')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['slug', 'day'], name='unique_slug_day')]
+
+
+class ReferrerClicks(models.Model):
+    slug = models.SlugField('slug', db_index=False)  # covered by the unique constraint
+    referrer = models.CharField('referrer host', max_length=255)
+    clicks = models.PositiveBigIntegerField('click count')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['slug', 'referrer'],
+                                               name='unique_slug_referrer')]
@@ -0,0 +1,79 @@
+import base64
+import heapq
+import json
+from datetime import datetime
+from itertools import islice
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from . import shards
+
+
+def after(queryset, created_at: datetime, slug: str):
+    """Filters short URLs ordered by `(created_at, slug)` to the ones following the given one."""
+    return queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, slug__gt=slug))
+
+
+class KeysetPagination(BasePagination):
+    """Paginates short URLs by `(created_at, slug)`, continuing after the last URL of the previous
+    page instead of skipping an offset, so every page costs one index range scan per shard. There
+    is no total count, the response only links the next page.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        queryset = queryset.order_by('created_at', 'slug')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is not None:
+            queryset = after(queryset, *self.decode_cursor(cursor))
+        # One extra row tells whether there is a next page. Each shard returns as many rows, of
+        # which the first ones in order make up the page.
+        size = self.page_size + 1
+        shard_pages = [list(shard_queryset[:size]) for shard_queryset in shards.fan_out(queryset)]
+        page = list(islice(heapq.merge(*shard_pages, key=lambda row: (row.created_at, row.slug)),
+                           size))
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self.encode_cursor(last.created_at, last.slug))
+
+    @staticmethod
+    def encode_cursor(created_at: datetime, slug: str) -> str:
+        position = json.dumps([created_at.isoformat(), slug]).encode()
+        return base64.urlsafe_b64encode(position).decode()
+
+    def decode_cursor(self, cursor: str) -> tuple[datetime, str]:
+        try:
+            created_at, slug = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return datetime.fromisoformat(created_at), str(slug)
+        except (TypeError, ValueError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
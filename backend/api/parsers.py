@@ -0,0 +1,15 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """Parses newline-delimited JSON into a list of values."""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return [json.loads(line) for line in stream if line.strip()]
+        except ValueError as e:
+            raise ParseError(f'NDJSON parse error - {e}') from e
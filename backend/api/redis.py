@@ -1,4 +1,60 @@
+import time
+
 from django.conf import settings
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from redis.asyncio.client import Pipeline as AsyncPipeline
+from redis.client import Pipeline
+
+from . import metrics
+
+
+class InstrumentedRedis(Redis):
+    """Redis client recording the count and duration of its round trips in `api.metrics`."""
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            metrics.record_call('redis', time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> 'InstrumentedPipeline':
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction,
+                                    shard_hint)
+
+
+class InstrumentedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            metrics.record_call('redis', time.perf_counter() - start)
+
+
+class InstrumentedAsyncRedis(AsyncRedis):
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            metrics.record_call('redis', time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> 'InstrumentedAsyncPipeline':
+        return InstrumentedAsyncPipeline(self.connection_pool, self.response_callbacks,
+                                         transaction, shard_hint)
+
+
+class InstrumentedAsyncPipeline(AsyncPipeline):
+    async def execute(self, raise_on_error=True):
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            metrics.record_call('redis', time.perf_counter() - start)
+
 
-redis = Redis(**getattr(settings, 'REDIS', {}))
+redis = InstrumentedRedis(**getattr(settings, 'REDIS', {}))
+# Shares one connection pool among the requests handled by the event loop of an ASGI worker
+aredis = InstrumentedAsyncRedis(**getattr(settings, 'REDIS', {}))
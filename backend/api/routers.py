@@ -0,0 +1,136 @@
+import contextlib
+import contextvars
+import random
+import time
+from typing import Iterator, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .models import ShortUrl
+from . import shards
+
+PIN_COOKIE = 'primary_until'
+
+# Whether reads may go to a replica, see `replica_reads()`
+_replica_reads: contextvars.ContextVar[bool] = contextvars.ContextVar('replica_reads',
+                                                                      default=False)
+# {"pinned": ..., "wrote": ...} of the request being handled, see `ReplicaPinMiddleware`
+_request_state: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar('request_state',
+                                                                               default=None)
+
+
+@contextlib.contextmanager
+def replica_reads() -> Iterator[None]:
+    """Lets the queries made within go to a replica, which may lag behind the primary."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def read_alias(primary: str) -> str:
+    """Returns a random replica of the `primary` database for reads within `replica_reads()`
+    unless the request is pinned to the primary, otherwise `primary`."""
+    if not _replica_reads.get():
+        return primary
+    state = _request_state.get()
+    if state is not None and state['pinned']:
+        return primary
+    replicas = getattr(settings, 'REPLICA_DATABASES', {}).get(primary)
+    return random.choice(replicas) if replicas else primary
+
+
+class DatabaseRouter:
+    """Routes ShortUrl queries to the shard of the slug given by the `slug` hint, see
+    `api.shards.manager()`, or by the saved instance. Queries without either go to `default`,
+    use `using()` to fan out over `api.shards.aliases()`.
+
+    Reads of this app's models within `replica_reads()` go to a replica, see `read_alias()`.
+    The other models live on `default` only.
+    """
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        # Sessions, e.g. loaded lazily by a listing, are read from where they are written
+        if model._meta.app_label != 'api':
+            return None
+        return read_alias(self._primary(model, hints))
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        if model._meta.app_label != 'api':
+            return None
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return self._primary(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> Optional[bool]:
+        if db in shards.aliases() and db != 'default' and app_label == 'api' \
+                and model_name is not None:
+            return model_name == 'shorturl'
+        return None
+
+    @staticmethod
+    def _primary(model, hints: dict) -> str:
+        if model is not ShortUrl:
+            return 'default'
+        instance = hints.get('instance')
+        slug = hints.get('slug', instance.slug if instance is not None else None)
+        return 'default' if slug is None else shards.shard(slug)
+
+
+class ReplicaPinMiddleware:
+    """Pins the requests of a client to the primary for REPLICA_PIN_SECONDS after it wrote, so
+    that it reads its own writes, e.g. lists a URL it just shortened, despite replication lag.
+
+    The pin is a cookie holding its expiry, which costs no lookup on every request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self._state(request)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._pin(response, state)
+
+    async def __acall__(self, request):
+        state = self._state(request)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._pin(response, state)
+
+    @staticmethod
+    def _state(request) -> dict:
+        now = time.time()
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        # A client cannot pin itself for longer than a write would
+        pinned = now < pinned_until <= now + getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+        return {'pinned': pinned, 'wrote': False}
+
+    @staticmethod
+    def _pin(response, state: dict):
+        if state['wrote'] and getattr(settings, 'REPLICA_DATABASES', []):
+            seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+            response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=seconds,
+                                httponly=True, samesite='Lax')
+        return response
@@ -6,4 +6,4 @@ from . import models
 class ShortUrlSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.ShortUrl
-        fields = ['slug', 'url']
+        fields = ['slug', 'url', 'expires_at']
@@ -0,0 +1,17 @@
+"""Session engines keeping the ephemeral user IDs out of the database, see SESSION_MODE.
+
+Both fall back to sessions stored by the database engine before the switch, so users keep their
+URLs. Sessions are moved over on their first use. Once they all have been, SESSION_DB_FALLBACK
+turns the fallback off, so unknown session keys no longer query the database.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import db
+
+
+def load_db_session(session_key: str) -> dict:
+    """Returns the data of a session stored by the database engine, or {} if there is none."""
+    # Database session keys are alphanumeric, unlike signed cookies
+    if (not getattr(settings, 'SESSION_DB_FALLBACK', True)
+            or not session_key or not session_key.isalnum()):
+        return {}
+    return db.SessionStore(session_key).load()
@@ -0,0 +1,19 @@
+from django.contrib.sessions.backends import cache
+
+from . import load_db_session
+
+
+class SessionStore(cache.SessionStore):
+    """Keeps sessions in the SESSION_CACHE_ALIAS cache, Redis in the "redis" SESSION_MODE."""
+
+    def load(self):
+        session_key = self.session_key
+        data = super().load()
+        if not data and session_key is not None:
+            data = load_db_session(session_key)
+            if data:
+                # Moves the session over under the same key, so the cookie stays valid
+                self._session_key = session_key
+                expiry_age = self.get_expiry_age(expiry=data.get('_session_expiry'))
+                self._cache.set(self.cache_key, data, expiry_age)
+        return data
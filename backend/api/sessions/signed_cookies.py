@@ -0,0 +1,16 @@
+from django.contrib.sessions.backends import signed_cookies
+
+from . import load_db_session
+
+
+class SessionStore(signed_cookies.SessionStore):
+    """Keeps the session data in a signed cookie, so sessions never touch the database."""
+
+    def load(self):
+        session_key = self.session_key
+        data = super().load()
+        if not data and self.modified:
+            # Not a signed cookie. A database session found instead is rewritten as one, since
+            # the session stays modified.
+            data = load_db_session(session_key)
+        return data
@@ -0,0 +1,103 @@
+import hashlib
+from collections import defaultdict
+from typing import Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ShortUrl
+from . import cache, routers
+
+
+def aliases() -> list[str]:
+    """Databases holding ShortUrl rows, `default` first."""
+    return getattr(settings, 'SHORTURL_SHARDS', ['default'])
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash of Lamping and Veach: growing `buckets` by one moves only a
+    1/`buckets` share of the keys, all of them into the new bucket."""
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def _index(slug: str, count: int) -> int:
+    # Unlike hash(), stable across processes
+    key = int.from_bytes(hashlib.blake2b(slug.encode(), digest_size=8).digest(), 'big')
+    return jump_hash(key, count)
+
+
+def shard(slug: str) -> str:
+    """Returns the database holding the short URL of `slug`."""
+    shards = aliases()
+    return shards[_index(slug, len(shards))] if len(shards) > 1 else shards[0]
+
+
+def previous_shard(slug: str) -> Optional[str]:
+    """Returns the database which held `slug` before shards were added, if it differs, while
+    `manage.py rebalance_shards` may not have moved it yet."""
+    count = getattr(settings, 'SHORTURL_PREVIOUS_SHARD_COUNT', None)
+    if not count:
+        return None
+    previous = aliases()[_index(slug, count)]
+    return previous if previous != shard(slug) else None
+
+
+def group(slugs: Iterable[str]) -> dict[str, list[str]]:
+    """Groups slugs by their shard."""
+    groups = defaultdict(list)
+    for slug in slugs:
+        groups[shard(slug)].append(slug)
+    return groups
+
+
+def manager(slug: str):
+    """Returns a ShortUrl manager whose queries go to the shard of `slug`, or one of its
+    replicas, see `api.routers.DatabaseRouter`."""
+    return ShortUrl.objects.db_manager(hints={'slug': slug})
+
+
+def fan_out(queryset) -> list:
+    """Returns `queryset` on every shard, or on replicas of them within `replica_reads()`."""
+    return [queryset.using(routers.read_alias(alias)) for alias in aliases()]
+
+
+def rebalance(chunk_size: int = 1000) -> Iterator[tuple[str, str, int]]:
+    """Moves the rows stored on another shard than theirs, e.g. after shards were added.
+    Yields the source and target shard and the number of rows moved per chunk.
+
+    Rows are copied before they are deleted, so a lookup finds them on one shard or the other
+    all along, see `previous_shard()`. An interrupted rebalancing can be run again.
+    """
+    for alias in aliases():
+        last_slug = ''
+        while True:
+            chunk = list(ShortUrl.objects.using(alias).filter(slug__gt=last_slug)
+                         .order_by('slug')[:chunk_size])
+            if not chunk:
+                break
+            last_slug = chunk[-1].slug
+            moving = defaultdict(list)
+            for short_url in chunk:
+                if shard(short_url.slug) != alias:
+                    moving[shard(short_url.slug)].append(short_url)
+            for target, short_urls in moving.items():
+                _copy(short_urls, target)
+                slugs = [short_url.slug for short_url in short_urls]
+                ShortUrl.objects.using(alias).filter(slug__in=slugs).delete()
+                cache.invalidate(*slugs)
+                yield alias, target, len(short_urls)
+
+
+def _copy(short_urls: list[ShortUrl], alias: str) -> None:
+    created_at = [short_url.created_at for short_url in short_urls]
+    with transaction.atomic(using=alias):
+        ShortUrl.objects.using(alias).bulk_create(short_urls, ignore_conflicts=True)
+        # bulk_create() sets the auto_now_add creation times to now
+        for short_url, value in zip(short_urls, created_at):
+            short_url.created_at = value
+        ShortUrl.objects.using(alias).bulk_update(short_urls, ['created_at'])
@@ -1,61 +1,606 @@
-import random
+import hashlib
 import uuid
-from string import ascii_letters, digits
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Iterator, Optional, Union
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 
+from .bloom import slug_filter
 from .models import ShortUrl
-from . import redis
+from .slugs import NoFreeSlugsError
+from .singleflight import AsyncSingleFlight, SingleFlight
+from . import cache, clicks, metrics, redis, routers, shards, slugs, snapshot
 
-_SYMBOLS = ascii_letters + digits
+RANDOM_SLUG_LENGTH = 6
+_GENERATED_SLUG_ATTEMPTS = 3
 
+_SLUG_FIELD = ShortUrl._meta.get_field('slug')
+# First path segments routed elsewhere, see urls.py, so short URLs with these slugs would never
+# be reached
+RESERVED_SLUGS = frozenset({'admin', 'api', 'metrics'})
 
-def shorten(slug: str, url: str, user_id: uuid.UUID) -> None:
-    if ShortUrl.objects.filter(slug=slug).exists():
-        raise ShortenDuplicateError()
+_loads = SingleFlight()
+_aloads = AsyncSingleFlight()
+
+
+def shorten(slug: str, url: str, user_id: uuid.UUID,
+            expires_at: Union[datetime, str, None] = None) -> None:
+    """Saves a short URL with a single INSERT, a taken slug being detected by the primary key,
+    and writes it through to the cache so that even the first redirect is served from Redis.
 
-    short_url = ShortUrl(slug=slug, url=url, user_id=user_id)
+    The short URL stops resolving at `expires_at`, a datetime or an ISO 8601 string, if given.
+    """
+    short_url = ShortUrl(slug=slug, url=url, user_id=user_id, expires_at=expires_at)
 
     try:
-        short_url.full_clean()
+        _full_clean(short_url)
     except ValidationError as e:
         raise ShortenBadInputError(str(e)) from e
+    if short_url.expires_at is not None and short_url.expires_at <= timezone.now():
+        raise ShortenBadInputError('The expiry time must be in the future.')
+    # Cleaning turns a slug given as a number into a string
+    slug = short_url.slug
+
+    previous = shards.previous_shard(slug)
+    if previous is not None and ShortUrl.objects.using(previous).filter(slug=slug).exists():
+        # Taken, but not moved to its shard yet
+        raise ShortenDuplicateError()
+    try:
+        _insert(short_url)
+    except IntegrityError as e:
+        raise ShortenDuplicateError() from e
+
+    pipeline = redis.redis.pipeline(transaction=False)
+    slug_filter.add(slug, pipeline=pipeline)
+    value = cache.encode(url, short_url.expires_at)
+    # Also replaces a negative cache entry left by an earlier lookup
+    cache.slug_cache.set(slug, value, pipeline=pipeline)
+    # Workers may still hold the value of a reaped short URL of the slug
+    cache.invalidate(slug, pipeline=pipeline)
+    pipeline.execute()
+    cache.local_cache.set(slug, value)
+
+
+def _insert(short_url: ShortUrl) -> None:
+    alias = shards.shard(short_url.slug)
+    if transaction.get_connection(alias).in_atomic_block:
+        # A savepoint keeps the surrounding transaction usable after a duplicate
+        with transaction.atomic(using=alias):
+            short_url.save(force_insert=True)
+    else:
+        # In autocommit mode, atomic() would add round trips to begin and commit
+        short_url.save(force_insert=True)
+
+
+def url_hash(url: str) -> str:
+    """Returns the value of `ShortUrl.url_hash` for `url`, which the database computes as MD5."""
+    return hashlib.md5(url.encode(), usedforsecurity=False).hexdigest()
+
+
+def existing_slugs(urls: Iterable[str], user_id: uuid.UUID) -> dict[str, str]:
+    """Returns the oldest slug of each of the URLs that `user_id` already shortened without an
+    expiry time, with a lookup of the (user_id, url_hash) index per shard.
+
+    Reads go to the primaries so that a URL shortened just before is found. Concurrent requests
+    may still shorten the same URL twice.
+    """
+    urls = set(urls)
+    if not urls:
+        return {}
+    hashes = [url_hash(url) for url in urls]
+    found = []
+    for alias in shards.aliases():
+        found += (ShortUrl.objects.using(alias)
+                  .filter(user_id=user_id, url_hash__in=hashes, expires_at__isnull=True)
+                  .values_list('created_at', 'slug', 'url'))
+    slugs_by_url = {}
+    for _, slug, url in sorted(found):
+        # The URL comparison rules out hash collisions
+        if url in urls:
+            slugs_by_url.setdefault(url, slug)
+    return slugs_by_url
+
+
+def shorten_many(items: list, user_id: uuid.UUID, chunk_size: int = 500,
+                 dedupe: bool = False) -> list[dict]:
+    """Saves `{"url": ..., "slug": ...}` items, generating slugs for the ones without one.
+
+    Returns a result per item: its slug and URL with a "created" status, or a "conflict" or
+    "invalid" status along with validation errors. With `dedupe`, items without a slug whose URL
+    the user already shortened, or which repeat the URL of an earlier item, get its slug with an
+    "existing" status instead.
+    """
+    results: list[dict] = [{} for _ in items]
+    generated = set()
+    reused = _reused(items, user_id) if dedupe else {}
+    missing_slugs = sum(1 for index, item in enumerate(items)
+                        if isinstance(item, dict) and 'slug' not in item and index not in reused)
+    new_slugs = iter(slugs.generator.generate_many(RANDOM_SLUG_LENGTH, missing_slugs)
+                     if missing_slugs else [])
+
+    pending = []
+    seen_slugs = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('url'), str):
+            results[index] = _result(None, None, 'invalid', errors={'url': ['This field is required.']})
+            continue
+        if index in reused:
+            continue
+        if 'slug' in item:
+            slug = item['slug']
+        else:
+            slug = next(new_slugs)
+            generated.add(index)
+        short_url = ShortUrl(slug=slug, url=item['url'], user_id=user_id)
+        try:
+            _full_clean(short_url)
+        except ValidationError as e:
+            results[index] = _result(slug, item['url'], 'invalid', errors=e.message_dict)
+            continue
+        if slug in seen_slugs:
+            results[index] = _result(slug, item['url'], 'conflict')
+            continue
+        seen_slugs.add(slug)
+        pending.append((index, short_url))
+
+    created = []
+    for attempt in range(1, _GENERATED_SLUG_ATTEMPTS + 1):
+        conflicts = []
+        for start in range(0, len(pending), chunk_size):
+            chunk_created, chunk_conflicts = _insert_chunk(pending[start:start + chunk_size])
+            created += chunk_created
+            conflicts += chunk_conflicts
+
+        # Generated slugs never repeat, but some may have been taken as custom slugs
+        pending = []
+        for index, short_url in conflicts:
+            if index in generated and attempt < _GENERATED_SLUG_ATTEMPTS:
+                pending.append((index, short_url))
+            else:
+                results[index] = _result(short_url.slug, short_url.url, 'conflict')
+        if not pending:
+            break
+        metrics.inc('slug_generation_retries_total', len(pending), endpoint='bulk_shorten')
+        new_slugs = slugs.generator.generate_many(RANDOM_SLUG_LENGTH, len(pending))
+        for (_, short_url), slug in zip(pending, new_slugs):
+            short_url.slug = slug
+
+    pipeline = redis.redis.pipeline(transaction=False)
+    for index, short_url in created:
+        results[index] = _result(short_url.slug, short_url.url, 'created')
+        cache.slug_cache.set(short_url.slug, short_url.url, pipeline=pipeline)
+    slug_filter.add(*(short_url.slug for _, short_url in created), pipeline=pipeline)
+    cache.invalidate(*(short_url.slug for _, short_url in created), pipeline=pipeline)
+    pipeline.execute()
+
+    # An earlier item comes before the items repeating its URL
+    for index, source in reused.items():
+        if isinstance(source, str):
+            results[index] = _result(source, items[index]['url'], 'existing')
+        elif results[source]['status'] == 'created':
+            results[index] = _result(results[source]['slug'], items[index]['url'], 'existing')
+        else:
+            results[index] = dict(results[source])
+    if reused:
+        metrics.inc('shorten_deduplicated_total', len(reused), endpoint='bulk_shorten')
+    return results
 
-    short_url.save()
+
+def _reused(items: list, user_id: uuid.UUID) -> dict[int, Union[str, int]]:
+    """Maps the indexes of the items without a slug whose URL the user already shortened to the
+    existing slug, and of the ones repeating the URL of an earlier such item to its index."""
+    urls = [(index, item['url']) for index, item in enumerate(items)
+            if isinstance(item, dict) and 'slug' not in item and isinstance(item.get('url'), str)]
+    existing = existing_slugs((url for _, url in urls), user_id)
+    reused: dict[int, Union[str, int]] = {}
+    first_indexes = {}
+    for index, url in urls:
+        if url in existing:
+            reused[index] = existing[url]
+        elif url in first_indexes:
+            reused[index] = first_indexes[url]
+        else:
+            first_indexes[url] = index
+    return reused
+
+
+def _full_clean(short_url: ShortUrl) -> None:
+    short_url.full_clean(validate_unique=False)
+    if short_url.slug in RESERVED_SLUGS:
+        raise ValidationError({'slug': [f'The slug "{short_url.slug}" is reserved.']})
+
+
+def _result(slug: Optional[str], url: Optional[str], status: str, **extra) -> dict:
+    return {'slug': slug, 'url': url, 'status': status, **extra}
+
+
+def _insert_chunk(chunk: list[tuple[int, ShortUrl]]) -> tuple[list, list]:
+    """Inserts the chunk with one query per shard, splitting out the conflicting short URLs."""
+    occupied = _occupied([short_url.slug for _, short_url in chunk])
+    conflicts = [entry for entry in chunk if entry[1].slug in occupied]
+    by_shard = defaultdict(list)
+    for entry in chunk:
+        if entry[1].slug not in occupied:
+            by_shard[shards.shard(entry[1].slug)].append(entry)
+    created = []
+    for alias, free in by_shard.items():
+        shard_created, shard_conflicts = _insert_shard_chunk(alias, free)
+        created += shard_created
+        conflicts += shard_conflicts
+    return created, conflicts
+
+
+def _occupied(slug_list: list[str]) -> set[str]:
+    """Returns the taken slugs, looking them up in their previous shards too while shards are
+    being rebalanced."""
+    locations = defaultdict(list)
+    for slug in slug_list:
+        locations[shards.shard(slug)].append(slug)
+        previous = shards.previous_shard(slug)
+        if previous is not None:
+            locations[previous].append(slug)
+    occupied = set()
+    for alias, group in locations.items():
+        occupied.update(ShortUrl.objects.using(alias).filter(slug__in=group)
+                        .values_list('slug', flat=True))
+    return occupied
+
+
+def _insert_shard_chunk(alias: str, free: list[tuple[int, ShortUrl]]) -> tuple[list, list]:
+    try:
+        with transaction.atomic(using=alias):
+            shards.manager(free[0][1].slug).bulk_create([short_url for _, short_url in free])
+        return free, []
+    except IntegrityError:
+        pass
+
+    # Some slugs got taken concurrently, fall back to inserting one by one
+    created, conflicts = [], []
+    for entry in free:
+        try:
+            with transaction.atomic(using=alias):
+                entry[1].save(force_insert=True)
+            created.append(entry)
+        except IntegrityError:
+            conflicts.append(entry)
+    return created, conflicts
 
 
 def unshorten(slug: str) -> str:
-    cached_url = redis.redis.get(slug)
-    if cached_url:
-        return cached_url.decode()
-    return _unshorten_uncached(slug)
+    if not is_valid_slug(slug):
+        _count_lookups('not_found')
+        raise UnshortenError()
+    value = cache.local_cache.get(slug)
+    if value is not None and cache.decode(value):
+        _count_lookups('local_hit')
+        return cache.decode(value)
+    url = _snapshot_url(slug)
+    if url is not None:
+        return url
+    cached_value = cache.slug_cache.get(slug)
+    if cached_value == '':
+        # Negative cache entry: the slug was recently looked up and not found
+        _count_lookups('negative_hit')
+        raise UnshortenError()
+    if cached_value:
+        _count_lookups('redis_hit')
+        value = cached_value
+    else:
+        value = _unshorten_uncached(slug)
+    cache.local_cache.set(slug, value)
+    return _url(value)
+
+
+def is_valid_slug(slug: str) -> bool:
+    """Tells whether `slug` could be stored as a ShortUrl slug. Lookups reject other strings
+    before they reach Redis, where they could name one of the keys of other data."""
+    try:
+        _SLUG_FIELD.run_validators(slug)
+    except ValidationError:
+        return False
+    return bool(slug)
+
+
+def _snapshot_url(slug: str) -> Optional[str]:
+    """Returns the URL of `slug` in the snapshot shared by the worker processes, if any. Values
+    are not copied into the local cache, which would duplicate them in every process.
+
+    Slugs expired in the snapshot may have been reaped and shortened again since, so they are
+    looked up further.
+    """
+    value = snapshot.slug_snapshot.get(slug)
+    url = cache.decode(value) if value is not None else ''
+    if not url:
+        return None
+    _count_lookups('snapshot_hit')
+    return url
+
+
+def _url(value: str) -> str:
+    """Returns the URL of a cached value, raising `UnshortenError` if it expired."""
+    url = cache.decode(value)
+    if not url:
+        raise UnshortenError()
+    return url
 
 
 def _unshorten_uncached(slug: str) -> str:
+    """Loads the value to cache for `slug`, see `cache.encode()`."""
+    if not slug_filter.might_contain(slug):
+        _count_lookups('filtered')
+        raise UnshortenError()
+    options = _single_flight_options()
+    if not options['local']:
+        return _load(slug, options)
+
+    loaded = False
+
+    def load():
+        nonlocal loaded
+        loaded = True
+        return _load(slug, options)
+
+    try:
+        return _loads.do(slug, load)
+    finally:
+        if not loaded:
+            _count_lookups('coalesced')
+
+
+def _load(slug: str, options: dict) -> str:
+    locked = options['redis'] and cache.slug_cache.lock_fill(slug, options['lock_ttl'])
+    if options['redis'] and not locked:
+        # Another process is loading the slug
+        cached_value = cache.slug_cache.wait_for(slug, options['wait'], options['poll_interval'])
+        if cached_value is not None:
+            return _coalesced(cached_value)
     try:
-        url = ShortUrl.objects.get(slug=slug).url
-        redis.redis.set(slug, url)
+        short_url = _get(slug)
+        _count_lookups('db_hit')
+        # Expired but not reaped yet short URLs are cached too, their value tells they expired
+        value = cache.encode(short_url.url, short_url.expires_at)
+        cache.slug_cache.set(slug, value)
+        return value
+    except ShortUrl.DoesNotExist as e:
+        _count_lookups('not_found')
+        cache.slug_cache.set_negative(slug)
+        raise UnshortenError() from e
+    finally:
+        # Later misses, e.g. after an eviction, must not wait for a fill that is done
+        if locked:
+            cache.slug_cache.unlock_fill(slug)
+
+
+async def aunshorten(slug: str) -> str:
+    """Asynchronous `unshorten()` for ASGI workers."""
+    if not is_valid_slug(slug):
+        _count_lookups('not_found')
+        raise UnshortenError()
+    value = cache.local_cache.get(slug)
+    if value is not None and cache.decode(value):
+        _count_lookups('local_hit')
+        return cache.decode(value)
+    url = _snapshot_url(slug)
+    if url is not None:
         return url
+    cached_value = await cache.slug_cache.aget(slug)
+    if cached_value == '':
+        _count_lookups('negative_hit')
+        raise UnshortenError()
+    if cached_value:
+        _count_lookups('redis_hit')
+        value = cached_value
+    else:
+        value = await _aunshorten_uncached(slug)
+    cache.local_cache.set(slug, value)
+    return _url(value)
+
+
+async def _aunshorten_uncached(slug: str) -> str:
+    if not await slug_filter.amight_contain(slug):
+        _count_lookups('filtered')
+        raise UnshortenError()
+    options = _single_flight_options()
+    if not options['local']:
+        return await _aload(slug, options)
+
+    loaded = False
+
+    async def load():
+        nonlocal loaded
+        loaded = True
+        return await _aload(slug, options)
+
+    try:
+        return await _aloads.do(slug, load)
+    finally:
+        if not loaded:
+            _count_lookups('coalesced')
+
+
+async def _aload(slug: str, options: dict) -> str:
+    locked = options['redis'] and await cache.slug_cache.alock_fill(slug, options['lock_ttl'])
+    if options['redis'] and not locked:
+        cached_value = await cache.slug_cache.await_for(slug, options['wait'],
+                                                      options['poll_interval'])
+        if cached_value is not None:
+            return _coalesced(cached_value)
+    try:
+        short_url = await _aget(slug)
+        _count_lookups('db_hit')
+        value = cache.encode(short_url.url, short_url.expires_at)
+        await cache.slug_cache.aset(slug, value)
+        return value
     except ShortUrl.DoesNotExist as e:
+        _count_lookups('not_found')
+        await cache.slug_cache.aset_negative(slug)
         raise UnshortenError() from e
+    finally:
+        if locked:
+            await cache.slug_cache.aunlock_fill(slug)
 
 
-def generate_unique_slug(length: int) -> str:
-    if length < 1:
-        raise ValueError(f'invalid {length=}')
-    slug = ''.join(random.choices(_SYMBOLS, k=length))
-    if ShortUrl.objects.filter(slug=slug).exists():
-        # Just generated an occupied slug, try again
+def _get(slug: str) -> ShortUrl:
+    with routers.replica_reads():
         try:
-            return generate_unique_slug(length)
-        except RecursionError:
-            # Slug space of this length is (almost) exhausted
-            raise NoFreeSlugsError()
-    return slug
+            return shards.manager(slug).get(slug=slug)
+        except ShortUrl.DoesNotExist:
+            previous = shards.previous_shard(slug)
+            if previous is None:
+                raise
+            return ShortUrl.objects.using(routers.read_alias(previous)).get(slug=slug)
 
 
-class NoFreeSlugsError(Exception):
-    pass
+async def _aget(slug: str) -> ShortUrl:
+    with routers.replica_reads():
+        try:
+            return await shards.manager(slug).aget(slug=slug)
+        except ShortUrl.DoesNotExist:
+            previous = shards.previous_shard(slug)
+            if previous is None:
+                raise
+            return await ShortUrl.objects.using(routers.read_alias(previous)).aget(slug=slug)
+
+
+def _single_flight_options() -> dict:
+    return {'local': True, 'redis': True, 'lock_ttl': 1.0, 'wait': 0.5, 'poll_interval': 0.01,
+            **getattr(settings, 'SLUG_SINGLE_FLIGHT', {})}
+
+
+def _coalesced(cached_value: str) -> str:
+    """Returns the outcome another process cached while this one waited for it."""
+    _count_lookups('coalesced')
+    if not cached_value:
+        raise UnshortenError()
+    return cached_value
+
+
+def unshorten_many(slug_list: list[str]) -> dict[str, Optional[str]]:
+    """Resolves the slugs with one Redis round trip for lookups (and one refreshing the TTLs of
+    hits, if any need it), one DB query and one Redis round trip for filling the cache. Unknown
+    and expired slugs map to None."""
+    values: dict[str, Optional[str]] = {}
+    invalid = 0
+    for slug in slug_list:
+        if is_valid_slug(slug):
+            value = cache.local_cache.get(slug)
+            # Expired slugs may have been reaped and shortened again since
+            values[slug] = value if value is None or cache.decode(value) else None
+        elif slug not in values:
+            # Like a negative cache entry
+            values[slug] = ''
+            invalid += 1
+    uncached = [slug for slug, value in values.items() if value is None]
+    _count_lookups('not_found', invalid)
+    _count_lookups('local_hit', len(values) - len(uncached) - invalid)
+    if not uncached:
+        return _urls(values)
+
+    unknown = []
+    for slug in uncached:
+        value = snapshot.slug_snapshot.get(slug)
+        if value is not None and cache.decode(value):
+            values[slug] = value
+        else:
+            unknown.append(slug)
+    _count_lookups('snapshot_hit', len(uncached) - len(unknown))
+    uncached = unknown
+    if not uncached:
+        return _urls(values)
+
+    misses = []
+    negative_hits = 0
+    for slug, cached_value in zip(uncached, cache.slug_cache.get_many(uncached)):
+        if cached_value:
+            values[slug] = cached_value
+            cache.local_cache.set(slug, cached_value)
+        elif cached_value is None:
+            misses.append(slug)
+        else:
+            negative_hits += 1
+    _count_lookups('redis_hit', len(uncached) - len(misses) - negative_hits)
+    _count_lookups('negative_hit', negative_hits)
+    if not misses:
+        return _urls(values)
+
+    maybe_present = [slug for slug, maybe in zip(misses, slug_filter.might_contain_many(misses))
+                     if maybe]
+    _count_lookups('filtered', len(misses) - len(maybe_present))
+    misses = maybe_present
+    found = _fetch(misses)
+    _count_lookups('db_hit', len(found))
+    _count_lookups('not_found', len(misses) - len(found))
+    pipeline = redis.redis.pipeline(transaction=False)
+    for slug in misses:
+        if slug in found:
+            values[slug] = found[slug]
+            cache.slug_cache.set(slug, found[slug], pipeline=pipeline)
+        else:
+            cache.slug_cache.set_negative(slug, pipeline=pipeline)
+    pipeline.execute()
+    return _urls(values)
+
+
+def _fetch(slug_list: list[str]) -> dict[str, str]:
+    """Looks the slugs up with a query per shard, returning the values to cache of found ones."""
+    found = {}
+    with routers.replica_reads():
+        for alias, group in shards.group(slug_list).items():
+            found.update(_values(shards.manager(group[0]).filter(slug__in=group)))
+        moving = defaultdict(list)
+        for slug in slug_list:
+            previous = shards.previous_shard(slug) if slug not in found else None
+            if previous is not None:
+                moving[previous].append(slug)
+        for alias, group in moving.items():
+            found.update(_values(ShortUrl.objects.using(routers.read_alias(alias))
+                                 .filter(slug__in=group)))
+    return found
+
+
+def _values(queryset) -> dict[str, str]:
+    return {slug: cache.encode(url, expires_at)
+            for slug, url, expires_at in queryset.values_list('slug', 'url', 'expires_at')}
+
+
+def _urls(values: dict[str, Optional[str]]) -> dict[str, Optional[str]]:
+    return {slug: cache.decode(value) or None if value else None for slug, value in values.items()}
+
+
+def delete_expired(batch_size: int = 1000) -> Iterator[int]:
+    """Deletes the short URLs expired by now in batches along with their click statistics,
+    evicting them from the caches. Yields the number of short URLs deleted per batch.
+
+    Every batch is found through the expiry index of a shard and deleted by primary key in a
+    statement of its own, so row locks are held briefly and replicas can keep up in between.
+    """
+    now = timezone.now()
+    for alias in shards.aliases():
+        expired = ShortUrl.objects.using(alias).filter(expires_at__lte=now).order_by('expires_at')
+        while True:
+            batch = list(expired.values_list('slug', flat=True)[:batch_size])
+            if not batch:
+                break
+            deleted, _ = ShortUrl.objects.using(alias).filter(slug__in=batch).delete()
+            # The slugs are free for new short URLs, which must not inherit their clicks
+            clicks.forget(batch)
+            cache.slug_cache.delete(*batch)
+            cache.invalidate(*batch)
+            yield deleted
+
+
+def _count_lookups(result: str, amount: int = 1) -> None:
+    if amount:
+        metrics.inc('unshorten_lookups_total', amount, result=result)
+
+
+def generate_unique_slug(length: int) -> str:
+    """Generates a slug never generated before. It may still be occupied as a custom slug."""
+    return slugs.generator.generate(length)
 
 
 class ShortenError(Exception):
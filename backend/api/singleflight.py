@@ -0,0 +1,58 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent loads of the same key within a process: the first caller runs the
+    load and callers arriving while it runs wait for its outcome instead of loading again."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+
+    def do(self, key: str, load: Callable[[], Any]) -> Any:
+        """Returns the value of `load()`, or raises its exception, shared by concurrent callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = load()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` for coroutines of one event loop."""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(load())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # A cancelled caller must not cancel the load the others are waiting for
+        return await asyncio.shield(task)
@@ -0,0 +1,135 @@
+import hashlib
+import math
+import threading
+from string import ascii_letters, digits
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ShortUrl, SlugCounter
+
+ALPHABET = ascii_letters + digits
+MAX_LENGTH = ShortUrl._meta.get_field('slug').max_length
+
+
+class FeistelPermutation:
+    """Keyed pseudorandom bijection of range(domain).
+
+    Uses the FE1 construction (a Feistel network over Z_a x Z_b with a * b >= domain) and
+    cycle-walks values falling outside of the domain back into it.
+    """
+
+    def __init__(self, domain: int, key: bytes, rounds: int = 4):
+        self.domain = domain
+        self.a = math.isqrt(domain - 1) + 1
+        self.b = -(-domain // self.a)
+        self.key = key
+        self.rounds = rounds
+
+    def _round(self, i: int, value: int) -> int:
+        digest = hashlib.blake2b(f'{i}:{value}'.encode(), key=self.key, digest_size=16).digest()
+        return int.from_bytes(digest, 'big') % self.a
+
+    def _encrypt(self, x: int) -> int:
+        for i in range(self.rounds):
+            left, right = divmod(x, self.b)
+            x = self.a * right + (left + self._round(i, right)) % self.a
+        return x
+
+    def __call__(self, x: int) -> int:
+        if not 0 <= x < self.domain:
+            raise ValueError(f'{x} is out of the permutation domain')
+        x = self._encrypt(x)
+        while x >= self.domain:
+            x = self._encrypt(x)
+        return x
+
+
+def capacity(length: int) -> int:
+    return len(ALPHABET) ** length
+
+
+def encode(number: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        number, index = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[index])
+    return ''.join(chars)
+
+
+class SlugGenerator:
+    """Generates random-looking slugs which never repeat, without checking the database.
+
+    The n-th slug of a length is the n-th counter value passed through a keyed permutation of
+    that length's slug space. Counter values are reserved from the database in blocks of
+    `block_size`, so a worker touches the database once per `block_size` slugs.
+    Values left unused in a block when a worker stops are skipped, never reissued.
+    """
+
+    def __init__(self, key: str, block_size: int = 100):
+        self.key = hashlib.blake2b(key.encode(), digest_size=32).digest()
+        self.block_size = block_size
+        self._blocks: dict[int, tuple[int, int]] = {}
+        self._permutations: dict[int, FeistelPermutation] = {}
+        self._lock = threading.Lock()
+
+    def generate(self, length: int) -> str:
+        return self.generate_many(length, 1)[0]
+
+    def generate_many(self, length: int, count: int) -> list[str]:
+        """Generates `count` slugs, or raises NoFreeSlugsError without using any up if fewer
+        than `count` are left, see `available()`."""
+        if not 1 <= length <= MAX_LENGTH:
+            raise ValueError(f'invalid {length=}')
+        with self._lock:
+            permutation = self._permutation(length)
+            start, end = self._blocks.get(length, (0, 0))
+            taken = min(end - start, count)
+            numbers = list(range(start, start + taken))
+            start += taken
+            if taken < count:
+                # Raises before the rest of the block is given up, so it is not lost
+                start, end = self._reserve(length, count - taken)
+                numbers.extend(range(start, start + count - taken))
+                start += count - taken
+            self._blocks[length] = (start, end)
+        return [encode(permutation(number), length) for number in numbers]
+
+    def available(self, length: int) -> int:
+        """Returns the number of slugs of `length` this generator can still generate."""
+        with self._lock:
+            start, end = self._blocks.get(length, (0, 0))
+            reserved = SlugCounter.objects.filter(length=length).values_list(
+                'next_value', flat=True).first() or 0
+        return end - start + capacity(length) - reserved
+
+    def _permutation(self, length: int) -> FeistelPermutation:
+        if length not in self._permutations:
+            key = hashlib.blake2b(str(length).encode(), key=self.key).digest()
+            self._permutations[length] = FeistelPermutation(capacity(length), key)
+        return self._permutations[length]
+
+    def _reserve(self, length: int, at_least: int) -> tuple[int, int]:
+        size = max(self.block_size, at_least)
+        with transaction.atomic():
+            counter, _ = SlugCounter.objects.select_for_update().get_or_create(length=length)
+            start = counter.next_value
+            if start + at_least > capacity(length):
+                raise NoFreeSlugsError()
+            counter.next_value = min(start + size, capacity(length))
+            counter.save(update_fields=['next_value'])
+        return start, counter.next_value
+
+
+def space_usage() -> list[tuple[int, int, int]]:
+    """Returns (length, reserved slugs, capacity) for every length slugs were generated of."""
+    return [(counter.length, counter.next_value, capacity(counter.length))
+            for counter in SlugCounter.objects.order_by('length')]
+
+
+class NoFreeSlugsError(Exception):
+    pass
+
+
+generator = SlugGenerator(getattr(settings, 'SLUG_PERMUTATION_KEY', settings.SECRET_KEY),
+                          getattr(settings, 'SLUG_COUNTER_BLOCK_SIZE', 100))
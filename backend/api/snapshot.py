@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b'SLUGSNP1'
+# Magic, slot count, entry count
+_HEADER = struct.Struct('<8sQQ')
+# Slug hash, record offset + 1 (0 for an empty slot)
+_SLOT = struct.Struct('<QQ')
+# Slug length, value length, followed by the slug and the value
+_RECORD = struct.Struct('<HI')
+
+
+def _hash(slug: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(slug, digest_size=8).digest(), 'little')
+
+
+class SlugSnapshot:
+    """Read-only slug -> cache value hash table in a file, see `manage.py build_slug_snapshot`.
+
+    Worker processes map the file into memory, so they all share one copy of it in the page
+    cache. A rebuilt file replaces the old one atomically and is picked up within
+    `check_interval` seconds. Slugs shortened after the snapshot was built are not in it.
+    """
+
+    def __init__(self, path: Optional[str] = None, check_interval: float = 5):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = float('-inf')
+        self._file_id: Optional[tuple[int, int]] = None
+        # The mapping with its slot count, replaced as a whole so readers never see a mix
+        self._table: Optional[tuple[mmap.mmap, int]] = None
+
+    def get(self, slug: str) -> Optional[str]:
+        """Returns the cache value of `slug`, see `cache.encode()`, or None if it is not in the
+        snapshot."""
+        table = self._current()
+        if table is None:
+            return None
+        mapping, slot_count = table
+        key = slug.encode()
+        slug_hash = _hash(key)
+        records = _HEADER.size + slot_count * _SLOT.size
+        index = slug_hash & (slot_count - 1)
+        while True:
+            stored_hash, offset = _SLOT.unpack_from(mapping, _HEADER.size + index * _SLOT.size)
+            if not offset:
+                return None
+            if stored_hash == slug_hash:
+                position = records + offset - 1
+                slug_length, value_length = _RECORD.unpack_from(mapping, position)
+                position += _RECORD.size
+                if mapping[position:position + slug_length] == key:
+                    position += slug_length
+                    return mapping[position:position + value_length].decode()
+            index = (index + 1) & (slot_count - 1)
+
+    def _current(self) -> Optional[tuple[mmap.mmap, int]]:
+        if self.path is None:
+            return None
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked_at >= self.check_interval:
+                    self._reopen()
+                    self._checked_at = time.monotonic()
+        return self._table
+
+    def _reopen(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._file_id, self._table = None, None
+            return
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if file_id == self._file_id:
+            return
+        self._file_id, self._table = file_id, None
+        try:
+            with open(self.path, 'rb') as file:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, slot_count, _ = _HEADER.unpack_from(mapping)
+        except (OSError, ValueError, struct.error):
+            logger.exception('Failed to open the slug snapshot %s', self.path)
+            return
+        if magic != _MAGIC:
+            logger.error('%s is not a slug snapshot', self.path)
+            return
+        # The replaced mapping is unmapped once the lookups still reading it are done
+        self._file_id, self._table = file_id, (mapping, slot_count)
+
+
+def build(path: str, chunks: Iterator[list[tuple[str, str]]]) -> int:
+    """Writes the chunks of `(slug, value)` to a snapshot file replacing `path` atomically.
+    Returns the number of slugs written.
+
+    Records are streamed to a temporary file, so memory grows only by the 16 bytes of the hash
+    and the offset of each slug.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    hashes, offsets = array('Q'), array('Q')
+    with tempfile.TemporaryFile(dir=directory) as records:
+        offset = 0
+        for chunk in chunks:
+            for slug, value in chunk:
+                key, encoded_value = slug.encode(), value.encode()
+                records.write(_RECORD.pack(len(key), len(encoded_value)) + key + encoded_value)
+                hashes.append(_hash(key))
+                offsets.append(offset + 1)
+                offset += _RECORD.size + len(key) + len(encoded_value)
+
+        # A load factor of at most 1/2 keeps linear probing short
+        slot_count = 8
+        while slot_count < 2 * len(hashes):
+            slot_count *= 2
+        slots = array('Q', bytes(slot_count * _SLOT.size))
+        for slug_hash, record_offset in zip(hashes, offsets):
+            index = slug_hash & (slot_count - 1)
+            while slots[2 * index + 1]:
+                index = (index + 1) & (slot_count - 1)
+            slots[2 * index], slots[2 * index + 1] = slug_hash, record_offset
+        if sys.byteorder == 'big':
+            slots.byteswap()
+
+        records.seek(0)
+        file = tempfile.NamedTemporaryFile(dir=directory, prefix='.snapshot-', delete=False)
+        try:
+            with file:
+                file.write(_HEADER.pack(_MAGIC, slot_count, len(hashes)))
+                file.write(slots.tobytes())
+                shutil.copyfileobj(records, file)
+                file.flush()
+                os.fsync(file.fileno())
+            # Readable by workers running as another user, unlike the temporary file
+            os.chmod(file.name, 0o644)
+            os.replace(file.name, path)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    return len(hashes)
+
+
+slug_snapshot = SlugSnapshot(**getattr(settings, 'SLUG_SNAPSHOT', {}))
@@ -1,8 +1,13 @@
 import uuid
+from unittest.mock import patch
 
 from django.http import HttpResponse
+from fakeredis import FakeAsyncRedis, FakeRedis, FakeServer
+
+from .. import cache, metrics
 
 SHORTEN_ENDPOINT = '/api/shorten/'
+BULK_SHORTEN_ENDPOINT = '/api/shorten/bulk/'
 EXAMPLE_DOT_COM = 'http://example.com'
 SOME_DIFFERENT_URL_DOT_COM = 'http://somedifferenturl.com'
 SLUG_EXAMPLE = 'my_slug'
@@ -12,3 +17,33 @@ UUID_123 = uuid.UUID(int=123)
 
 def get_response_str(response: HttpResponse):
     return response.content.decode()
+
+
+class ClearLocalCacheMixin:
+    """Keeps the per-process slug cache from leaking entries between tests."""
+
+    def setUp(self):
+        super().setUp()
+        cache.local_cache.clear()
+
+
+class FakeRedisMixin(ClearLocalCacheMixin):
+    """Replaces the Redis clients with fresh fakes of one server, the sync one available as
+    `self.redis`."""
+
+    def setUp(self):
+        super().setUp()
+        server = FakeServer()
+        self.redis = FakeRedis(server=server)
+        for name, client in [('redis', self.redis), ('aredis', FakeAsyncRedis(server=server))]:
+            patcher = patch(f'api.redis.{name}', client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class ClearMetricsMixin:
+    """Starts every test with empty metrics of this process."""
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
@@ -1,19 +1,28 @@
+import json
+import tempfile
 import uuid
+from datetime import datetime, timedelta
 from unittest.mock import patch
 
+from django.db import connection
+from django.contrib.sessions.backends import db as db_sessions
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from fakeredis import FakeRedis
 from parameterized import parameterized
 from rest_framework.test import APITestCase
 
-from . import SHORTEN_ENDPOINT, EXAMPLE_DOT_COM, SLUG_EXAMPLE, \
-    SOME_DIFFERENT_URL_DOT_COM, get_response_str, UUID_NULL, UUID_123
-from .. import shorten
+from . import SHORTEN_ENDPOINT, BULK_SHORTEN_ENDPOINT, EXAMPLE_DOT_COM, SLUG_EXAMPLE, \
+    SOME_DIFFERENT_URL_DOT_COM, get_response_str, UUID_NULL, UUID_123, ClearLocalCacheMixin, \
+    ClearMetricsMixin, FakeRedisMixin
+from .. import leases, metrics, routers, shorten
 from ..models import ShortUrl
 from ..serializers import ShortUrlSerializer
 from ..shorten import NoFreeSlugsError
 
 
-class ShorteningAPITestCaseBase(APITestCase):
+class ShorteningAPITestCaseBase(FakeRedisMixin, APITestCase):
     def make_custom_slug_request(self):
         return self.client.post(SHORTEN_ENDPOINT,
                                 {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE})
@@ -56,6 +65,78 @@ class ShorteningAPITestCase(ShorteningAPITestCaseBase):
 
         self.assertEqual(400, response.status_code)
 
+    def test_expiring(self):
+        expires_at = timezone.now() + timedelta(days=1)
+
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE,
+                                                       'expires_at': expires_at.isoformat()})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(expires_at, ShortUrl.objects.get(slug=SLUG_EXAMPLE).expires_at)
+        self.assertEqual(302, self.client.get(f'/{SLUG_EXAMPLE}').status_code)
+
+    def test_naive_expiry(self):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE,
+                                                       'expires_at': '2100-01-01T00:00:00'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(timezone.make_aware(datetime(2100, 1, 1)),
+                         ShortUrl.objects.get(slug=SLUG_EXAMPLE).expires_at)
+
+    def test_empty_expiry(self):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'expires_at': ''})
+
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(ShortUrl.objects.get().expires_at)
+
+    @parameterized.expand([('invalid', 'tomorrow'), ('past', '2020-01-01T00:00:00Z')])
+    def test_bad_expiry(self, _, expires_at):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM,
+                                                       'expires_at': expires_at})
+
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(ShortUrl.objects.exists())
+
+
+class DeduplicatingShorteningAPITestCase(FakeRedisMixin, APITestCase):
+    def shorten(self, **data) -> str:
+        return get_response_str(self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM,
+                                                                    **data}))
+
+    def test_reuses_users_slug(self):
+        slug = self.shorten()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(slug, self.shorten(dedupe=True))
+
+        self.assertEqual(1, ShortUrl.objects.count())
+        self.assertEqual(1, sum(1 for query in queries if 'api_shorturl' in query['sql']))
+
+    def test_opt_in(self):
+        slug = self.shorten()
+
+        self.assertNotEqual(slug, self.shorten())
+
+    def test_other_users_slug(self):
+        slug = self.shorten()
+        self.client.session.flush()
+        self.client.cookies.clear()
+
+        self.assertNotEqual(slug, self.shorten(dedupe=True))
+
+    def test_expiring(self):
+        expires_at = (timezone.now() + timedelta(days=1)).isoformat()
+        expiring_slug = self.shorten(expires_at=expires_at)
+
+        slug = self.shorten(dedupe=True)
+        self.assertNotEqual(expiring_slug, slug)
+        self.assertNotIn(self.shorten(dedupe=True, expires_at=expires_at), [expiring_slug, slug])
+
+    def test_bad_flag(self):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'dedupe': 'maybe'})
+
+        self.assertEqual(400, response.status_code)
+
 
 class ShorteningAPIAuthorizationTestCase(ShorteningAPITestCaseBase):
     def test_records_user_id_in_db(self):
@@ -73,14 +154,35 @@ class ShorteningAPIAuthorizationTestCase(ShorteningAPITestCaseBase):
         self.assertEqual(id1, id2)
 
 
-class CustomSlugShorteningAPITestCase(APITestCase):
+class CustomSlugShorteningAPITestCase(FakeRedisMixin, APITestCase):
     def test_response_contains_slug(self):
         response = self.client.post(SHORTEN_ENDPOINT,
                                     {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE})
         self.assertEqual(SLUG_EXAMPLE, response.content.decode())
 
+    def test_numeric_slug(self):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': 5},
+                                    format='json')
+
+        self.assertEqual('5', response.content.decode())
+        self.assertEqual(EXAMPLE_DOT_COM, self.client.get('/5').url)
+
+    @parameterized.expand([('admin',), ('api',), ('metrics',)])
+    def test_reserved_slug(self, slug):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': slug})
+
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(ShortUrl.objects.filter(slug=slug).exists())
+
+    def test_bulk_reserved_slug(self):
+        response = self.client.post(BULK_SHORTEN_ENDPOINT,
+                                    [{'url': EXAMPLE_DOT_COM, 'slug': 'metrics'}], format='json')
+
+        self.assertEqual('invalid', response.json()[0]['status'])
+        self.assertIn('slug', response.json()[0]['errors'])
 
-class RandomSlugShorteningAPITestCase(APITestCase):
+
+class RandomSlugShorteningAPITestCase(FakeRedisMixin, APITestCase):
     def test_response_content(self):
         slug = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM}).content.decode()
         self.assertEqual(6, len(slug), f'unexpected request length. Request content repr: {slug!r}')
@@ -95,8 +197,109 @@ class RandomSlugShorteningAPITestCase(APITestCase):
         self.assertEqual('Random slug space is exhausted. Try shortening with a longer slug.',
                          response.content.decode())
 
+    @patch('api.shorten.generate_unique_slug')
+    def test_generated_slug_taken_as_custom(self, generate_unique_slug):
+        ShortUrl(url=EXAMPLE_DOT_COM, slug='taken', user_id=UUID_NULL).save()
+        generate_unique_slug.side_effect = ['taken', 'free']
+
+        slug = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM}).content.decode()
+
+        self.assertEqual('free', slug)
+
+
+class BulkShorteningAPITestCase(FakeRedisMixin, APITestCase):
+    def test_shorten(self):
+        ShortUrl(url=EXAMPLE_DOT_COM, slug='taken', user_id=UUID_NULL).save()
+        items = [
+            {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE},
+            {'url': SOME_DIFFERENT_URL_DOT_COM},
+            {'url': EXAMPLE_DOT_COM, 'slug': 'taken'},
+            {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE},
+            {'url': 'not an URL'},
+            {'slug': 'no_url'},
+        ]
+
+        response = self.client.post(BULK_SHORTEN_ENDPOINT, items, format='json')
+
+        self.assertEqual(200, response.status_code)
+        results = response.json()
+        self.assertEqual(['created', 'created', 'conflict', 'conflict', 'invalid', 'invalid'],
+                         [result['status'] for result in results])
+        generated_slug = results[1]['slug']
+        self.assertEqual(6, len(generated_slug))
+        self.assertEqual(SOME_DIFFERENT_URL_DOT_COM, ShortUrl.objects.get(slug=generated_slug).url)
+        self.assertEqual(self.client.session['user_id'],
+                         str(ShortUrl.objects.get(slug=SLUG_EXAMPLE).user_id))
+        self.assertIn('url', results[4]['errors'])
+
+    def test_warms_cache(self):
+        self.client.post(BULK_SHORTEN_ENDPOINT, [{'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE}],
+                         format='json')
+
+        self.assertEqual(EXAMPLE_DOT_COM.encode(), self.redis.get(SLUG_EXAMPLE))
+
+    def test_ndjson(self):
+        body = f'{{"url": "{EXAMPLE_DOT_COM}", "slug": "a"}}\n\n{{"url": "{EXAMPLE_DOT_COM}"}}\n'
+
+        response = self.client.post(BULK_SHORTEN_ENDPOINT, body,
+                                    content_type='application/x-ndjson')
+
+        self.assertEqual(['created', 'created'], [result['status'] for result in response.json()])
+
+    def test_batched_queries(self):
+        items = [{'url': EXAMPLE_DOT_COM, 'slug': f'slug{i}'} for i in range(100)]
+
+        with CaptureQueriesContext(connection) as queries:
+            shorten.shorten_many(items, UUID_NULL, chunk_size=50)
+
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual(2, statements.count('SELECT'))
+        self.assertEqual(2, statements.count('INSERT'))
+
+    def test_dedupe(self):
+        self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': 'mine'})
+        ShortUrl(url=SOME_DIFFERENT_URL_DOT_COM, slug='others', user_id=UUID_NULL).save()
+        items = [
+            {'url': EXAMPLE_DOT_COM},
+            {'url': SOME_DIFFERENT_URL_DOT_COM},
+            {'url': SOME_DIFFERENT_URL_DOT_COM},
+            {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE},
+            {'url': 'not an URL'},
+            {'url': 'not an URL'},
+        ]
+
+        response = self.client.post(f'{BULK_SHORTEN_ENDPOINT}?dedupe=true', items, format='json')
+
+        results = response.json()
+        self.assertEqual(['existing', 'created', 'existing', 'created', 'invalid', 'invalid'],
+                         [result['status'] for result in results])
+        self.assertEqual('mine', results[0]['slug'])
+        self.assertNotEqual('others', results[1]['slug'])
+        self.assertEqual(results[1]['slug'], results[2]['slug'])
+        self.assertEqual(4, ShortUrl.objects.count())
+        self.assertEqual(shorten.url_hash(EXAMPLE_DOT_COM),
+                         ShortUrl.objects.get(slug=SLUG_EXAMPLE).url_hash)
+
+    @patch('api.slugs.generator.generate_many')
+    def test_regenerates_slugs_taken_as_custom(self, generate_many):
+        ShortUrl(url=EXAMPLE_DOT_COM, slug='taken', user_id=UUID_NULL).save()
+        generate_many.side_effect = [['taken'], ['free']]
 
-class SlugGeneratorAPITestCase(APITestCase):
+        results = shorten.shorten_many([{'url': EXAMPLE_DOT_COM}], UUID_NULL)
+
+        self.assertEqual([{'slug': 'free', 'url': EXAMPLE_DOT_COM, 'status': 'created'}], results)
+
+    @parameterized.expand([
+        ('not a list', {'url': EXAMPLE_DOT_COM}),
+        ('too many items', [{'url': EXAMPLE_DOT_COM}] * 10001),
+    ])
+    def test_bad_request(self, description, body):
+        response = self.client.post(BULK_SHORTEN_ENDPOINT, body, format='json')
+
+        self.assertEqual(400, response.status_code, f'failed to reject {description}')
+
+
+class SlugGeneratorAPITestCase(FakeRedisMixin, APITestCase):
     def test_status_code_is_200(self):
         response = self.client.get('/api/slug/', {'length': 6})
 
@@ -107,7 +310,7 @@ class SlugGeneratorAPITestCase(APITestCase):
 
         self.assertEqual(6, len(response.content.decode()))
 
-    @patch('api.shorten.generate_unique_slug')
+    @patch('api.slugs.generator.generate_many')
     def test_no_free_slugs(self, slug_gen_mock):
         slug_gen_mock.side_effect = shorten.NoFreeSlugsError()
 
@@ -115,6 +318,35 @@ class SlugGeneratorAPITestCase(APITestCase):
 
         self.assertEqual(409, response.status_code)
 
+    def test_lease_slug_of_small_slug_space(self):
+        response = self.client.get('/api/slug/', {'length': 1})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.content.decode()))
+
+    def test_invalid_custom_slug_is_not_claimed(self):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': ['x', 'y']},
+                                    format='json')
+
+        self.assertEqual(400, response.status_code)
+
+    def test_leased_slug_can_be_shortened(self):
+        slug = self.client.get('/api/slug/', {'length': 6}).content.decode()
+
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': slug})
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(ShortUrl.objects.filter(slug=slug, url=EXAMPLE_DOT_COM).exists())
+        self.assertFalse(leases.pool.claim(slug))
+
+    def test_leased_slug_released_on_bad_input(self):
+        slug = self.client.get('/api/slug/', {'length': 6}).content.decode()
+
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': 'not an URL', 'slug': slug})
+
+        self.assertEqual(400, response.status_code)
+        self.assertIn(slug.encode(), self.redis.lrange('slugs:pool:6', 0, -1))
+
     def test_no_length_specified(self):
         response = self.client.get('/api/slug/')
 
@@ -125,6 +357,7 @@ class SlugGeneratorAPITestCase(APITestCase):
         ('zero length', 0),
         ('not a number', 'what'),
         ('float', 6.9),
+        ('longer than a slug can be', 51),
     ])
     def test_bad_length(self, description, length):
         response = self.client.get('/api/slug/', {'length': str(length)})
@@ -134,7 +367,7 @@ class SlugGeneratorAPITestCase(APITestCase):
 
 
 @patch('api.redis.redis', new_callable=FakeRedis)
-class UnshorteningAPITestCase(APITestCase):
+class UnshorteningAPITestCase(ClearLocalCacheMixin, APITestCase):
     @classmethod
     def setUpTestData(cls):
         ShortUrl(url=EXAMPLE_DOT_COM, slug=SLUG_EXAMPLE, user_id=UUID_NULL).save()
@@ -158,13 +391,81 @@ class UnshorteningAPITestCase(APITestCase):
         self.assertEqual(400, response.status_code)
 
 
+class InvalidSlugUnshorteningAPITestCase(FakeRedisMixin, APITestCase):
+    @parameterized.expand([('existing key', True), ('missing key', False)])
+    def test_not_found(self, _, key_exists):
+        if key_exists:
+            self.redis.hset('clicks:pending', SLUG_EXAMPLE, 1)
+
+        response = self.client.get('/api/unshorten/', {'slug': 'clicks:pending'})
+
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(b'hash' if key_exists else b'none', self.redis.type('clicks:pending'))
+
+
+class BulkUnshorteningAPITestCase(FakeRedisMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        ShortUrl(url=EXAMPLE_DOT_COM, slug='slug1', user_id=UUID_NULL).save()
+        ShortUrl(url=SOME_DIFFERENT_URL_DOT_COM, slug='slug2', user_id=UUID_NULL).save()
+
+    def test_post(self):
+        response = self.client.post('/api/unshorten/bulk/', ['slug1', 'slug2', 'unknown'],
+                                    format='json')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'slug1': EXAMPLE_DOT_COM, 'slug2': SOME_DIFFERENT_URL_DOT_COM,
+                          'unknown': None}, response.json())
+
+    def test_get(self):
+        response = self.client.get('/api/unshorten/bulk/?slug=slug1&slug=unknown')
+
+        self.assertEqual({'slug1': EXAMPLE_DOT_COM, 'unknown': None}, response.json())
+
+    def test_one_query_for_misses(self):
+        self.redis.set('slug1', EXAMPLE_DOT_COM)
+
+        with self.assertNumQueries(1):
+            urls = shorten.unshorten_many(['slug1', 'slug2', 'unknown'])
+
+        self.assertEqual({'slug1': EXAMPLE_DOT_COM, 'slug2': SOME_DIFFERENT_URL_DOT_COM,
+                          'unknown': None}, urls)
+        with self.assertNumQueries(0):
+            self.assertEqual(urls, shorten.unshorten_many(['slug1', 'slug2', 'unknown']))
+
+    def test_invalid_slugs_do_not_reach_redis(self):
+        self.redis.hset('clicks:pending', 'slug1', 1)
+
+        response = self.client.post('/api/unshorten/bulk/', ['clicks:pending', 'stats:x', 'slug1'],
+                                    format='json')
+
+        self.assertEqual({'clicks:pending': None, 'stats:x': None, 'slug1': EXAMPLE_DOT_COM},
+                         response.json())
+        self.assertFalse(self.redis.exists('stats:x'))
+
+    @parameterized.expand([
+        ('not a list', {'slug': 'slug1'}),
+        ('not strings', [1, 2]),
+        ('too many slugs', ['slug1'] * 1001),
+    ])
+    def test_bad_request(self, description, body):
+        response = self.client.post('/api/unshorten/bulk/', body, format='json')
+
+        self.assertEqual(400, response.status_code, f'failed to reject {description}')
+
+
 class UserURLListingAPITestCase(APITestCase):
+    def log_in(self, user_id):
+        session = self.client.session
+        session['user_id'] = str(user_id)
+        session.save()
+
     def test_no_user_id(self):
         response = self.client.get('/api/urls/')
 
         response_json = response.json()
         self.assertEqual(200, response.status_code)
-        self.assertEqual(0, response_json['count'])
+        self.assertIsNone(response_json['next'])
         self.assertEqual([], response_json['results'])
 
     def test_gives_only_users_urls(self):
@@ -176,9 +477,7 @@ class UserURLListingAPITestCase(APITestCase):
             url.save()
         ShortUrl(url='http://thirdurl.com', slug='slug3', user_id=uuid.uuid4()).save()
 
-        session = self.client.session
-        session['user_id'] = str(UUID_123)
-        session.save()
+        self.log_in(UUID_123)
         json = self.client.get('/api/urls/').json()
 
         self.assertEqual(ShortUrlSerializer(expected_user_123s_urls, many=True).data,
@@ -186,20 +485,322 @@ class UserURLListingAPITestCase(APITestCase):
 
     def test_pagination(self):
         for i in range(60):
-            ShortUrl(url=EXAMPLE_DOT_COM, slug=f'slug{i}', user_id=UUID_NULL).save()
+            ShortUrl(url=EXAMPLE_DOT_COM, slug=f'slug{i:02}', user_id=UUID_NULL).save()
+
+        self.log_in(UUID_NULL)
+        first_page = self.client.get('/api/urls/').json()
+        second_page = self.client.get(first_page['next']).json()
+
+        self.assertEqual([f'slug{i:02}' for i in range(50)],
+                         [url['slug'] for url in first_page['results']])
+        self.assertEqual([f'slug{i:02}' for i in range(50, 60)],
+                         [url['slug'] for url in second_page['results']])
+        self.assertIsNone(second_page['next'])
+
+    def test_pagination_of_urls_created_at_once(self):
+        ShortUrl.objects.bulk_create([ShortUrl(url=EXAMPLE_DOT_COM, slug=f'slug{i:03}',
+                                               user_id=UUID_NULL) for i in range(120)])
+        ShortUrl.objects.update(created_at=ShortUrl.objects.first().created_at)
+        self.log_in(UUID_NULL)
+
+        slugs = []
+        url = '/api/urls/'
+        while url is not None:
+            page = self.client.get(url).json()
+            slugs += [short_url['slug'] for short_url in page['results']]
+            url = page['next']
+
+        self.assertEqual([f'slug{i:03}' for i in range(120)], slugs)
+
+    def test_deep_page_takes_one_query(self):
+        ShortUrl.objects.bulk_create([ShortUrl(url=EXAMPLE_DOT_COM, slug=f'slug{i:03}',
+                                               user_id=UUID_NULL) for i in range(120)])
+        self.log_in(UUID_NULL)
+        second_page = self.client.get('/api/urls/').json()['next']
+        third_page = self.client.get(second_page).json()['next']
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(third_page)
+
+        listing_queries = [query['sql'] for query in queries
+                           if 'api_shorturl' in query['sql']]
+        self.assertEqual(1, len(listing_queries))
+        self.assertNotIn('COUNT', listing_queries[0])
+        self.assertNotIn('OFFSET', listing_queries[0])
+
+    def test_invalid_cursor(self):
+        self.log_in(UUID_NULL)
+
+        response = self.client.get('/api/urls/', {'cursor': 'invalid'})
+
+        self.assertEqual(404, response.status_code)
+
+
+@override_settings(REPLICA_DATABASES={'default': ['replica']})
+class ReplicaRoutingAPITestCase(FakeRedisMixin, APITestCase):
+    # The replica is a separate database which is never caught up, like one lagging far behind
+    databases = {'default', 'replica'}
+
+    def listed_slugs(self) -> list[str]:
+        return [url['slug'] for url in self.client.get('/api/urls/').json()['results']]
+
+    def test_resolves_from_replica(self):
+        ShortUrl(url=EXAMPLE_DOT_COM, slug=SLUG_EXAMPLE, user_id=UUID_NULL).save()
+        ShortUrl(url=SOME_DIFFERENT_URL_DOT_COM, slug=SLUG_EXAMPLE, user_id=UUID_NULL).save(
+            using='replica')
+
+        response = self.client.get('/api/unshorten/', {'slug': SLUG_EXAMPLE})
+
+        self.assertEqual(SOME_DIFFERENT_URL_DOT_COM, get_response_str(response))
+
+    def test_reads_own_writes(self):
+        response = self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM,
+                                                       'slug': SLUG_EXAMPLE})
+
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertFalse(ShortUrl.objects.using('replica').exists())
+        self.assertEqual([SLUG_EXAMPLE], self.listed_slugs())
+
+    def test_lists_from_replica_once_unpinned(self):
+        self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE})
+        del self.client.cookies[routers.PIN_COOKIE]
+
+        self.assertEqual([], self.listed_slugs())
+
+    def test_pin_is_capped(self):
+        self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE})
+        self.client.cookies[routers.PIN_COOKIE] = '9999999999'
+
+        self.assertEqual([], self.listed_slugs())
+
+    def test_reads_do_not_pin(self):
+        response = self.client.get('/api/urls/')
+
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+
+class URLExportAPITestCase(APITestCase):
+    def setUp(self):
+        ShortUrl.objects.bulk_create([ShortUrl(url=f'{EXAMPLE_DOT_COM}/{i}', slug=f'slug{i}',
+                                               user_id=UUID_123) for i in range(5)])
+        ShortUrl(url=EXAMPLE_DOT_COM, slug='other', user_id=UUID_NULL).save()
+        session = self.client.session
+        session['user_id'] = str(UUID_123)
+        session.save()
+
+    def test_ndjson(self):
+        response = self.client.get('/api/urls/export/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        self.assertTrue(response.streaming)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(f'slug{i}', f'{EXAMPLE_DOT_COM}/{i}') for i in range(5)],
+                         [(line['slug'], line['url']) for line in lines])
+
+    def test_csv(self):
+        response = self.client.get('/api/urls/export/', {'format': 'csv'})
+
+        self.assertEqual('attachment; filename="urls.csv"', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual('slug,url,created_at', lines[0])
+        self.assertEqual(['slug0', f'{EXAMPLE_DOT_COM}/0'], lines[1].split(',')[:2])
+        self.assertEqual(6, len(lines))
+
+    @override_settings(URL_EXPORT_CHUNK_SIZE=2)
+    def test_reads_in_chunks(self):
+        ShortUrl.objects.update(created_at=ShortUrl.objects.first().created_at)
+
+        with CaptureQueriesContext(connection) as queries:
+            content = b''.join(self.client.get('/api/urls/export/').streaming_content)
+
+        self.assertEqual([f'slug{i}' for i in range(5)],
+                         [json.loads(line)['slug'] for line in content.splitlines()])
+        self.assertEqual(3, sum(1 for query in queries if 'api_shorturl' in query['sql']))
+
+    def test_no_user_id(self):
+        self.client.session.flush()
+        self.client.cookies.clear()
 
+        response = self.client.get('/api/urls/export/')
+
+        self.assertEqual(b'', b''.join(response.streaming_content))
+
+    def test_bad_format(self):
+        self.assertEqual(400, self.client.get('/api/urls/export/', {'format': 'xml'}).status_code)
+
+
+@override_settings(SHORTURL_SHARDS=['default', 'shard1', 'shard2'])
+class ShardedListingAPITestCase(APITestCase):
+    databases = {'default', 'shard1', 'shard2'}
+
+    def setUp(self):
+        for i in range(60):
+            ShortUrl(url=EXAMPLE_DOT_COM, slug=f'slug{i:02}', user_id=UUID_NULL).save()
         session = self.client.session
         session['user_id'] = str(UUID_NULL)
         session.save()
-        json = self.client.get('/api/urls/?page=1').json()
 
-        self.assertEqual(60, json['count'])
-        self.assertEqual(50, len(json['results']))
+    def test_pagination_merges_shards(self):
+        first_page = self.client.get('/api/urls/').json()
+        second_page = self.client.get(first_page['next']).json()
 
-    def test_empty_first_page(self):
-        response = self.client.get('/api/urls/?page=1')
+        self.assertEqual([f'slug{i:02}' for i in range(60)],
+                         [url['slug'] for url in first_page['results'] + second_page['results']])
+        self.assertIsNone(second_page['next'])
+
+    @override_settings(URL_EXPORT_CHUNK_SIZE=7)
+    def test_export_merges_shards(self):
+        content = b''.join(self.client.get('/api/urls/export/').streaming_content)
+
+        self.assertEqual([f'slug{i:02}' for i in range(60)],
+                         [json.loads(line)['slug'] for line in content.splitlines()])
+
+
+class SessionModeTestCaseMixin:
+    def shorten_and_list(self):
+        self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE})
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get('/api/urls/').json()['results']
+
+        self.assertEqual([SLUG_EXAMPLE], [url['slug'] for url in results])
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+    def log_in_with_db_session(self, user_id):
+        ShortUrl(url=EXAMPLE_DOT_COM, slug=SLUG_EXAMPLE, user_id=user_id).save()
+        session = db_sessions.SessionStore()
+        session['user_id'] = str(user_id)
+        session.save()
+        self.client.cookies['sessionid'] = session.session_key
+        return session.session_key
+
+
+@override_settings(SESSION_ENGINE='api.sessions.signed_cookies')
+class SignedCookieSessionAPITestCase(SessionModeTestCaseMixin, FakeRedisMixin, APITestCase):
+    def test_no_session_queries(self):
+        self.shorten_and_list()
+
+    def test_moves_db_session(self):
+        session_key = self.log_in_with_db_session(UUID_123)
+
+        response = self.client.get('/api/urls/')
+
+        self.assertEqual([SLUG_EXAMPLE], [url['slug'] for url in response.json()['results']])
+        self.assertNotEqual(session_key, response.cookies['sessionid'].value)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/urls/')
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+
+@override_settings(SESSION_ENGINE='api.sessions.cache', SESSION_CACHE_ALIAS='sessions',
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                           'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                        'LOCATION': 'sessions'}})
+class CacheSessionAPITestCase(SessionModeTestCaseMixin, FakeRedisMixin, APITestCase):
+    def test_no_session_queries(self):
+        self.shorten_and_list()
+
+    def test_moves_db_session(self):
+        session_key = self.log_in_with_db_session(UUID_123)
+
+        results = self.client.get('/api/urls/').json()['results']
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/urls/')
+
+        self.assertEqual([SLUG_EXAMPLE], [url['slug'] for url in results])
+        self.assertEqual(session_key, self.client.cookies['sessionid'].value)
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+    @override_settings(SESSION_DB_FALLBACK=False)
+    def test_db_fallback_turned_off(self):
+        self.log_in_with_db_session(UUID_123)
+
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get('/api/urls/').json()['results']
+
+        self.assertEqual([], results)
+        self.assertFalse([query for query in queries if 'django_session' in query['sql']])
+
+
+class URLStatsAPITestCase(FakeRedisMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        ShortUrl(url=EXAMPLE_DOT_COM, slug=SLUG_EXAMPLE, user_id=UUID_123).save()
+
+    def log_in(self, user_id):
+        session = self.client.session
+        session['user_id'] = str(user_id)
+        session.save()
+
+    def test_stats(self):
+        self.log_in(UUID_123)
+        self.client.get(f'/{SLUG_EXAMPLE}', HTTP_REFERER='https://example.com/')
+
+        response = self.client.get(f'/api/urls/{SLUG_EXAMPLE}/stats/')
 
-        response_json = response.json()
         self.assertEqual(200, response.status_code)
-        self.assertEqual(0, response_json['count'])
-        self.assertEqual([], response_json['results'])
+        stats = response.json()
+        self.assertEqual(1, stats['clicks'])
+        self.assertEqual(1, stats['daily'][0]['unique_visitors'])
+        self.assertEqual([{'referrer': 'example.com', 'clicks': 1}], stats['referrers'])
+
+    def test_other_users_url(self):
+        self.log_in(UUID_NULL)
+
+        response = self.client.get(f'/api/urls/{SLUG_EXAMPLE}/stats/')
+
+        self.assertEqual(404, response.status_code)
+
+    def test_no_user_id(self):
+        response = self.client.get(f'/api/urls/{SLUG_EXAMPLE}/stats/')
+
+        self.assertEqual(404, response.status_code)
+
+    @parameterized.expand([('not a number', 'what'), ('zero', 0), ('too many', 367)])
+    def test_bad_day_count(self, description, days):
+        self.log_in(UUID_123)
+
+        response = self.client.get(f'/api/urls/{SLUG_EXAMPLE}/stats/', {'days': days})
+
+        self.assertEqual(400, response.status_code, f'failed to reject {description}')
+
+
+class MetricsAPITestCase(ClearMetricsMixin, FakeRedisMixin, APITestCase):
+    def test_reports_views(self):
+        self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM})
+        self.client.get('/unknown')
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="api.views.shorten_view"} 1\n',
+                      content)
+        self.assertIn('http_request_duration_seconds_bucket{view="api.views.shorten_view",le="+Inf"} 1\n',
+                      content)
+        self.assertIn('db_queries_total{view="api.views.shorten_view"}', content)
+        self.assertIn('unshorten_lookups_total{result="not_found"} 1\n', content)
+
+    @patch('api.shorten.generate_unique_slug')
+    def test_counts_slug_generation_retries(self, generate_unique_slug):
+        ShortUrl(url=EXAMPLE_DOT_COM, slug='taken', user_id=UUID_NULL).save()
+        generate_unique_slug.side_effect = ['taken', 'free']
+
+        self.client.post(SHORTEN_ENDPOINT, {'url': EXAMPLE_DOT_COM})
+
+        self.assertIn('slug_generation_retries_total{endpoint="shorten"} 1\n',
+                      self.client.get('/metrics').content.decode())
+
+    def test_adds_up_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            other_worker = {'counters': [['unshorten_lookups_total', [['result', 'redis_hit']], 2]],
+                            'histograms': []}
+            with open(f'{directory}/1-other.json', 'w') as file:
+                json.dump(other_worker, file)
+            metrics.inc('unshorten_lookups_total', 3, result='redis_hit')
+            metrics.dump()
+
+            content = self.client.get('/metrics').content.decode()
+
+        self.assertIn('unshorten_lookups_total{result="redis_hit"} 5\n', content)
@@ -1,13 +1,29 @@
-from unittest.mock import patch
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch, AsyncMock, MagicMock
+from wsgiref.util import setup_testing_defaults
 
+from django.test import AsyncRequestFactory
 from django.test.testcases import TestCase
+from django.test.utils import override_settings
 from django.core.exceptions import ValidationError
-from parameterized import parameterized
-from fakeredis import FakeRedis
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from parameterized import parameterized, parameterized_class
+from fakeredis import FakeAsyncRedis, FakeRedis, FakeServer
 
-from . import EXAMPLE_DOT_COM, SOME_DIFFERENT_URL_DOT_COM, SLUG_EXAMPLE, UUID_NULL, UUID_123
-from .. import shorten
-from ..models import ShortUrl
+from . import EXAMPLE_DOT_COM, SOME_DIFFERENT_URL_DOT_COM, SLUG_EXAMPLE, UUID_NULL, UUID_123, \
+    ClearLocalCacheMixin, ClearMetricsMixin, FakeRedisMixin
+from .. import analytics, benchmarks, bloom, cache, clicks, fastpath, leases, loadtest, metrics, \
+    redis, shards, shorten, slugs, snapshot, views, warmup
+from ..models import ShortUrl, ClickStats, ClickBatch, DailyClicks, HourlyClicks, ReferrerClicks
 from ..serializers import ShortUrlSerializer
 from ..shorten import NoFreeSlugsError
 
@@ -18,34 +34,70 @@ class GenerateUniqueSlugTestCase(TestCase):
 
         self.assertEqual(6, len(slug))
 
-    @patch('random.choices')
-    def test_random_slug_collision(self, choices):
-        colliding_slug = '123456'
-        different_slug = '654321'
-        ShortUrl(slug=colliding_slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
-        choices.side_effect = [colliding_slug, different_slug]
+    def test_slugs_never_repeat(self):
+        generator = slugs.SlugGenerator('key', block_size=10)
 
-        slug = shorten.generate_unique_slug(6)
+        generated = {generator.generate(1) for _ in range(62)}
 
-        self.assertEqual(different_slug, slug)
+        self.assertEqual(set(slugs.ALPHABET), generated)
+        with self.assertRaises(NoFreeSlugsError):
+            generator.generate(1)
 
-    @patch('random.choices')
-    def test_all_slugs_occupied(self, choices):
-        slug = '1'
-        ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
-        choices.return_value = slug
+    def test_too_many_slugs_are_not_used_up(self):
+        generator = slugs.SlugGenerator('key', block_size=10)
+        generator.generate_many(2, 62 ** 2 - 50)
+        generator.generate(2)
 
         with self.assertRaises(NoFreeSlugsError):
-            shorten.generate_unique_slug(1)
+            generator.generate_many(2, 100)
+
+        self.assertEqual(49, generator.available(2))
+        self.assertEqual(49, len(set(generator.generate_many(2, 49))))
+        self.assertEqual(0, generator.available(2))
+
+    def test_does_not_query_db_within_block(self):
+        generator = slugs.SlugGenerator('key', block_size=10)
+        generator.generate(6)
+
+        with self.assertNumQueries(0):
+            generator.generate_many(6, 9)
+
+    def test_generated_slugs_are_valid(self):
+        generator = slugs.SlugGenerator('key')
+
+        for slug in generator.generate_many(6, 10):
+            ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).full_clean()
+
+    def test_space_usage(self):
+        generator = slugs.SlugGenerator('key', block_size=10)
+        generator.generate(2)
+
+        self.assertEqual([(2, 10, 62 ** 2)], slugs.space_usage())
 
-    @parameterized.expand([(0,), (-1,)])
+    @parameterized.expand([(0,), (-1,), (51,)])
     def test_bad_length(self, length):
         with self.assertRaises(ValueError, msg=f'failed to disallow length {length}'):
             shorten.generate_unique_slug(length)
 
 
+class FeistelPermutationTestCase(TestCase):
+    @parameterized.expand([(1,), (62,), (1000,), (62 ** 3,)])
+    def test_is_bijection(self, domain):
+        permutation = slugs.FeistelPermutation(domain, b'key')
+        sample = range(min(domain, 5000))
+
+        self.assertEqual(len(sample), len({permutation(x) for x in sample}))
+        self.assertTrue(all(0 <= permutation(x) < domain for x in sample))
+
+    def test_depends_on_key(self):
+        first = slugs.FeistelPermutation(62 ** 6, b'first')
+        second = slugs.FeistelPermutation(62 ** 6, b'second')
+
+        self.assertNotEqual([first(x) for x in range(10)], [second(x) for x in range(10)])
+
+
 @patch('api.redis.redis', new_callable=FakeRedis)
-class ShortenUnshortenTestCase(TestCase):
+class ShortenUnshortenTestCase(ClearLocalCacheMixin, TestCase):
     def test_shorten_saves_to_db(self, _):
         shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
 
@@ -57,6 +109,22 @@ class ShortenUnshortenTestCase(TestCase):
         with self.assertRaises(shorten.ShortenDuplicateError):
             shorten.shorten(SLUG_EXAMPLE, SOME_DIFFERENT_URL_DOT_COM, UUID_123)
 
+    def test_shorten_is_one_insert(self, _):
+        with CaptureQueriesContext(connection) as queries:
+            shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
+
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual(['INSERT'], [statement for statement in statements
+                                      if statement in ('SELECT', 'INSERT', 'UPDATE')])
+
+    def test_shorten_writes_through_to_cache(self, redis: FakeRedis):
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
+        cache.local_cache.clear()
+
+        self.assertEqual(EXAMPLE_DOT_COM, redis.get(SLUG_EXAMPLE).decode())
+        with self.assertNumQueries(0):
+            self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+
     def test_shorten_bad_slug(self, _):
         with self.assertRaises(shorten.ShortenBadInputError):
             shorten.shorten(', !"', EXAMPLE_DOT_COM, UUID_NULL)
@@ -92,12 +160,736 @@ class ShortenUnshortenTestCase(TestCase):
 
     def test_unshortening_saves_to_cache(self, redis: FakeRedis):
         slug = SLUG_EXAMPLE
-        shorten.shorten(slug, EXAMPLE_DOT_COM, UUID_NULL)
+        ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
 
         shorten.unshorten(slug)
 
         self.assertEqual(EXAMPLE_DOT_COM, redis.get(slug).decode())
 
+    def test_unshortening_pulls_from_local_cache(self, redis: FakeRedis):
+        redis.set(SLUG_EXAMPLE, EXAMPLE_DOT_COM)
+        shorten.unshorten(SLUG_EXAMPLE)
+        redis.delete(SLUG_EXAMPLE)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+
+    def test_unknown_slug_is_negatively_cached(self, redis: FakeRedis):
+        with self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten(SLUG_EXAMPLE)
+
+        self.assertEqual(b'', redis.get(SLUG_EXAMPLE))
+        with self.assertNumQueries(0), self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten(SLUG_EXAMPLE)
+
+    def test_shorten_clears_negative_cache_entry(self, _):
+        with self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten(SLUG_EXAMPLE)
+
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
+
+        self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+
+    def test_unknown_slug_rejected_by_bloom_filter(self, _):
+        ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
+        bloom.slug_filter.rebuild([SLUG_EXAMPLE])
+
+        with self.assertNumQueries(0), self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten('unknown')
+        self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+
+    def test_shorten_adds_to_bloom_filter(self, _):
+        bloom.slug_filter.rebuild([])
+
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
+
+        self.assertTrue(bloom.slug_filter.might_contain(SLUG_EXAMPLE))
+
+
+class BloomFilterTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.filter = bloom.BloomFilter('test', size=1024, hashes=3)
+
+    def test_not_built(self):
+        self.filter.add('a')
+
+        self.assertTrue(self.filter.might_contain('b'))
+
+    def test_rebuild(self):
+        count = self.filter.rebuild(['a', 'b'])
+
+        self.assertEqual(2, count)
+        self.assertTrue(self.filter.might_contain('a'))
+        self.assertTrue(self.filter.might_contain('b'))
+        self.assertFalse(self.filter.might_contain('c'))
+
+    def test_add(self):
+        self.filter.rebuild([])
+        self.filter.add('a')
+
+        self.assertTrue(self.filter.might_contain('a'))
+        self.assertFalse(self.filter.might_contain('b'))
+
+
+class SlugPoolTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.pool = leases.SlugPool(size=5, batch_size=2, lease_ttl=60)
+
+    def test_fill(self):
+        self.assertEqual(5, self.pool.fill(6))
+        self.assertEqual(0, self.pool.fill(6))
+        self.assertEqual(5, self.redis.llen('slugs:pool:6'))
+
+    def test_lease_from_pool(self):
+        self.pool.fill(6)
+        pooled = self.redis.lindex('slugs:pool:6', 0).decode()
+
+        with self.assertNumQueries(0):
+            slug = self.pool.lease(6)
+
+        self.assertEqual(pooled, slug)
+        self.assertEqual(4, self.redis.llen('slugs:pool:6'))
+
+    def test_lease_from_empty_pool(self):
+        slug = self.pool.lease(3)
+
+        self.assertEqual(3, len(slug))
+        self.assertEqual(1, self.redis.llen('slugs:pool:3'))
+
+    def test_lease_last_slugs(self):
+        pool = leases.SlugPool(batch_size=100)
+
+        slug = pool.lease(1)
+
+        self.assertIn(slug, slugs.ALPHABET)
+        self.assertEqual(61, self.redis.llen('slugs:pool:1'))
+        self.assertEqual([(1, 62, 62)], slugs.space_usage())
+        self.assertEqual(0, pool.fill(1))
+
+    def test_lease_from_pool_emptied_concurrently(self):
+        with patch.object(self.redis, 'lpop', side_effect=[None, None, b'leased']):
+            slug = self.pool.lease(6)
+
+        self.assertEqual('leased', slug)
+        self.assertEqual(4, self.redis.llen('slugs:pool:6'))
+
+    def test_claim(self):
+        slug = self.pool.lease(6)
+
+        self.assertTrue(self.pool.claim(slug))
+        self.assertFalse(self.pool.claim(slug))
+        self.assertFalse(self.pool.claim('not_leased'))
+
+    @patch('time.time')
+    def test_reclaim_expired(self, time):
+        time.return_value = 1000
+        slug = self.pool.lease(6)
+        self.redis.delete(f'slugs:lease:{slug}')  # expired
+
+        time.return_value = 1059
+        self.assertEqual(0, self.pool.reclaim_expired())
+        time.return_value = 1060
+        self.assertEqual(1, self.pool.reclaim_expired())
+        self.assertIn(slug.encode(), self.redis.lrange('slugs:pool:6', 0, -1))
+        self.assertFalse(self.pool.claim(slug))
+
+
+class ClickFlushTestCase(FakeRedisMixin, TestCase):
+    def test_flush(self):
+        ClickStats(slug='a', clicks=10).save()
+        clicks.record('a', {})
+        clicks.record('b', {})
+        clicks.record('b', {})
+
+        self.assertEqual(2, clicks.flush())
+
+        self.assertEqual({'a': 11, 'b': 2}, dict(ClickStats.objects.values_list('slug', 'clicks')))
+        self.assertEqual(0, clicks.flush())
+
+    def test_clicks_recorded_during_flush_are_kept(self):
+        clicks.record('a', {})
+        with patch.object(clicks, '_add_counts', side_effect=lambda counts: clicks.record('a', {})):
+            clicks.flush()
+
+        self.assertEqual({b'a': b'1'}, self.redis.hgetall('clicks:pending'))
+
+    def test_resumes_interrupted_flush(self):
+        clicks.record('a', {})
+        with patch.object(ClickBatch.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                clicks.flush()
+
+        clicks.flush()
+
+        self.assertEqual(1, ClickStats.objects.get(slug='a').clicks)
+
+    def test_does_not_add_flushed_batch_twice(self):
+        clicks.record('a', {})
+        with patch.object(self.redis, 'delete', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                clicks.flush()
+
+        clicks.flush()
+
+        self.assertEqual(1, ClickStats.objects.get(slug='a').clicks)
+
+
+class AnalyticsTestCase(FakeRedisMixin, TestCase):
+    NOW = datetime(2021, 7, 20, 12, 30, tzinfo=timezone.utc)
+
+    def click(self, now=None, ip='1.1.1.1', referrer=None):
+        meta = {'REMOTE_ADDR': ip, 'HTTP_USER_AGENT': 'test'}
+        if referrer:
+            meta['HTTP_REFERER'] = referrer
+        pipeline = self.redis.pipeline()
+        analytics.track(pipeline, SLUG_EXAMPLE, meta, now)
+        pipeline.execute()
+
+    def test_stats_from_redis(self):
+        self.click(self.NOW)
+        self.click(self.NOW, ip='2.2.2.2', referrer='https://example.com/page')
+        self.click(datetime(2021, 7, 20, 11, 59, tzinfo=timezone.utc))
+
+        stats = analytics.stats(SLUG_EXAMPLE, days=1, now=self.NOW)
+
+        self.assertEqual([
+            {'hour': datetime(2021, 7, 20, 11, tzinfo=timezone.utc), 'clicks': 1},
+            {'hour': datetime(2021, 7, 20, 12, tzinfo=timezone.utc), 'clicks': 2},
+        ], stats['hourly'])
+        self.assertEqual([{'day': date(2021, 7, 20), 'clicks': 3, 'unique_visitors': 2}],
+                         stats['daily'])
+        self.assertEqual([{'referrer': analytics.DIRECT, 'clicks': 2},
+                          {'referrer': 'example.com', 'clicks': 1}], stats['referrers'])
+
+    def test_compact(self):
+        self.click()
+        self.click(ip='2.2.2.2', referrer='https://example.com/')
+
+        self.assertEqual(1, analytics.compact())
+
+        self.assertEqual(2, HourlyClicks.objects.get(slug=SLUG_EXAMPLE).clicks)
+        daily = DailyClicks.objects.get(slug=SLUG_EXAMPLE)
+        self.assertEqual((2, 2), (daily.clicks, daily.unique_visitors))
+        self.assertEqual({analytics.DIRECT: 1, 'example.com': 1},
+                         dict(ReferrerClicks.objects.values_list('referrer', 'clicks')))
+        self.assertEqual(0, analytics.compact())
+
+    def test_compaction_keeps_top_referrers(self):
+        for i in range(analytics.REFERRERS_REPORTED + 2):
+            for _ in range(i + 1):
+                self.click(referrer=f'https://{i}.example.com/')
+        analytics.compact()
+        self.click(referrer='https://0.example.com/')
+        analytics.compact()
+
+        top = [f'{i}.example.com' for i in reversed(range(2, analytics.REFERRERS_REPORTED + 2))]
+        self.assertEqual(set(top), set(ReferrerClicks.objects.values_list('referrer', flat=True)))
+        self.assertEqual(analytics.REFERRERS_REPORTED,
+                         self.redis.zcard(f'stats:referrers:{SLUG_EXAMPLE}'))
+        self.assertEqual(top, [row['referrer']
+                               for row in analytics.stats(SLUG_EXAMPLE)['referrers']])
+
+    def test_compaction_is_idempotent(self):
+        self.click()
+        analytics.compact()
+        self.click()
+        analytics.compact()
+
+        self.assertEqual(2, DailyClicks.objects.get(slug=SLUG_EXAMPLE).clicks)
+
+    def test_stats_merge_compacted_buckets(self):
+        DailyClicks(slug=SLUG_EXAMPLE, day=date(2021, 7, 1), clicks=5, unique_visitors=4).save()
+        self.click(self.NOW)
+
+        with self.assertNumQueries(3):
+            stats = analytics.stats(SLUG_EXAMPLE, now=self.NOW)
+
+        self.assertEqual([{'day': date(2021, 7, 1), 'clicks': 5, 'unique_visitors': 4},
+                          {'day': date(2021, 7, 20), 'clicks': 1, 'unique_visitors': 1}],
+                         stats['daily'])
+
+
+class ExpiringShortUrlTestCase(FakeRedisMixin, TestCase):
+    def expire(self, *slugs: str) -> None:
+        ShortUrl.objects.filter(slug__in=slugs).update(
+            expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    def test_encode_decode(self):
+        future = datetime.now(timezone.utc) + timedelta(minutes=1)
+        past = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+        self.assertEqual(EXAMPLE_DOT_COM, cache.decode(cache.encode(EXAMPLE_DOT_COM)))
+        self.assertEqual(EXAMPLE_DOT_COM, cache.decode(cache.encode(EXAMPLE_DOT_COM, future)))
+        self.assertEqual('', cache.decode(cache.encode(EXAMPLE_DOT_COM, past)))
+        self.assertEqual('', cache.decode(''))
+
+    def test_expiring(self):
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL,
+                        datetime.now(timezone.utc) + timedelta(minutes=1))
+        cache.local_cache.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+
+    def test_expired_is_rejected_from_cache(self):
+        ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
+        self.expire(SLUG_EXAMPLE)
+        with self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten(SLUG_EXAMPLE)
+        cache.local_cache.clear()
+
+        with self.assertNumQueries(0), self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten(SLUG_EXAMPLE)
+
+    def test_cached_expiring_url_expires(self):
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL,
+                        datetime.now(timezone.utc) + timedelta(minutes=1))
+        value = cache.encode(EXAMPLE_DOT_COM, datetime.now(timezone.utc) - timedelta(seconds=1))
+        cache.local_cache.set(SLUG_EXAMPLE, value)
+        cache.slug_cache.set(SLUG_EXAMPLE, value)
+
+        with self.assertNumQueries(0), self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten(SLUG_EXAMPLE)
+
+    def test_expired_local_entry_falls_back(self):
+        # Another worker reaped the short URL and its slug got shortened again
+        value = cache.encode(EXAMPLE_DOT_COM, datetime.now(timezone.utc) - timedelta(seconds=1))
+        cache.local_cache.set(SLUG_EXAMPLE, value)
+        cache.slug_cache.set(SLUG_EXAMPLE, SOME_DIFFERENT_URL_DOT_COM)
+
+        self.assertEqual(SOME_DIFFERENT_URL_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+        cache.local_cache.set(SLUG_EXAMPLE, value)
+        self.assertEqual(SOME_DIFFERENT_URL_DOT_COM,
+                         asyncio.run(shorten.aunshorten(SLUG_EXAMPLE)))
+        cache.local_cache.set(SLUG_EXAMPLE, value)
+        self.assertEqual({SLUG_EXAMPLE: SOME_DIFFERENT_URL_DOT_COM},
+                         shorten.unshorten_many([SLUG_EXAMPLE]))
+
+    async def test_aunshorten_expired(self):
+        await ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL,
+                       expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)).asave()
+
+        with self.assertRaises(shorten.UnshortenError):
+            await shorten.aunshorten(SLUG_EXAMPLE)
+
+    def test_unshorten_many(self):
+        ShortUrl.objects.bulk_create([ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL)
+                                      for slug in ('live', 'expired')])
+        self.expire('expired')
+        cache.slug_cache.set('cached', cache.encode(
+            EXAMPLE_DOT_COM, datetime.now(timezone.utc) - timedelta(seconds=1)))
+
+        self.assertEqual({'live': EXAMPLE_DOT_COM, 'expired': None, 'cached': None},
+                         shorten.unshorten_many(['live', 'expired', 'cached']))
+
+    def test_delete_expired(self):
+        ShortUrl.objects.bulk_create([ShortUrl(slug=f'slug{i}', url=EXAMPLE_DOT_COM,
+                                               user_id=UUID_NULL) for i in range(5)])
+        for i in range(5):
+            shorten.unshorten(f'slug{i}')
+        self.expire('slug0', 'slug1', 'slug2')
+
+        self.assertEqual([2, 1], list(shorten.delete_expired(batch_size=2)))
+        self.assertEqual(['slug3', 'slug4'], list(ShortUrl.objects.order_by('slug')
+                                                  .values_list('slug', flat=True)))
+        self.assertEqual([None, None, None, EXAMPLE_DOT_COM, EXAMPLE_DOT_COM],
+                         cache.slug_cache.get_many([f'slug{i}' for i in range(5)]))
+
+    def test_delete_expired_forgets_clicks(self):
+        for slug in ('expired', 'live'):
+            ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
+            clicks.record(slug, {'HTTP_REFERER': 'https://example.com/'})
+            clicks.flush()
+            analytics.compact()
+            clicks.record(slug, {'HTTP_REFERER': 'https://example.org/'})
+        self.expire('expired')
+
+        with patch('api.cache.invalidate') as invalidate:
+            list(shorten.delete_expired())
+
+        invalidate.assert_called_once_with('expired')
+        self.assertEqual(0, clicks.total('expired'))
+        self.assertEqual({'hourly': [], 'daily': [], 'referrers': []},
+                         analytics.stats('expired'))
+        self.assertEqual(2, clicks.total('live'))
+        self.assertEqual(2, len(analytics.stats('live')['referrers']))
+        self.assertEqual([], self.redis.keys('*expired*'))
+        self.assertFalse(self.redis.sismember('stats:dirty', 'expired'))
+
+
+@override_settings(SHORTURL_SHARDS=['default', 'shard1', 'shard2'])
+class ShardingTestCase(FakeRedisMixin, TestCase):
+    databases = {'default', 'shard1', 'shard2'}
+    SLUGS = [f'slug{i}' for i in range(30)]
+
+    def stored(self) -> dict[str, set[str]]:
+        return {alias: set(ShortUrl.objects.using(alias).values_list('slug', flat=True))
+                for alias in ['default', 'shard1', 'shard2']}
+
+    def test_jump_hash_moves_keys_to_new_buckets_only(self):
+        keys = range(0, 2 ** 64, 2 ** 52 + 12345)
+        moved = [(key, jump) for key in keys
+                 if (jump := shards.jump_hash(key, 4)) != shards.jump_hash(key, 3)]
+
+        self.assertEqual({3}, {bucket for _, bucket in moved})
+        self.assertAlmostEqual(len(keys) / 4, len(moved), delta=len(keys) / 20)
+
+    def test_shorten_unshorten(self):
+        for slug in self.SLUGS:
+            shorten.shorten(slug, EXAMPLE_DOT_COM, UUID_NULL)
+        cache.local_cache.clear()
+        self.redis.flushall()
+
+        stored = self.stored()
+        self.assertEqual(set(self.SLUGS), set.union(*stored.values()))
+        self.assertTrue(all(stored.values()))
+        for alias, slug_set in stored.items():
+            self.assertEqual({alias}, {shards.shard(slug) for slug in slug_set})
+        self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(self.SLUGS[0]))
+        self.assertEqual(dict.fromkeys(self.SLUGS, EXAMPLE_DOT_COM),
+                         shorten.unshorten_many(self.SLUGS))
+
+    def test_shorten_many(self):
+        shorten.shorten('taken', EXAMPLE_DOT_COM, UUID_NULL)
+        items = [{'url': EXAMPLE_DOT_COM, 'slug': slug} for slug in [*self.SLUGS, 'taken']]
+
+        results = shorten.shorten_many(items, UUID_NULL, chunk_size=7)
+
+        self.assertEqual(['created'] * len(self.SLUGS) + ['conflict'],
+                         [result['status'] for result in results])
+        self.assertEqual(set(self.SLUGS) | {'taken'}, set.union(*self.stored().values()))
+
+    def test_delete_expired(self):
+        for slug in self.SLUGS:
+            ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL,
+                     expires_at=datetime(2020, 1, 1, tzinfo=timezone.utc)).save()
+
+        self.assertEqual(len(self.SLUGS), sum(shorten.delete_expired(batch_size=4)))
+        self.assertFalse(any(self.stored().values()))
+
+    def test_warmup_chunks(self):
+        for slug in self.SLUGS:
+            shorten.shorten(slug, EXAMPLE_DOT_COM, UUID_NULL)
+
+        chunks = list(warmup.chunks(chunk_size=4))
+
+        self.assertEqual(sorted(self.SLUGS), sorted(slug for chunk in chunks for slug, _ in chunk))
+
+    def test_rebalance(self):
+        with override_settings(SHORTURL_SHARDS=['default', 'shard1']):
+            for slug in self.SLUGS:
+                shorten.shorten(slug, EXAMPLE_DOT_COM, UUID_NULL)
+        created_at = {short_url.slug: short_url.created_at
+                      for alias in ['default', 'shard1']
+                      for short_url in ShortUrl.objects.using(alias)}
+        moving = [slug for slug in self.SLUGS if shards.shard(slug) == 'shard2']
+        cache.local_cache.clear()
+        self.redis.flushall()
+
+        with override_settings(SHORTURL_PREVIOUS_SHARD_COUNT=2):
+            # Rows not moved yet are still found and their slugs stay taken
+            self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(moving[0]))
+            self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten_many(moving)[moving[-1]])
+            with self.assertRaises(shorten.ShortenDuplicateError):
+                shorten.shorten(moving[0], EXAMPLE_DOT_COM, UUID_NULL)
+
+            cache.local_cache.set(moving[0], EXAMPLE_DOT_COM)
+            moved = list(shards.rebalance(chunk_size=4))
+
+        self.assertEqual(len(moving), sum(count for _, _, count in moved))
+        self.assertEqual({'shard2'}, {target for _, target, _ in moved})
+        for alias, slug_set in self.stored().items():
+            self.assertEqual({alias}, {shards.shard(slug) for slug in slug_set})
+        self.assertEqual(created_at, {short_url.slug: short_url.created_at
+                                      for alias in ['default', 'shard1', 'shard2']
+                                      for short_url in ShortUrl.objects.using(alias)})
+        self.assertEqual([], list(shards.rebalance()))
+        self.assertIsNone(cache.local_cache.get(moving[0]))
+
+
+class SlugSnapshotTestCase(ClearMetricsMixin, FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'slugs.snapshot')
+        self.snapshot = snapshot.SlugSnapshot(self.path, check_interval=0)
+        patcher = patch.object(snapshot, 'slug_snapshot', self.snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self, entries: list[tuple[str, str]]) -> int:
+        return snapshot.build(self.path, iter([entries[:10], entries[10:]]))
+
+    def test_get(self):
+        entries = [(f'slug{i}', f'{EXAMPLE_DOT_COM}/{i}') for i in range(1000)]
+
+        self.assertEqual(1000, self.build(entries))
+
+        self.assertEqual(dict(entries), {slug: self.snapshot.get(slug) for slug, _ in entries})
+        self.assertIsNone(self.snapshot.get('unknown'))
+
+    def test_no_snapshot(self):
+        self.assertIsNone(self.snapshot.get(SLUG_EXAMPLE))
+        self.assertIsNone(snapshot.SlugSnapshot().get(SLUG_EXAMPLE))
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'garbage' * 10)
+
+        with self.assertLogs('api.snapshot', 'ERROR'):
+            self.assertIsNone(self.snapshot.get(SLUG_EXAMPLE))
+
+    def test_swapped_in(self):
+        self.build([(SLUG_EXAMPLE, EXAMPLE_DOT_COM)])
+        self.assertEqual(EXAMPLE_DOT_COM, self.snapshot.get(SLUG_EXAMPLE))
+
+        self.build([(SLUG_EXAMPLE, SOME_DIFFERENT_URL_DOT_COM), ('new', EXAMPLE_DOT_COM)])
+
+        self.assertEqual(SOME_DIFFERENT_URL_DOT_COM, self.snapshot.get(SLUG_EXAMPLE))
+        self.assertEqual(EXAMPLE_DOT_COM, self.snapshot.get('new'))
+
+    def test_checks_for_new_snapshot_periodically(self):
+        self.build([(SLUG_EXAMPLE, EXAMPLE_DOT_COM)])
+        self.snapshot.check_interval = 60
+        self.snapshot.get(SLUG_EXAMPLE)
+
+        self.build([])
+
+        self.assertEqual(EXAMPLE_DOT_COM, self.snapshot.get(SLUG_EXAMPLE))
+
+    def test_unshorten(self):
+        self.build([(SLUG_EXAMPLE, EXAMPLE_DOT_COM)])
+
+        self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+        self.assertEqual(EXAMPLE_DOT_COM,
+                         asyncio.run(shorten.aunshorten(SLUG_EXAMPLE)))
+        self.assertEqual({SLUG_EXAMPLE: EXAMPLE_DOT_COM, 'unknown': None},
+                         shorten.unshorten_many([SLUG_EXAMPLE, 'unknown']))
+
+        self.assertEqual(0, len(cache.local_cache))
+        self.assertIsNone(self.redis.get(SLUG_EXAMPLE))
+        self.assertEqual(3, metrics.registry.counters[
+            ('unshorten_lookups_total', (('result', 'snapshot_hit'),))])
+
+    def test_newer_slugs_fall_back(self):
+        self.build([])
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
+        cache.local_cache.clear()
+
+        self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+
+    def test_expired_slugs_fall_back(self):
+        # The expired short URL was reaped and its slug shortened again
+        expired_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.build([(SLUG_EXAMPLE, cache.encode(SOME_DIFFERENT_URL_DOT_COM, expired_at))])
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
+        cache.local_cache.clear()
+
+        self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+        self.assertEqual({SLUG_EXAMPLE: EXAMPLE_DOT_COM}, shorten.unshorten_many([SLUG_EXAMPLE]))
+
+    def test_builds_from_db(self):
+        expires_at = datetime(2100, 1, 1, tzinfo=timezone.utc)
+        ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL,
+                 expires_at=expires_at).save()
+
+        snapshot.build(self.path, warmup.chunks())
+
+        self.assertEqual(cache.encode(EXAMPLE_DOT_COM, expires_at),
+                         self.snapshot.get(SLUG_EXAMPLE))
+
+
+class LocalCacheTestCase(TestCase):
+    def test_get_set(self):
+        local_cache = cache.LocalCache()
+        local_cache.set('a', 1)
+
+        self.assertEqual(1, local_cache.get('a'))
+        self.assertIsNone(local_cache.get('b'))
+        self.assertEqual({'size': 1, 'hits': 1, 'misses': 1}, local_cache.stats())
+
+    def test_evicts_least_recently_used(self):
+        local_cache = cache.LocalCache(max_size=2)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        local_cache.get('a')
+        local_cache.set('c', 3)
+
+        self.assertEqual(1, local_cache.get('a'))
+        self.assertIsNone(local_cache.get('b'))
+        self.assertEqual(3, local_cache.get('c'))
+
+    @patch('time.monotonic')
+    def test_expires(self, monotonic):
+        local_cache = cache.LocalCache(ttl=10)
+        monotonic.return_value = 100
+        local_cache.set('a', 1)
+
+        monotonic.return_value = 109
+        self.assertEqual(1, local_cache.get('a'))
+        monotonic.return_value = 110
+        self.assertIsNone(local_cache.get('a'))
+
+    def test_disabled(self):
+        local_cache = cache.LocalCache(max_size=0)
+        local_cache.set('a', 1)
+
+        self.assertIsNone(local_cache.get('a'))
+
+
+@parameterized_class(('buckets',), [(0,), (16,)])
+class SlugCacheTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = cache.SlugCache(ttl=1000, negative_ttl=10, buckets=self.buckets)
+
+    def ttl(self, slug: str) -> int:
+        key, field = self.cache.location(slug)
+        return self.redis.ttl(key) if field is None else self.redis.httl(key, field)[0]
+
+    def test_set_get(self):
+        self.cache.set('a', EXAMPLE_DOT_COM)
+        self.cache.set_negative('b')
+
+        self.assertEqual([EXAMPLE_DOT_COM, '', None], self.cache.get_many(['a', 'b', 'c']))
+        self.assertAlmostEqual(1000, self.ttl('a'), delta=1)
+        self.assertAlmostEqual(10, self.ttl('b'), delta=1)
+
+    def test_layout(self):
+        for i in range(100):
+            self.cache.set(f'slug{i}', EXAMPLE_DOT_COM)
+
+        keys = self.redis.keys()
+        if self.buckets:
+            self.assertEqual(16, len(keys))
+            self.assertTrue(all(key.startswith(b'b:') for key in keys))
+        else:
+            self.assertEqual(100, len(keys))
+
+    def test_keys_have_ttl(self):
+        self.cache.set('a', EXAMPLE_DOT_COM)
+        self.cache.set_negative('b')
+
+        # Buckets outlive their entries, and volatile-* policies can evict them
+        for slug, ttl in [('a', 1000), ('b', 10 if not self.buckets else 1000)]:
+            self.assertAlmostEqual(ttl, self.redis.ttl(self.cache.location(slug)[0]), delta=1)
+
+    def test_refreshes_hits_past_half_of_ttl(self):
+        self.cache.set('fresh', EXAMPLE_DOT_COM)
+        self.cache.set('old', EXAMPLE_DOT_COM)
+        self.cache.set_negative('negative')
+        for slug, ttl in [('fresh', 600), ('old', 400)]:
+            self.cache._write(slug, EXAMPLE_DOT_COM, ttl, None)
+
+        self.cache.get_many(['fresh', 'old', 'negative'])
+
+        self.assertAlmostEqual(600, self.ttl('fresh'), delta=1)
+        self.assertAlmostEqual(1000, self.ttl('old'), delta=1)
+        self.assertAlmostEqual(10, self.ttl('negative'), delta=1)
+
+    def test_refreshes_entries_without_ttl(self):
+        self.cache._write('a', EXAMPLE_DOT_COM, 0, None)
+        self.assertEqual(-1, self.ttl('a'))
+
+        self.cache.get('a')
+
+        self.assertAlmostEqual(1000, self.ttl('a'), delta=1)
+
+    def test_no_ttl(self):
+        self.cache.ttl = 0
+        self.cache.set('a', EXAMPLE_DOT_COM)
+
+        self.assertEqual(EXAMPLE_DOT_COM, self.cache.get('a'))
+        self.assertEqual(-1, self.ttl('a'))
+
+    def test_delete(self):
+        self.cache.set('a', EXAMPLE_DOT_COM)
+        self.cache.set('b', EXAMPLE_DOT_COM)
+
+        self.cache.delete('a')
+
+        self.assertEqual([None, EXAMPLE_DOT_COM], self.cache.get_many(['a', 'b']))
+
+    async def test_async(self):
+        await self.cache.aset('a', EXAMPLE_DOT_COM)
+        await self.cache.aset_negative('b')
+
+        self.assertEqual(EXAMPLE_DOT_COM, await self.cache.aget('a'))
+        self.assertEqual('', await self.cache.aget('b'))
+        self.assertIsNone(await self.cache.aget('c'))
+
+
+class SlugCacheMemoryReportTestCase(TestCase):
+    INFO = {'used_memory': 2 ** 20, 'maxmemory': 0, 'maxmemory_policy': 'volatile-lfu',
+            'evicted_keys': 0, 'expired_keys': 5, 'keyspace_hits': 3, 'keyspace_misses': 1}
+
+    def report(self, buckets: int, sampled_keys: list[bytes], measurements: list) -> dict:
+        client = MagicMock()
+        client.info.return_value = self.INFO
+        client.dbsize.return_value = 30
+        client.pipeline.return_value.execute.side_effect = [sampled_keys, measurements]
+        with patch('api.redis.redis', client):
+            return cache.SlugCache(buckets=buckets).memory_report(samples=len(sampled_keys))
+
+    def test_keys(self):
+        report = self.report(0, [b'slug1', b'slug2', b'clicks:pending', b'slug1'], [480, 520])
+
+        self.assertEqual(0.75, report['keyspace_hit_rate'])
+        self.assertEqual(20, report['entries'])
+        self.assertEqual(500, report['bytes_per_entry'])
+        self.assertIsNone(report['listpack_share'])
+
+    def test_buckets(self):
+        report = self.report(16, [b'b:1', b'b:2', b'slugs:leases'],
+                             [4000, 10, b'listpack', 6000, 10, b'hashtable'])
+
+        self.assertEqual(200, report['entries'])
+        self.assertEqual(500, report['bytes_per_entry'])
+        self.assertEqual(0.5, report['listpack_share'])
+
+    def test_buckets_with_field_ttls(self):
+        report = self.report(16, [b'b:1', b'b:2'],
+                             [4000, 10, b'listpackex', 6000, 10, b'hashtable'])
+
+        self.assertEqual(0.5, report['listpack_share'])
+
+
+@patch('api.redis.redis', new_callable=FakeRedis)
+class CacheInvalidationTestCase(ClearLocalCacheMixin, TestCase):
+    def test_invalidate_publishes(self, redis: FakeRedis):
+        pubsub = redis.pubsub()
+        pubsub.subscribe(cache.INVALIDATION_CHANNEL)
+        pubsub.get_message(timeout=1)  # subscription confirmation
+        cache.local_cache.set('a', 1)
+
+        cache.invalidate('a', 'b')
+
+        self.assertIsNone(cache.local_cache.get('a'))
+        self.assertEqual(b'a b', pubsub.get_message(timeout=1)['data'])
+
+    def test_shorten_invalidates_reused_slug(self, redis: FakeRedis):
+        pubsub = redis.pubsub()
+        pubsub.subscribe(cache.INVALIDATION_CHANNEL)
+        pubsub.get_message(timeout=1)  # subscription confirmation
+
+        shorten.shorten(SLUG_EXAMPLE, EXAMPLE_DOT_COM, UUID_NULL)
+        shorten.shorten_many([{'url': EXAMPLE_DOT_COM, 'slug': 'other'}], UUID_NULL)
+
+        self.assertEqual(SLUG_EXAMPLE.encode(), pubsub.get_message(timeout=1)['data'])
+        self.assertEqual(b'other', pubsub.get_message(timeout=1)['data'])
+
+    def test_applies_invalidation_messages(self, _):
+        cache.local_cache.set('a', 1)
+        cache.local_cache.set('b', 2)
+
+        cache._on_invalidation({'data': b'a'})
+
+        self.assertIsNone(cache.local_cache.get('a'))
+        self.assertEqual(2, cache.local_cache.get('b'))
+
 
 class ShortUrlModelTestCase(TestCase):
     def test_create_bad_url(self):
@@ -119,7 +911,7 @@ class ShortUrlModelTestCase(TestCase):
 
 
 @patch('api.redis.redis', new_callable=FakeRedis)
-class RedirectionTestCase(TestCase):
+class RedirectionTestCase(ClearLocalCacheMixin, TestCase):
     @parameterized.expand([
         ('with trailing backslash', f'/{SLUG_EXAMPLE}/'),
         ('without trailing backslash', f'/{SLUG_EXAMPLE}'),
@@ -133,6 +925,15 @@ class RedirectionTestCase(TestCase):
         self.assertIn(response.status_code, {301, 302}, message)
         self.assertEqual(EXAMPLE_DOT_COM, response.headers['Location'], message)
 
+    def test_counts_clicks(self, redis: FakeRedis):
+        ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
+
+        self.client.get(f'/{SLUG_EXAMPLE}')
+        self.client.get(f'/{SLUG_EXAMPLE}')
+        self.client.get('/unknown')
+
+        self.assertEqual({SLUG_EXAMPLE.encode(): b'2'}, redis.hgetall('clicks:pending'))
+
     @parameterized.expand([
         ('with trailing backslash', f'/unknown/'),
         ('without trailing backslash', f'/unknown'),
@@ -143,10 +944,491 @@ class RedirectionTestCase(TestCase):
         self.assertEqual(404, response.status_code, f'failed to give a 404 response {description}')
 
 
+class AsyncRedirectionTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def test_redirect(self):
+        await ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).asave()
+
+        response = await views.aredirect_view(self.factory.get(f'/{SLUG_EXAMPLE}'), SLUG_EXAMPLE)
+
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(EXAMPLE_DOT_COM, response.headers['Location'])
+        self.assertEqual(EXAMPLE_DOT_COM.encode(), self.redis.get(SLUG_EXAMPLE))
+        self.assertEqual(b'1', self.redis.hget('clicks:pending', SLUG_EXAMPLE))
+
+    async def test_unknown_slug(self):
+        response = await views.aredirect_view(self.factory.get('/unknown'), 'unknown')
+
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(b'', self.redis.get('unknown'))
+
+    async def test_unshorten(self):
+        self.redis.set(SLUG_EXAMPLE, EXAMPLE_DOT_COM)
+
+        response = await views.aunshorten_view(self.factory.get('/api/unshorten/',
+                                                                {'slug': SLUG_EXAMPLE}))
+
+        self.assertEqual(EXAMPLE_DOT_COM, response.content.decode())
+
+    async def test_unshorten_bad_requests(self):
+        no_slug = await views.aunshorten_view(self.factory.get('/api/unshorten/'))
+        unknown = await views.aunshorten_view(self.factory.get('/api/unshorten/', {'slug': 'x'}))
+        post = await views.aunshorten_view(self.factory.post('/api/unshorten/'))
+
+        self.assertEqual([400, 404, 405], [no_slug.status_code, unknown.status_code,
+                                           post.status_code])
+
+
+class RedirectFastPathTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Closing connections would end the transaction each test runs in
+        patcher = patch('api.fastpath.close_old_connections')
+        self.close_old_connections = patcher.start()
+        self.addCleanup(patcher.stop)
+        ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
+        self.django_app = MagicMock(return_value=[b'django'])
+
+    def request(self, path, method='GET'):
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path}
+        setup_testing_defaults(environ)
+        start_response = MagicMock()
+        body = fastpath.RedirectFastPath(self.django_app)(environ, start_response)
+        return start_response, body
+
+    @parameterized.expand([(f'/{SLUG_EXAMPLE}',), (f'/{SLUG_EXAMPLE}/',)])
+    def test_redirect(self, path):
+        start_response, _ = self.request(path)
+
+        status, headers = start_response.call_args.args
+        self.assertEqual('302 Found', status)
+        self.assertIn(('Location', EXAMPLE_DOT_COM), headers)
+        self.django_app.assert_not_called()
+        self.assertEqual(b'1', self.redis.hget('clicks:pending', SLUG_EXAMPLE))
+
+    def test_closes_old_connections(self):
+        self.request(f'/{SLUG_EXAMPLE}')
+
+        # Before and after the request, like Django's handler on request_started/finished
+        self.assertEqual(2, self.close_old_connections.call_count)
+
+    def test_unknown_slug(self):
+        start_response, _ = self.request('/unknown')
+
+        self.assertEqual('404 Not Found', start_response.call_args.args[0])
+
+    @parameterized.expand([
+        ('API', '/api/slug/', 'GET'),
+        ('admin', '/admin/', 'GET'),
+        ('unknown path', '/a/b/c', 'GET'),
+        ('non-GET request', f'/{SLUG_EXAMPLE}', 'POST'),
+    ])
+    def test_falls_through(self, description, path, method):
+        _, body = self.request(path, method)
+
+        self.assertEqual([b'django'], body, f'failed to pass on {description}')
+
+    async def test_asgi_redirect(self):
+        django_app = AsyncMock()
+        send = AsyncMock()
+        scope = {'type': 'http', 'method': 'GET', 'path': f'/{SLUG_EXAMPLE}', 'client': ('1.1.1.1', 1),
+                 'headers': [(b'referer', b'https://example.com/')]}
+
+        await fastpath.AsyncRedirectFastPath(django_app)(scope, AsyncMock(), send)
+
+        start = send.call_args_list[0].args[0]
+        self.assertEqual(302, start['status'])
+        self.assertIn((b'location', EXAMPLE_DOT_COM.encode()), start['headers'])
+        django_app.assert_not_called()
+        self.assertEqual(1, self.redis.zscore('stats:referrers:' + SLUG_EXAMPLE, 'example.com'))
+
+    async def test_asgi_closes_old_connections(self):
+        scope = {'type': 'http', 'method': 'GET', 'path': '/unknown', 'headers': []}
+
+        await fastpath.AsyncRedirectFastPath(AsyncMock())(scope, AsyncMock(), AsyncMock())
+
+        self.assertEqual(2, self.close_old_connections.call_count)
+
+    async def test_asgi_falls_through(self):
+        django_app = AsyncMock()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/slug/', 'headers': []}
+
+        await fastpath.AsyncRedirectFastPath(django_app)(scope, AsyncMock(), AsyncMock())
+
+        django_app.assert_awaited_once()
+
+
+class BenchmarkResultTestCase(TestCase):
+    def test_statistics(self):
+        result = benchmarks.Result('test', [i * 1000 for i in range(100, 0, -1)])
+
+        self.assertAlmostEqual(100 / 0.00505, result.ops_per_sec)
+        self.assertEqual((51, 96, 100), tuple(result.percentile_us(p) for p in (50, 95, 99)))
+
+    def test_warm_up_with_other_indexes(self):
+        calls = []
+
+        result = benchmarks.measure('test', calls.append, 20)
+
+        self.assertEqual([20, 21, *range(20)], calls)
+        self.assertEqual(20, len(result.timings_ns))
+
+    def test_compare(self):
+        baseline = {'fast': {'ops_per_sec': 1000, 'p95_us': 1000},
+                    'slow': {'ops_per_sec': 1000, 'p95_us': 1000}}
+        results = [benchmarks.Result('fast', [1000 * 1000] * 10),
+                   benchmarks.Result('slow', [1500 * 1000] * 10),
+                   benchmarks.Result('new', [1000])]
+
+        regressions = benchmarks.compare(results, baseline, tolerance=0.2)
+
+        self.assertEqual(2, len(regressions))
+        self.assertTrue(all(regression.startswith('slow') for regression in regressions))
+
+
+class MetricsTestCase(ClearMetricsMixin, TestCase):
+    def test_render(self):
+        metrics.inc('unshorten_lookups_total', result='local_hit')
+        metrics.inc('unshorten_lookups_total', 2, result='local_hit')
+        metrics.registry.observe('http_request_duration_seconds', 0.003, view='a')
+        metrics.registry.observe('http_request_duration_seconds', 10, view='a')
+
+        lines = metrics.render(metrics.collect()).splitlines()
+
+        self.assertIn('# TYPE unshorten_lookups_total counter', lines)
+        self.assertIn('unshorten_lookups_total{result="local_hit"} 3', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="0.0025"} 0', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="0.005"} 1', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="5"} 1', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="a",le="+Inf"} 2', lines)
+        self.assertIn('http_request_duration_seconds_sum{view="a"} 10.003', lines)
+        self.assertIn('http_request_duration_seconds_count{view="a"} 2', lines)
+
+    def test_track_request(self):
+        client = redis.InstrumentedRedis(connection_pool=FakeRedis(server=FakeServer()).connection_pool)
+
+        with metrics.track_request('view') as usage:
+            client.set('a', 'b')
+            pipeline = client.pipeline()
+            pipeline.get('a')
+            pipeline.get('b')
+            pipeline.execute()
+            ShortUrl.objects.count()
+        client.get('a')
+
+        self.assertEqual([2, 1], [usage['redis'][0], usage['db'][0]])
+        counters = metrics.registry.counters
+        self.assertEqual(2, counters[('redis_commands_total', (('view', 'view'),))])
+        self.assertEqual(1, counters[('db_queries_total', (('view', 'view'),))])
+        self.assertEqual(1, counters[('redis_commands_total', (('view', 'none'),))])
+        self.assertEqual(1, metrics.registry.histograms[
+            ('http_request_duration_seconds', (('view', 'view'),))][-1])
+
+    async def test_async_redis(self):
+        client = redis.InstrumentedAsyncRedis(
+            connection_pool=FakeAsyncRedis(server=FakeServer()).connection_pool)
+
+        with metrics.track_request('view') as usage:
+            await client.set('a', 'b')
+            pipeline = client.pipeline()
+            pipeline.get('a')
+            await pipeline.execute()
+
+        self.assertEqual(2, usage['redis'][0])
+
+
+class UnshortenMetricsTestCase(ClearMetricsMixin, FakeRedisMixin, TestCase):
+    def lookups(self) -> dict[str, float]:
+        return {dict(labels)['result']: value for (name, labels), value
+                in metrics.registry.counters.items() if name == 'unshorten_lookups_total'}
+
+    def test_unshorten(self):
+        bloom.slug_filter.rebuild([SLUG_EXAMPLE])
+        ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
+        shorten.unshorten(SLUG_EXAMPLE)
+        shorten.unshorten(SLUG_EXAMPLE)
+        cache.local_cache.clear()
+        shorten.unshorten(SLUG_EXAMPLE)
+        for _ in range(2):
+            with self.assertRaises(shorten.UnshortenError):
+                shorten.unshorten('unknown')
+        self.redis.set('gone', '')
+        with self.assertRaises(shorten.UnshortenError):
+            shorten.unshorten('gone')
+
+        self.assertEqual({'db_hit': 1, 'local_hit': 1, 'redis_hit': 1, 'filtered': 2,
+                          'negative_hit': 1}, self.lookups())
+
+    def test_unshorten_many(self):
+        ShortUrl.objects.bulk_create([ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL)
+                                      for slug in ('local', 'redis', 'db')])
+        shorten.unshorten('local')
+        self.redis.set('redis', EXAMPLE_DOT_COM)
+        self.redis.set('negative', '')
+        metrics.registry.clear()
+
+        shorten.unshorten_many(['local', 'redis', 'negative', 'db', 'unknown'])
+
+        self.assertEqual({'local_hit': 1, 'redis_hit': 1, 'negative_hit': 1, 'db_hit': 1,
+                          'not_found': 1}, self.lookups())
+
+
+class SingleFlightTestCase(ClearMetricsMixin, FakeRedisMixin, TestCase):
+    CALLERS = 20
+
+    def setUp(self):
+        super().setUp()
+        self.loaded_slugs = []
+
+    def load(self, slug: str) -> ShortUrl:
+        # Stands in for a slow query, so that all callers miss the cache before it is filled
+        self.loaded_slugs.append(slug)
+        time.sleep(0.1)
+        if slug == 'unknown':
+            raise ShortUrl.DoesNotExist()
+        return ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL)
+
+    async def aload(self, slug: str) -> ShortUrl:
+        self.loaded_slugs.append(slug)
+        await asyncio.sleep(0.1)
+        if slug == 'unknown':
+            raise ShortUrl.DoesNotExist()
+        return ShortUrl(slug=slug, url=EXAMPLE_DOT_COM, user_id=UUID_NULL)
+
+    def burst(self, slugs: list[str]) -> list:
+        """Looks up every slug from CALLERS threads at once each. Returns the URLs or errors."""
+        barrier = threading.Barrier(self.CALLERS * len(slugs))
+
+        def unshorten(slug):
+            barrier.wait()
+            try:
+                return shorten.unshorten(slug)
+            except shorten.UnshortenError as e:
+                return e
+
+        with patch.object(ShortUrl.objects, 'get', side_effect=lambda slug: self.load(slug)):
+            with ThreadPoolExecutor(self.CALLERS * len(slugs)) as executor:
+                return list(executor.map(unshorten, slugs * self.CALLERS))
+
+    def lookups(self) -> dict[str, float]:
+        return {dict(labels)['result']: value for (name, labels), value
+                in metrics.registry.counters.items() if name == 'unshorten_lookups_total'}
+
+    def test_one_query_per_slug(self):
+        results = self.burst(['a', 'b', 'unknown'])
+
+        self.assertEqual(['a', 'b', 'unknown'], sorted(self.loaded_slugs))
+        self.assertEqual([EXAMPLE_DOT_COM] * self.CALLERS * 2,
+                         [result for result in results if isinstance(result, str)])
+        self.assertEqual(self.CALLERS, sum(isinstance(result, shorten.UnshortenError)
+                                           for result in results))
+        self.assertEqual({'db_hit': 2, 'not_found': 1, 'coalesced': self.CALLERS * 3 - 3},
+                         self.lookups())
+
+    @override_settings(SLUG_SINGLE_FLIGHT={'local': False, 'redis': True, 'lock_ttl': 1,
+                                           'wait': 0.5, 'poll_interval': 0.01})
+    def test_one_query_per_slug_across_processes(self):
+        # Without coalescing within the process, every thread acts like a separate process
+        results = self.burst([SLUG_EXAMPLE])
+
+        self.assertEqual([SLUG_EXAMPLE], self.loaded_slugs)
+        self.assertEqual([EXAMPLE_DOT_COM] * self.CALLERS, results)
+        self.assertIsNone(self.redis.get(f'fill:{SLUG_EXAMPLE}'))
+
+    @override_settings(SLUG_SINGLE_FLIGHT={'local': False, 'redis': False})
+    def test_disabled(self):
+        self.burst([SLUG_EXAMPLE])
+
+        self.assertEqual([SLUG_EXAMPLE] * self.CALLERS, self.loaded_slugs)
+
+    @override_settings(SLUG_SINGLE_FLIGHT={'local': True, 'redis': True, 'lock_ttl': 10,
+                                           'wait': 0.05, 'poll_interval': 0.01})
+    def test_loads_after_waiting_for_lost_lock(self):
+        ShortUrl(slug=SLUG_EXAMPLE, url=EXAMPLE_DOT_COM, user_id=UUID_NULL).save()
+        # Taken by a process which died before caching the slug
+        self.redis.set(f'fill:{SLUG_EXAMPLE}', 1)
+
+        self.assertEqual(EXAMPLE_DOT_COM, shorten.unshorten(SLUG_EXAMPLE))
+        self.assertEqual({'db_hit': 1}, self.lookups())
+
+    async def test_async_one_query_per_slug(self):
+        with patch.object(ShortUrl.objects, 'aget', side_effect=lambda slug: self.aload(slug)):
+            results = await asyncio.gather(
+                *(shorten.aunshorten(slug) for slug in ['a', 'unknown'] * self.CALLERS),
+                return_exceptions=True)
+
+        self.assertEqual(['a', 'unknown'], sorted(self.loaded_slugs))
+        self.assertEqual([EXAMPLE_DOT_COM, shorten.UnshortenError] * self.CALLERS,
+                         [result if isinstance(result, str) else type(result)
+                          for result in results])
+        self.assertEqual({'db_hit': 1, 'not_found': 1, 'coalesced': self.CALLERS * 2 - 2},
+                         self.lookups())
+
+
+class WarmupTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        ShortUrl.objects.bulk_create([ShortUrl(slug=f'slug{i}', url=f'{EXAMPLE_DOT_COM}/{i}',
+                                               user_id=UUID_NULL) for i in range(5)])
+        ShortUrl.objects.filter(slug__in=['slug0', 'slug1']).update(
+            created_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+
+    def test_chunks(self):
+        self.assertEqual([[('slug0', f'{EXAMPLE_DOT_COM}/0'), ('slug1', f'{EXAMPLE_DOT_COM}/1')],
+                          [('slug2', f'{EXAMPLE_DOT_COM}/2'), ('slug3', f'{EXAMPLE_DOT_COM}/3')],
+                          [('slug4', f'{EXAMPLE_DOT_COM}/4')]],
+                         list(warmup.chunks(chunk_size=2)))
+
+    def test_chunks_encode_expiry(self):
+        expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+        ShortUrl.objects.filter(slug='slug0').update(expires_at=expires_at)
+        ShortUrl.objects.filter(slug='slug1').update(
+            expires_at=datetime(2020, 2, 1, tzinfo=timezone.utc))
+
+        chunk = next(warmup.chunks(chunk_size=2))
+
+        self.assertEqual([('slug0', cache.encode(f'{EXAMPLE_DOT_COM}/0', expires_at)),
+                          ('slug2', f'{EXAMPLE_DOT_COM}/2')], chunk)
+
+    def test_chunks_created_after(self):
+        chunks = warmup.chunks(datetime(2021, 1, 1, tzinfo=timezone.utc), chunk_size=2)
+
+        self.assertEqual([['slug2', 'slug3'], ['slug4']],
+                         [[slug for slug, _ in chunk] for chunk in chunks])
+
+    def test_chunks_by_clicks(self):
+        DailyClicks.objects.bulk_create([
+            DailyClicks(slug=slug, day=date(2024, 1, day), clicks=clicks, unique_visitors=1)
+            for slug, day, clicks in [('slug1', 2, 5), ('slug1', 3, 5), ('slug3', 3, 20),
+                                      ('slug4', 3, 10), ('deleted', 3, 50)]])
+        DailyClicks(slug='slug2', day=date(2023, 12, 1), clicks=100, unique_visitors=1).save()
+
+        chunks = warmup.chunks_by_clicks(date(2024, 1, 1), chunk_size=2)
+
+        self.assertEqual([['slug3'], ['slug1', 'slug4']],
+                         [[slug for slug, _ in chunk] for chunk in chunks])
+
+    def test_warm(self):
+        counts = list(warmup.warm(warmup.chunks(chunk_size=2), limit=3))
+
+        self.assertEqual([2, 1], counts)
+        self.assertEqual([f'{EXAMPLE_DOT_COM}/0', f'{EXAMPLE_DOT_COM}/2', None],
+                         cache.slug_cache.get_many(['slug0', 'slug2', 'slug3']))
+        self.assertGreater(self.redis.ttl('slug0'), 0)
+
+
+class LoadTestTestCase(TestCase):
+    def test_parse_mix(self):
+        self.assertEqual({'redirect': 0.75, 'listing': 0.25}, loadtest.parse_mix('redirect=3,listing=1'))
+
+    @parameterized.expand([('redirect=1,unknown=1',), ('redirect=-1,slug=2',), ('redirect=0',),
+                           ('redirect',)])
+    def test_parse_invalid_mix(self, mix):
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix(mix)
+
+    def test_zipf_sampler_prefers_low_ranks(self):
+        sampler = loadtest.ZipfSampler(100, rng=random.Random(0))
+
+        counts = Counter(sampler.sample() for _ in range(10000))
+
+        self.assertLess(max(counts), 100)
+        self.assertGreater(counts[0], 10 * counts[50])
+        self.assertAlmostEqual(1 / sum(1 / k for k in range(1, 101)), counts[0] / 10000, delta=0.02)
+
+    def test_stats(self):
+        stats = loadtest.Stats()
+        for latency in (0.5, 1.5, 1.5, 7, 7000):
+            stats.record('redirect', latency, ok=latency < 1000)
+
+        self.assertEqual(5, stats.requests)
+        self.assertEqual(1, stats.errors['redirect'])
+        self.assertEqual(7, stats.percentile_ms('redirect', 75))
+        histogram = dict(stats.histogram('redirect'))
+        self.assertEqual((1, 2, 1, 1), (histogram['<= 1 ms'], histogram['<= 2 ms'],
+                                        histogram['<= 10 ms'], histogram['> 5000 ms']))
+
+    async def test_http_connection(self):
+        requests = []
+
+        async def serve(reader, writer):
+            for _ in range(2):
+                requests.append(await reader.readuntil(b'\r\n\r\n'))
+                if len(requests) == 1:
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                                 b'Set-Cookie: sessionid=abc; Path=/; HttpOnly\r\n\r\nok')
+                else:
+                    writer.write(b'HTTP/1.1 302 Found\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                 b'3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n')
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        connection = loadtest.HTTPConnection('127.0.0.1', server.sockets[0].getsockname()[1],
+                                             None, 'localhost')
+        try:
+            self.assertEqual((200, b'ok'), await connection.request('GET', '/a'))
+            self.assertEqual((302, b'abcde'), await connection.request('GET', '/b'))
+        finally:
+            connection.close()
+            server.close()
+
+        self.assertEqual(2, len(requests))
+        self.assertIn(b'Cookie: sessionid=abc\r\n', requests[1])
+
+
+    @parameterized.expand([('Connection: close', b'Connection: close\r\n'),
+                           ('idle connection closed', b'')])
+    async def test_http_connection_closed_by_server(self, _, connection_header):
+        connections = 0
+
+        async def serve(reader, writer):
+            # One response per connection, like gunicorn's sync workers
+            nonlocal connections
+            connections += 1
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n' + connection_header +
+                         b'\r\nok')
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        connection = loadtest.HTTPConnection('127.0.0.1', server.sockets[0].getsockname()[1],
+                                             None, 'localhost')
+        try:
+            for _ in range(3):
+                self.assertEqual((200, b'ok'), await connection.request('GET', '/a'))
+                # Lets the server close its side first
+                await asyncio.sleep(0.01)
+        finally:
+            connection.close()
+            server.close()
+
+        self.assertEqual(3, connections)
+
+    def test_hit_ratio(self):
+        before = loadtest.parse_lookups('# TYPE unshorten_lookups_total counter\n'
+                                        'unshorten_lookups_total{result="db_hit"} 10\n'
+                                        'unshorten_lookups_total{result="redis_hit"} 10\n')
+        after = loadtest.parse_lookups('unshorten_lookups_total{result="db_hit"} 12\n'
+                                       'unshorten_lookups_total{result="local_hit"} 5\n'
+                                       'unshorten_lookups_total{result="not_found"} 1\n'
+                                       'unshorten_lookups_total{result="redis_hit"} 12\n'
+                                       'db_queries_total{view="a"} 100\n')
+
+        self.assertEqual({'db_hit': 12, 'local_hit': 5, 'not_found': 1, 'redis_hit': 12}, after)
+        self.assertEqual(0.7, loadtest.hit_ratio(before, after))
+        self.assertIsNone(loadtest.hit_ratio(after, after))
+        self.assertIsNone(loadtest.hit_ratio(None, after))
+
 class ShortUrlSerializerTestCase(TestCase):
     def test_serialize(self):
         url = ShortUrl(url=EXAMPLE_DOT_COM, slug=SLUG_EXAMPLE, user_id=UUID_NULL)
         serializer = ShortUrlSerializer(url)
         serialized = serializer.data
 
-        self.assertEqual({'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE}, serialized)
+        self.assertEqual({'url': EXAMPLE_DOT_COM, 'slug': SLUG_EXAMPLE, 'expires_at': None},
+                         serialized)
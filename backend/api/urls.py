@@ -1,12 +1,24 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+# Async views need an event loop living as long as the worker, i.e. an ASGI server
+if getattr(settings, 'ASGI', False):
+    unshorten_view, redirect_view = views.aunshorten_view, views.aredirect_view
+else:
+    unshorten_view, redirect_view = views.unshorten_view, views.redirect_view
+
 urlpatterns = [
     path('api/shorten/', views.shorten_view),
-    path('api/unshorten/', views.unshorten_view),
+    path('api/shorten/bulk/', views.bulk_shorten_view),
+    path('api/unshorten/', unshorten_view),
+    path('api/unshorten/bulk/', views.bulk_unshorten_view),
     path('api/slug/', views.slug_view),
     path('api/urls/', views.UserURLsListingView.as_view()),
-    path('<slug:slug>/', views.redirect_view),
-    path('<slug:slug>', views.redirect_view),
+    path('api/urls/export/', views.export_urls_view),
+    path('api/urls/<slug:slug>/stats/', views.url_stats_view),
+    path('metrics', views.metrics_view),
+    path('<slug:slug>/', redirect_view),
+    path('<slug:slug>', redirect_view),
 ]
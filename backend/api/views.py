@@ -1,24 +1,42 @@
 import uuid
+from datetime import datetime
+from typing import Optional
 
+from django.conf import settings
 from django.http import HttpRequest
-from django.http.response import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
+from django.http.response import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, \
+    HttpResponseNotFound, StreamingHttpResponse
 from django.shortcuts import redirect
-from rest_framework.decorators import api_view
-from rest_framework.exceptions import ParseError
+from django.views.decorators.http import require_GET
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.fields import BooleanField, DateTimeField
 from rest_framework.generics import ListAPIView
+from rest_framework.parsers import JSONParser
 from rest_framework.request import Request
+from rest_framework.response import Response
 
 from . import models, serializers
-from . import shorten
+from . import analytics, clicks, export, leases, metrics, routers, shards, shorten
 from .exceptions import Conflict
+from .pagination import KeysetPagination
+from .parsers import NDJSONParser
+
+
+_RANDOM_SLUG_ATTEMPTS = 3
 
 
 @api_view(['POST'])
 def shorten_view(request: Request) -> HttpResponse:
     url = _get_url(request)
-    slug = _get_slug(request)
+    expires_at = _get_expires_at(request)
     user_id = _authorize_user(request)
-    _shorten(slug, url, user_id)
+    if 'slug' in request.data:
+        slug = request.data['slug']
+        _shorten_with_custom_slug(slug, url, user_id, expires_at)
+    else:
+        slug = _shorten_with_random_slug(url, user_id, expires_at,
+                                         _get_dedupe(request.data.get('dedupe', False)))
     response = HttpResponse(slug)
     response['Content-Type'] = 'text/plain; charset=utf-8'
     return response
@@ -31,9 +49,22 @@ def _get_url(request: Request) -> str:
         raise ParseError() from e
 
 
-def _get_slug(request: Request) -> str:
+def _get_expires_at(request: Request) -> Optional[datetime]:
+    """Parses the optional ISO 8601 expiry time, taking naive times as in TIME_ZONE."""
+    value = request.data.get('expires_at')
+    if value is None or value == '':
+        return None
+    return DateTimeField().to_internal_value(value)
+
+
+def _get_dedupe(value) -> bool:
+    """Parses the opt-in to reusing the slug of a URL the user already shortened."""
+    return BooleanField().to_internal_value(value)
+
+
+def _generate_slug() -> str:
     try:
-        return request.data.get('slug', shorten.generate_unique_slug(6))
+        return shorten.generate_unique_slug(shorten.RANDOM_SLUG_LENGTH)
     except shorten.NoFreeSlugsError as e:
         raise Conflict('Random slug space is exhausted. Try shortening with a longer slug.') from e
 
@@ -46,15 +77,68 @@ def _authorize_user(request: Request) -> uuid.UUID:
     return user_token
 
 
-def _shorten(slug: str, url: str, user_id: uuid.UUID) -> None:
+def _shorten_with_custom_slug(slug: str, url: str, user_id: uuid.UUID,
+                              expires_at: Optional[datetime]) -> None:
+    # Other values cannot have been leased, and are rejected by shorten() without reaching Redis
+    leased = isinstance(slug, str) and shorten.is_valid_slug(slug) and leases.pool.claim(slug)
     try:
-        shorten.shorten(slug, url, user_id)
+        _shorten(slug, url, user_id, expires_at)
+    except ParseError:
+        if leased:
+            leases.pool.release(slug)
+        raise
+
+
+def _shorten(slug: str, url: str, user_id: uuid.UUID, expires_at: Optional[datetime]) -> None:
+    try:
+        shorten.shorten(slug, url, user_id, expires_at)
     except shorten.ShortenDuplicateError as e:
         raise Conflict('This slug is already occupied.') from e
     except shorten.ShortenBadInputError as e:
         raise ParseError(str(e)) from e
 
 
+def _shorten_with_random_slug(url: str, user_id: uuid.UUID, expires_at: Optional[datetime],
+                              dedupe: bool = False) -> str:
+    # A URL shortened with an expiry time gets a short URL of its own
+    if dedupe and expires_at is None:
+        existing = shorten.existing_slugs([url], user_id).get(url)
+        if existing is not None:
+            metrics.inc('shorten_deduplicated_total', endpoint='shorten')
+            return existing
+    for _ in range(_RANDOM_SLUG_ATTEMPTS):
+        slug = _generate_slug()
+        try:
+            shorten.shorten(slug, url, user_id, expires_at)
+            return slug
+        except shorten.ShortenDuplicateError:
+            # Generated slugs never repeat, but one may have been taken as a custom slug
+            metrics.inc('slug_generation_retries_total', endpoint='shorten')
+            continue
+        except shorten.ShortenBadInputError as e:
+            raise ParseError(str(e)) from e
+    raise Conflict('Failed to find a free slug. Try shortening with a custom slug.')
+
+
+@api_view(['POST'])
+@parser_classes([JSONParser, NDJSONParser])
+def bulk_shorten_view(request: Request) -> Response:
+    options = getattr(settings, 'BULK_SHORTEN', {})
+    items = request.data
+    if not isinstance(items, list):
+        raise ParseError('Expected a list of {"url": ..., "slug": ...} objects.')
+    max_items = options.get('max_items', 10000)
+    if len(items) > max_items:
+        raise ParseError(f'At most {max_items} URLs can be shortened at once.')
+    dedupe = _get_dedupe(request.query_params.get('dedupe', False))
+    user_id = _authorize_user(request)
+    try:
+        return Response(shorten.shorten_many(items, user_id, options.get('chunk_size', 500),
+                                             dedupe))
+    except shorten.NoFreeSlugsError as e:
+        raise Conflict('Random slug space is exhausted. Try shortening with longer slugs.') from e
+
+
 @api_view(['GET'])
 def unshorten_view(request: Request) -> HttpResponse:
     try:
@@ -66,17 +150,54 @@ def unshorten_view(request: Request) -> HttpResponse:
     return HttpResponse(url)
 
 
+@api_view(['GET', 'POST'])
+def bulk_unshorten_view(request: Request) -> Response:
+    """Resolves the slugs given as repeated "slug" query parameters or a JSON array."""
+    slugs = request.data if request.method == 'POST' else request.query_params.getlist('slug')
+    if not isinstance(slugs, list) or not all(isinstance(slug, str) for slug in slugs):
+        raise ParseError('Expected a list of slugs.')
+    max_slugs = getattr(settings, 'BULK_UNSHORTEN_MAX_SLUGS', 1000)
+    if len(slugs) > max_slugs:
+        raise ParseError(f'At most {max_slugs} slugs can be resolved at once.')
+    return Response(shorten.unshorten_many(slugs))
+
+
 def redirect_view(request: HttpRequest, slug: str) -> HttpResponse:
     try:
-        return redirect(shorten.unshorten(slug))
+        response = redirect(shorten.unshorten(slug))
     except shorten.UnshortenError:
         return HttpResponseNotFound()
+    clicks.record(slug, request.META)
+    return response
+
+
+async def aunshorten_view(request: HttpRequest) -> HttpResponse:
+    """`unshorten_view` for ASGI workers. REST framework views can't be asynchronous."""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        url = await shorten.aunshorten(request.GET['slug'])
+    except shorten.UnshortenError:
+        return HttpResponseNotFound()
+    except KeyError:
+        return HttpResponseBadRequest()
+    return HttpResponse(url)
+
+
+async def aredirect_view(request: HttpRequest, slug: str) -> HttpResponse:
+    """`redirect_view` for ASGI workers."""
+    try:
+        response = redirect(await shorten.aunshorten(slug))
+    except shorten.UnshortenError:
+        return HttpResponseNotFound()
+    await clicks.arecord(slug, request.META)
+    return response
 
 
 @api_view(['GET'])
 def slug_view(request: Request) -> HttpResponse:
     try:
-        return HttpResponse(shorten.generate_unique_slug(int(request.query_params['length'])))
+        return HttpResponse(leases.pool.lease(int(request.query_params['length'])))
     except shorten.NoFreeSlugsError:
         return HttpResponse('Random slug space is exhausted. Try shortening with a longer slug.',
                             status=409)
@@ -88,9 +209,49 @@ def slug_view(request: Request) -> HttpResponse:
 
 class UserURLsListingView(ListAPIView):
     serializer_class = serializers.ShortUrlSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         session = self.request.session
         if 'user_id' not in session:
             return models.ShortUrl.objects.none()
-        return models.ShortUrl.objects.filter(user_id=self.request.session['user_id']).order_by('created_at')
+        return models.ShortUrl.objects.filter(user_id=self.request.session['user_id'])
+
+    def list(self, request, *args, **kwargs):
+        with routers.replica_reads():
+            return super().list(request, *args, **kwargs)
+
+
+@require_GET
+def export_urls_view(request: HttpRequest) -> HttpResponse:
+    """Streams all URLs of the user as NDJSON or, with `?format=csv`, as CSV."""
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in export.FORMATS:
+        return HttpResponseBadRequest(f'Format has to be one of: {", ".join(export.FORMATS)}.')
+    content_type, serialize = export.FORMATS[export_format]
+    user_id = request.session.get('user_id')
+    rows = export.rows(user_id, getattr(settings, 'URL_EXPORT_CHUNK_SIZE', 2000)) if user_id else []
+    response = StreamingHttpResponse(serialize(rows), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="urls.{export_format}"'
+    return response
+
+
+@require_GET
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """Metrics of all worker processes in the Prometheus text format, see `api.metrics`."""
+    return HttpResponse(metrics.render(metrics.collect()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+def url_stats_view(request: Request, slug: str) -> Response:
+    user_id = request.session.get('user_id')
+    if user_id is None or not shards.manager(slug).filter(slug=slug, user_id=user_id).exists():
+        raise NotFound()
+    try:
+        days = int(request.query_params.get('days', 30))
+    except ValueError as e:
+        raise ParseError('Day count has to be a number.') from e
+    if not 1 <= days <= 366:
+        raise ParseError('Day count has to be between 1 and 366.')
+    return Response({'slug': slug, 'clicks': clicks.total(slug), **analytics.stats(slug, days)})
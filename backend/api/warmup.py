@@ -0,0 +1,80 @@
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .models import DailyClicks, ShortUrl
+from . import cache, redis, shards
+
+
+def chunks(created_after: Optional[datetime] = None,
+           chunk_size: int = 5000) -> Iterator[list[tuple[str, str]]]:
+    """Yields the slugs and cache values of all unexpired short URLs, or of the ones created
+    after `created_after`, in chunks ordered by slug, one shard after the other.
+
+    Every chunk is a query continuing after the last slug of the previous one along the primary
+    key. MySQL client cursors buffer whole result sets, so `QuerySet.iterator()` would not keep
+    memory flat.
+    """
+    for alias in shards.aliases():
+        queryset = _unexpired(ShortUrl.objects.using(alias).order_by('slug'), created_after)
+        chunk = list(queryset.values_list('slug', 'url', 'expires_at')[:chunk_size])
+        while chunk:
+            yield [(slug, cache.encode(url, expires_at)) for slug, url, expires_at in chunk]
+            if len(chunk) < chunk_size:
+                break
+            chunk = list(queryset.filter(slug__gt=chunk[-1][0])
+                         .values_list('slug', 'url', 'expires_at')[:chunk_size])
+
+
+def chunks_by_clicks(clicked_since: date, created_after: Optional[datetime] = None,
+                     chunk_size: int = 5000) -> Iterator[list[tuple[str, str]]]:
+    """Yields the slugs and cache values of the unexpired short URLs clicked since
+    `clicked_since` in chunks, most clicked first.
+
+    Chunks continue after the click total and slug of the last slug of the previous chunk, so
+    every chunk adds the daily click counts of the period up again. Limit the number of chunks
+    when the period holds many slugs.
+    """
+    totals = (DailyClicks.objects.filter(day__gte=clicked_since).values('slug')
+              .annotate(total=Sum('clicks')).order_by('-total', 'slug'))
+    page = list(totals.values_list('slug', 'total')[:chunk_size])
+    while page:
+        found = {}
+        for alias, group in shards.group(slug for slug, _ in page).items():
+            urls = _unexpired(ShortUrl.objects.using(alias).filter(slug__in=group), created_after)
+            found.update((slug, cache.encode(url, expires_at)) for slug, url, expires_at
+                         in urls.values_list('slug', 'url', 'expires_at'))
+        # Statistics outlive deleted short URLs
+        yield [(slug, found[slug]) for slug, _ in page if slug in found]
+        if len(page) < chunk_size:
+            return
+        slug, total = page[-1]
+        page = list(totals.filter(Q(total__lt=total) | Q(total=total, slug__gt=slug))
+                    .values_list('slug', 'total')[:chunk_size])
+
+
+def _unexpired(queryset, created_after: Optional[datetime]):
+    queryset = queryset.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+    if created_after is not None:
+        queryset = queryset.filter(created_at__gte=created_after)
+    return queryset
+
+
+def warm(chunks: Iterator[list[tuple[str, str]]], limit: Optional[int] = None) -> Iterator[int]:
+    """Caches the chunks of `(slug, value)` with one Redis pipeline each, up to `limit` slugs.
+    Yields the number of slugs cached per chunk."""
+    cached = 0
+    for chunk in chunks:
+        if limit is not None:
+            chunk = chunk[:limit - cached]
+        pipeline = redis.redis.pipeline(transaction=False)
+        for slug, value in chunk:
+            cache.slug_cache.set(slug, value, pipeline=pipeline)
+        if len(pipeline):
+            pipeline.execute()
+        cached += len(chunk)
+        yield len(chunk)
+        if cached == limit:
+            return
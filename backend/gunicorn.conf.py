@@ -1 +1,30 @@
+import os
+import shutil
+
 bind = 'unix:/run/backend/backend.socket'
+
+if bool(int(os.environ.get('ASGI', '0'))):
+    # One worker process serves many redirects concurrently while they wait for Redis or the DB
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'urlshortener.asgi:application'
+else:
+    wsgi_app = 'urlshortener.wsgi:application'
+
+
+def on_starting(server):
+    # Metrics dumped by the workers of an earlier run would be added to the new ones
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+
+
+def post_worker_init(worker):
+    from api import cache, metrics
+    cache.listen_for_invalidations()
+    metrics.start_dumping()
+
+
+def worker_exit(server, worker):
+    from api import metrics
+    metrics.dump()
@@ -1,7 +1,12 @@
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'urlshortener.settings')
 
 application = get_asgi_application()
+
+if settings.REDIRECT_FAST_PATH:
+    from api.fastpath import AsyncRedirectFastPath
+    application = AsyncRedirectFastPath(application)
@@ -12,6 +12,10 @@ def envbool(name: str, default: str) -> bool:
 
 DEBUG = envbool('DEBUG', '0')
 DOCKER = envbool('DOCKER', '0')
+# Serve through urlshortener.asgi with async redirect views, see gunicorn.conf.py
+ASGI = envbool('ASGI', '0')
+# Serve redirects ahead of the middleware stack, see api.fastpath
+REDIRECT_FAST_PATH = envbool('REDIRECT_FAST_PATH', '1')
 
 ALLOWED_HOSTS = []
 
@@ -34,6 +38,8 @@ except ImportError:
     pass
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.routers.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,13 +80,49 @@ if DOCKER:
             'PORT': '3306',
         }
     }
+    # Further databases ShortUrl rows are spread over, e.g. DB_SHARD_HOSTS=db-shard-1,db-shard-2
+    shard_hosts = filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(','))
+    for i, host in enumerate(shard_hosts, 1):
+        DATABASES[f'shard{i}'] = {**DATABASES['default'], 'HOST': host}
+    SHORTURL_SHARDS = [alias for alias in DATABASES]
+    # Read replicas of the primary, e.g. DB_REPLICA_HOSTS=db-replica-1,db-replica-2
+    replica_hosts = filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))
+    for i, host in enumerate(replica_hosts, 1):
+        DATABASES[f'replica{i}'] = {**DATABASES['default'], 'HOST': host,
+                                    'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES = {'default': [alias for alias in DATABASES if alias.startswith('replica')]}
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
-        }
+        },
+        # Stands in for a replica with DB_REPLICA=1: copy db.sqlite3 over to catch it up
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db-replica.sqlite3',
+        },
     }
+    # DB_SHARDS=2 spreads ShortUrl rows over db.sqlite3 and two more files. Two are always
+    # configured for the tests.
+    shard_count = int(os.environ.get('DB_SHARDS', '0'))
+    for i in range(1, max(shard_count, 2) + 1):
+        DATABASES[f'shard{i}'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'db-shard{i}.sqlite3',
+        }
+    SHORTURL_SHARDS = ['default', *(f'shard{i}' for i in range(1, shard_count + 1))]
+    REPLICA_DATABASES = {'default': ['replica']} if envbool('DB_REPLICA', '0') else {}
+
+# ShortUrl rows live on the SHORTURL_SHARDS database picked by a hash of their slug, the other
+# models on `default`. To add shards, append them, set SHORTURL_PREVIOUS_SHARD_COUNT to the old
+# count while `manage.py rebalance_shards` moves rows, then unset it. See api.shards.
+SHORTURL_PREVIOUS_SHARD_COUNT = int(os.environ.get('DB_PREVIOUS_SHARD_COUNT', '0')) or None
+
+# Resolve and listing reads go to REPLICA_DATABASES of their database, except for clients that
+# wrote within the last REPLICA_PIN_SECONDS, see api.routers
+DATABASE_ROUTERS = ['api.routers.DatabaseRouter']
+REPLICA_PIN_SECONDS = 10
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -120,3 +162,101 @@ REST_FRAMEWORK = {
 REDIS = {
     'host': 'redis',
 }
+
+# Where the sessions holding ephemeral user IDs live: "db", "cookie" (signed cookies) or
+# "redis". Sessions stored in the database before switching are moved over on first use, see
+# api.sessions.
+SESSION_MODE = os.environ.get('SESSION_MODE', 'db')
+if SESSION_MODE == 'cookie':
+    SESSION_ENGINE = 'api.sessions.signed_cookies'
+elif SESSION_MODE == 'redis':
+    SESSION_ENGINE = 'api.sessions.cache'
+    SESSION_CACHE_ALIAS = 'sessions'
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'sessions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f'redis://{REDIS["host"]}:{REDIS.get("port", 6379)}',
+        },
+    }
+elif SESSION_MODE != 'db':
+    raise ValueError(f'Unknown SESSION_MODE {SESSION_MODE!r}, expected "db", "cookie" or "redis"')
+# Whether the "cookie" and "redis" modes look up sessions they do not know in the database. Turn
+# it off once SESSION_COOKIE_AGE has passed since the switch.
+SESSION_DB_FALLBACK = envbool('SESSION_DB_FALLBACK', '1')
+
+# Per-worker LRU cache in front of Redis for slug lookups. Set max_size to 0 to disable.
+LOCAL_SLUG_CACHE = {
+    'max_size': int(os.environ.get('LOCAL_SLUG_CACHE_SIZE', '10000')),
+    'ttl': float(os.environ.get('LOCAL_SLUG_CACHE_TTL', '30')),
+}
+
+# Redis-backed Bloom filter of existing slugs, see `manage.py rebuild_bloom_filter`.
+# The default size keeps false positives around 1% for up to 1.7M slugs.
+SLUG_BLOOM_FILTER = {
+    'size': int(os.environ.get('SLUG_BLOOM_FILTER_SIZE', 2 ** 24)),
+    'hashes': 7,
+}
+
+# Seconds to remember that a slug does not exist
+NEGATIVE_CACHE_TTL = 30
+
+# Slug -> URL entries in Redis, see api.cache.SlugCache. Entries expire `ttl` seconds after they
+# were cached or last refreshed by a hit (0 keeps them forever). With `buckets` > 0, entries
+# are fields of that many hashes, e.g. 2 ** 18 for ~400 entries each at 100M links, which needs
+# Redis 7.4 and hash-max-listpack-* settings large enough for Redis to keep them compact, see
+# docker-compose.yml.
+SLUG_CACHE = {
+    'ttl': int(os.environ.get('SLUG_CACHE_TTL', 7 * 86400)),
+    'buckets': int(os.environ.get('SLUG_CACHE_BUCKETS', '0')),
+}
+
+# Read-only slug lookup table built by `manage.py build_slug_snapshot`, shared by the worker
+# processes through the page cache and consulted before Redis. Rebuilt files are picked up within
+# `check_interval` seconds.
+SLUG_SNAPSHOT = {
+    'path': os.environ.get('SLUG_SNAPSHOT_PATH') or None,
+    'check_interval': 5,
+}
+
+# Concurrent cache misses of a slug load it from the DB once. With `local`, the requests of a
+# worker process wait for the one loading it. With `redis`, the first process takes a Redis lock
+# for `lock_ttl` seconds and the others poll the cache every `poll_interval` seconds for up to
+# `wait` seconds, after which they load the slug themselves.
+SLUG_SINGLE_FLIGHT = {
+    'local': True,
+    'redis': bool(int(os.environ.get('SLUG_SINGLE_FLIGHT_REDIS', '1'))),
+    'lock_ttl': 1.0,
+    'wait': 0.5,
+    'poll_interval': 0.01,
+}
+
+# Random slugs are a keyed permutation of a DB counter. Changing the key after slugs were
+# generated makes the generator repeat them.
+SLUG_PERMUTATION_KEY = SECRET_KEY
+SLUG_COUNTER_BLOCK_SIZE = 100
+
+# Pre-generated slugs leased out by /api/slug/, see `manage.py fill_slug_pool`
+SLUG_POOL = {
+    'size': 1000,
+    'batch_size': 100,
+    'lease_ttl': 600,
+}
+
+# POST /api/shorten/bulk/
+BULK_SHORTEN = {
+    'max_items': 10000,
+    # URLs inserted per INSERT query
+    'chunk_size': 500,
+}
+
+# /api/unshorten/bulk/
+BULK_UNSHORTEN_MAX_SLUGS = 1000
+
+# Rows read per query by /api/urls/export/
+URL_EXPORT_CHUNK_SIZE = 2000
+
+# Every worker process dumps its metrics into this directory for /metrics to add them up.
+# Unset, /metrics only reports the process serving it.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_DUMP_INTERVAL = 5
@@ -1,35 +1,38 @@
 import React, {useEffect, useState} from 'react';
 import axios from 'axios';
 
-const URLS_PER_PAGE = 50;
-
 export function UrlTable() {
     const [loading, setLoading] = useState(true);
     const [urlPages, setUrlPages] = useState<UrlPages>({});
     const [error, setError] = useState('');
     const [page, setPage] = useState(1);
-    const [totalPages, setTotalPages] = useState(1);
+    // The listing is paginated with cursors, so a page can only be reached from the previous one
+    const [pageLinks, setPageLinks] = useState<PageLinks>({1: '/api/urls/'});
 
-    async function fetchPage(pageNum: number): Promise<void> {
-        if (pageNum < 1 || pageNum > totalPages)
-            return;
+    async function fetchPage(pageNum: number): Promise<boolean> {
+        const link = pageLinks[pageNum];
+        if (!link)
+            return false;
 
         setLoading(true);
         try {
-            const response = await axios.get<PaginatedUrlList>(`/api/urls/?page=${pageNum}`);
-            setTotalPages(Math.ceil(response.data.count / URLS_PER_PAGE));
+            const response = await axios.get<PaginatedUrlList>(link);
             setUrlPages({...urlPages, [pageNum]: response.data.results});
+            if (response.data.next)
+                setPageLinks({...pageLinks, [pageNum + 1]: response.data.next});
+            return true;
         } catch (err) {
             console.error(err.data);
             setError('Failed to fetch your URLs due to an unexpected error.');
+            return false;
         } finally {
             setLoading(false);
         }
     }
 
     async function switchPage(pageNum: number) {
-        await fetchPage(pageNum);
-        setPage(pageNum);
+        if (await fetchPage(pageNum))
+            setPage(pageNum);
     }
 
     useEffect(() => {
@@ -64,10 +67,8 @@ export function UrlTable() {
 }
 
 interface PaginatedUrlList {
-    count: number;
     results: Url[];
-    previous: string;
-    next: string;
+    next: string | null;
 }
 
 interface Url {
@@ -78,3 +79,7 @@ interface Url {
 interface UrlPages {
     [pageNum: number]: Url[];
 }
+
+interface PageLinks {
+    [pageNum: number]: string;
+}
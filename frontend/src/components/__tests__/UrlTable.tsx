@@ -15,8 +15,6 @@ it('fetches URLs from /api/urls/ and renders them', async () => {
                     {slug: '123', url: 'https://example.com'},
                     {slug: '456', url: 'https://something.com'},
                 ],
-                count: 2,
-                previous: null,
                 next: null,
             }
         }
@@ -33,7 +31,7 @@ it('fetches URLs from /api/urls/ and renders them', async () => {
         screen.getByText('456');
         screen.getByText('https://example.com');
         screen.getByText('https://something.com');
-        expect(axiosMock.get).toBeCalledWith('/api/urls/?page=1');
+        expect(axiosMock.get).toBeCalledWith('/api/urls/');
     });
 });
 
@@ -43,9 +41,7 @@ it.skip('changes the page on "Next page" button click', async () => {
             {
                 data: {
                     results: Array.from(Array(50).keys()).map(i => ({url: 'https://example.com', slug: (i + 1).toString()})),
-                    count: 60,
-                    previous: null,
-                    next: null,
+                    next: 'http://localhost/api/urls/?cursor=abc',
                 }
             }
         )
@@ -53,8 +49,6 @@ it.skip('changes the page on "Next page" button click', async () => {
             {
                 data: {
                     results: Array.from(Array(10).keys()).map(i => ({url: 'https://example.com', slug: (i + 51).toString()})),
-                    count: 60,
-                    previous: null,
                     next: null,
                 }
             }